@@ -1,12 +1,19 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import { useNavigate } from "react-router-dom";
 import bg from "./assets/bg.jpg";
 
 const API_URL = "http://localhost:5000";
+const PAGE_SIZE = 50;
+const ORDER_FIELDS = "user_id,total,status";
 
 export default function OrdersDashboard() {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  // Conectado al feed de cambios: los deltas llegan solos, sin recargar el listado
+  const [live, setLive] = useState(false);
+  const liveRef = useRef(false);
 
   const [userId, setUserId] = useState("");
   const [total, setTotal] = useState("");
@@ -16,16 +23,23 @@ export default function OrdersDashboard() {
 
   const navigate = useNavigate();
 
-  const fetchOrders = async () => {
-    setLoading(true);
+  const fetchOrders = async (after = null) => {
+    if (after) setLoadingMore(true);
+    else setLoading(true);
     try {
-      const res = await fetch(`${API_URL}/api/orders`);
+      // Paginación por cursor: el listado no necesita los items de cada pedido
+      const params = new URLSearchParams({ limit: PAGE_SIZE, fields: ORDER_FIELDS });
+      if (after) params.set("after", after);
+      const res = await fetch(`${API_URL}/api/orders?${params}`);
       const data = await res.json();
-      setOrders(data.orders || []);
+      const page = data.orders || [];
+      setOrders((prev) => (after ? [...prev, ...page] : page));
+      setNextCursor(data.next_cursor || null);
     } catch (err) {
       console.error(err);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -36,7 +50,7 @@ export default function OrdersDashboard() {
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ status: "paid" }),
       });
-      fetchOrders();
+      if (!liveRef.current) fetchOrders();
     } catch (e) {
       console.error(e);
     }
@@ -57,7 +71,7 @@ export default function OrdersDashboard() {
       });
       setUserId("");
       setTotal("");
-      fetchOrders();
+      if (!liveRef.current) fetchOrders();
     } catch (e) {
       alert("Items JSON inválido. Revisa el campo Items.");
       console.error(e);
@@ -73,13 +87,53 @@ export default function OrdersDashboard() {
     fetchOrders();
   }, []);
 
+  // Feed SSE de cambios; EventSource reconecta solo y reenvía Last-Event-ID
+  useEffect(() => {
+    const source = new EventSource(`${API_URL}/api/orders/stream`);
+    const setConnected = (value) => {
+      liveRef.current = value;
+      setLive(value);
+    };
+    const parse = (handler) => (e) => handler(JSON.parse(e.data));
+
+    source.onopen = () => setConnected(true);
+    source.onerror = () => setConnected(false);
+    source.addEventListener(
+      "created",
+      parse((order) =>
+        setOrders((prev) =>
+          prev.some((o) => o._id === order._id) ? prev : [order, ...prev]
+        )
+      )
+    );
+    source.addEventListener(
+      "updated",
+      parse((changes) =>
+        setOrders((prev) =>
+          prev.map((o) => (o._id === changes._id ? { ...o, ...changes } : o))
+        )
+      )
+    );
+    source.addEventListener(
+      "deleted",
+      parse(({ _id }) => setOrders((prev) => prev.filter((o) => o._id !== _id)))
+    );
+    // Cambios perdidos que el servidor ya no conserva: se recarga el listado
+    source.addEventListener("reset", () => fetchOrders());
+
+    return () => source.close();
+  }, []);
+
+  // Los totales salen de las páginas ya cargadas; con más páginas pendientes son parciales
   const stats = useMemo(() => {
     const totalOrders = orders.length;
     const paid = orders.filter((o) => o.status === "paid").length;
     const pending = orders.filter((o) => o.status !== "paid").length;
     const totalValue = orders.reduce((sum, o) => sum + (Number(o.total) || 0), 0);
-    return { totalOrders, paid, pending, totalValue };
-  }, [orders]);
+    const partial = Boolean(nextCursor);
+    return { totalOrders, paid, pending, totalValue, partial };
+  }, [orders, nextCursor]);
+  const statLabel = (title) => (stats.partial ? `${title} (loaded)` : title);
 
   return (
     <div className="min-h-screen text-white">
@@ -104,12 +158,21 @@ export default function OrdersDashboard() {
             </div>
             <p className="mt-2 text-base sm:text-lg md:text-xl text-slate-300">
               API Gateway: <span className="font-semibold text-blue-400">{API_URL}</span>
+              <span
+                className={`ml-3 inline-flex items-center gap-1 rounded-full px-3 py-1 text-xs sm:text-sm font-semibold border ${
+                  live
+                    ? "bg-emerald-500/15 text-emerald-300 border-emerald-400/30"
+                    : "bg-slate-500/15 text-slate-400 border-slate-400/30"
+                }`}
+              >
+                ● {live ? "Live" : "Offline"}
+              </span>
             </p>
           </div>
 
           <div className="flex flex-col sm:flex-row gap-3 w-full md:w-auto">
             <button
-              onClick={fetchOrders}
+              onClick={() => fetchOrders()}
               className="inline-flex items-center justify-center rounded-xl bg-gradient-to-r from-blue-500 to-cyan-500 hover:from-blue-600 hover:to-cyan-600 px-6 py-3 text-base sm:text-lg font-semibold active:scale-[0.99] transition border border-blue-400/30 shadow-lg shadow-blue-500/20"
             >
               🔄 Refresh
@@ -126,11 +189,16 @@ export default function OrdersDashboard() {
 
         {/* Stats Cards mejoradas con azul */}
         <div className="mt-6 sm:mt-8 grid grid-cols-2 gap-3 sm:gap-5 lg:grid-cols-4">
-          <StatCard title="Total Orders" value={stats.totalOrders} icon="📦" color="blue" />
-          <StatCard title="Paid" value={stats.paid} icon="✅" color="emerald" />
-          <StatCard title="Pending" value={stats.pending} icon="⏳" color="amber" />
-          <StatCard title="Total Value" value={`$${stats.totalValue.toLocaleString()}`} icon="💰" color="cyan" />
+          <StatCard title={statLabel("Total Orders")} value={stats.totalOrders} icon="📦" color="blue" />
+          <StatCard title={statLabel("Paid")} value={stats.paid} icon="✅" color="emerald" />
+          <StatCard title={statLabel("Pending")} value={stats.pending} icon="⏳" color="amber" />
+          <StatCard title={statLabel("Total Value")} value={`$${stats.totalValue.toLocaleString()}`} icon="💰" color="cyan" />
         </div>
+        {stats.partial && (
+          <p className="mt-2 text-xs sm:text-sm text-slate-400">
+            Totals cover the {stats.totalOrders} orders loaded so far. Use "Load more" to include older orders.
+          </p>
+        )}
 
         {/* Main Content Grid */}
         <div className="mt-6 sm:mt-8 grid grid-cols-1 gap-4 sm:gap-6 lg:grid-cols-5">
@@ -266,12 +334,24 @@ export default function OrdersDashboard() {
                     </tbody>
                   </table>
                 </div>
+
+                {nextCursor && (
+                  <div className="mt-4 flex justify-center">
+                    <button
+                      onClick={() => fetchOrders(nextCursor)}
+                      disabled={loadingMore}
+                      className="rounded-xl bg-blue-500/20 hover:bg-blue-500/30 px-6 py-3 text-base font-semibold border border-blue-400/30 active:scale-[0.99] transition disabled:opacity-50"
+                    >
+                      {loadingMore ? "Loading..." : "⬇️ Load more"}
+                    </button>
+                  </div>
+                )}
               </div>
             )}
 
             <div className="mt-4 sm:mt-6 p-3 sm:p-4 rounded-xl bg-blue-500/10 border border-blue-400/30">
               <p className="text-xs sm:text-sm text-blue-200">
-                💡 <span className="font-semibold">Tip:</span> Future features: Filter by user_id, search functionality, and pagination.
+                💡 <span className="font-semibold">Tip:</span> Orders are loaded in pages of {PAGE_SIZE} and updated live from /api/orders/stream. Future features: Filter by user_id and search functionality.
               </p>
             </div>
           </div>
@@ -1,26 +1,236 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from datetime import datetime
 
+from cache import CacheEntry, ResponseCache, json_body
+from common.compression import enable_compression
+from common.deadline import DEADLINE_HEADER, set_deadline
+from common.json_provider import JSON_MIMETYPE, install_json_provider
+from common.metrics import instrument_flask
+from ratelimit import (EXEMPT_ROUTES, LONG_LIVED_ROUTES, SHED_RETRY_AFTER, STREAM_MAX_CLIENTS, RateLimiter,
+                       Rejected, client_id, load_shedder)
+from resilience import SERVICE_STATUS, Bulkhead, BulkheadFullError
+from singleflight import SingleFlight, flight_key
+from upstream import (COMPOSITE_PAYMENTS_LIMIT, PASSTHROUGH, PASSTHROUGH_CHUNK_BYTES, UpstreamClient,
+                      observe_overhead, request_deadline)
+
 app = Flask(__name__)
+# jsonify con orjson para las respuestas que genera el propio gateway
+install_json_provider(app)
+# gzip/brotli según Accept-Encoding; lo que ya llega comprimido del microservicio pasa tal cual
+enable_compression(app)
 
 # CORS (para desarrollo)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# /metrics con la latencia separada en tiempo upstream y overhead del gateway
+instrument_flask(app, on_request=observe_overhead)
+
+
+@app.before_request
+def start_deadline():
+    # Plazo de la petición: presupuesto de la ruta o X-Request-Timeout-Ms del cliente
+    set_deadline(request_deadline(request.endpoint, request.headers.get(DEADLINE_HEADER)))
+
+
+@app.teardown_request
+def clear_deadline(exc):
+    set_deadline(None)
+
+
+# Token bucket por cliente y ruta (429) y load shedding (503), antes de llamar a nadie
+rate_limiter = RateLimiter()
+
+
+@app.before_request
+def admit_request():
+    if request.endpoint is None or request.endpoint in EXEMPT_ROUTES or request.method == 'OPTIONS':
+        return None
+    try:
+        rate_limiter.check(client_id(request.headers, request.remote_addr), request.endpoint, request.method)
+        g.shed_slot = load_shedder.enter(track=request.endpoint not in LONG_LIVED_ROUTES)
+    except Rejected as e:
+        return jsonify(e.payload()), e.status_code, e.headers()
+    return None
+
+
+@app.after_request
+def release_after_stream(response):
+    # Un cuerpo en streaming (passthrough, NDJSON) sigue en curso tras volver de la vista:
+    # el hueco se libera cuando el servidor termina de enviarlo o el cliente corta
+    if response.is_streamed and g.pop('shed_slot', False):
+        response.call_on_close(load_shedder.leave)
+    return response
+
+
+@app.teardown_request
+def release_request(exc):
+    if g.pop('shed_slot', False):
+        load_shedder.leave()
+
+
 # Configuración de URLs de microservicios (en Docker deben apuntar a nombres de servicio)
 USER_SERVICE = os.getenv('USER_SERVICE_URL', 'http://user-service:5001')
 ORDER_SERVICE = os.getenv('ORDER_SERVICE_URL', 'http://order-service:5002')
 PAYMENT_SERVICE = os.getenv('PAYMENT_SERVICE_URL', 'http://payment-service:5003')
 
+# Clientes con pool keep-alive compartidos por todos los workers del proceso
+user_client = UpstreamClient('user-service', USER_SERVICE)
+order_client = UpstreamClient('order-service', ORDER_SERVICE)
+payment_client = UpstreamClient('payment-service', PAYMENT_SERVICE)
+UPSTREAMS = [user_client, order_client, payment_client]
+
+# Caché de lecturas de detalle (por proceso)
+response_cache = ResponseCache()
+
+# GETs idénticos concurrentes comparten una sola llamada upstream
+singleflight = SingleFlight()
+
+# Hilos para las llamadas en paralelo de las vistas compuestas
+COMPOSITE_WORKERS = int(os.getenv('GATEWAY_COMPOSITE_WORKERS', '16'))
+composite_executor = ThreadPoolExecutor(max_workers=COMPOSITE_WORKERS, thread_name_prefix='composite')
+
+# Suscripciones SSE simultáneas: cada una ocupa un hilo del worker mientras dura
+stream_slots = Bulkhead('orders_stream', max_concurrent=STREAM_MAX_CLIENTS, wait=0)
+
+
+def upstream_entry(response):
+    """Respuesta del microservicio con su cuerpo JSON sin parsear (ver ``cache.json_body``)."""
+    return CacheEntry(json_body(response.content, response.headers.get('Content-Type')),
+                      response.status_code, response.headers.get('ETag'))
 
-def safe_json(response):
-    """Intenta parsear JSON, si no, devuelve texto crudo."""
-    try:
-        return response.json()
-    except Exception:
-        return {"raw": response.text}
+
+def body_response(body, status_code):
+    """Response con bytes JSON ya serializados."""
+    return Response(body, status=status_code, mimetype=JSON_MIMETYPE)
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+SSE_MIMETYPE = 'text/event-stream'
+# Cabeceras del microservicio que se conservan al reenviar un stream
+STREAM_HEADERS = ('Cache-Control', 'X-Accel-Buffering')
+# Altas idempotentes: la clave va al microservicio y vuelve si la respuesta es repetida
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+WRITE_HEADERS = ('Idempotent-Replayed', 'Retry-After')
+# Cabeceras que el modo passthrough copia tal cual (el cuerpo no se toca)
+PASSTHROUGH_HEADERS = ('Content-Length', 'Content-Encoding', 'ETag', 'Vary') + STREAM_HEADERS + WRITE_HEADERS
+
+
+def wants_stream():
+    """El cliente pide exportación NDJSON (?stream=1 o Accept: application/x-ndjson)."""
+    return (request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+            or NDJSON_MIMETYPE in request.headers.get('Accept', ''))
+
+
+def stream_upstream(client, path, route, mimetype=NDJSON_MIMETYPE, headers=None):
+    """Reenvía una respuesta en streaming (NDJSON, SSE) trozo a trozo, sin acumularla en memoria."""
+    response = client.get(path, route=route, params=request.args,
+                          headers=dict(headers or {}, Accept=mimetype), stream=True)
+    proxied = Response(
+        response.iter_content(chunk_size=None),
+        status=response.status_code,
+        content_type=response.headers.get('Content-Type', mimetype)
+    )
+    for header in STREAM_HEADERS + ('Retry-After',):
+        if header in response.headers:
+            proxied.headers[header] = response.headers[header]
+    # Devuelve la conexión al pool cuando termina (o se corta) la descarga
+    proxied.call_on_close(response.close)
+    return proxied
+
+
+def idempotency_headers():
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    return {IDEMPOTENCY_HEADER: key} if key else None
+
+
+def raw_response(response, headers=()):
+    """Reenvía el cuerpo del microservicio byte a byte, sin parsearlo ni volver a serializarlo."""
+    proxied = body_response(json_body(response.content, response.headers.get('Content-Type')),
+                            response.status_code)
+    for header in headers:
+        if header in response.headers:
+            proxied.headers[header] = response.headers[header]
+    return proxied
+
+
+def passthrough(response):
+    """Reenvía estado, cabeceras y cuerpo del microservicio sin parsearlo ni descomprimirlo.
+
+    El cuerpo sale trozo a trozo, así que el coste del gateway no depende
+    de su tamaño. Si la lectura falla a mitad ya no se puede cambiar el
+    código HTTP y la respuesta se corta.
+    """
+    proxied = Response(response.raw.stream(PASSTHROUGH_CHUNK_BYTES, decode_content=False),
+                       status=response.status_code, content_type=response.headers.get('Content-Type'))
+    for header in PASSTHROUGH_HEADERS:
+        if header in response.headers:
+            proxied.headers[header] = response.headers[header]
+    proxied.call_on_close(response.close)
+    return proxied
+
+
+def proxy(client, method, path, route, **kwargs):
+    """Reenvía la llamada al microservicio.
+
+    En modo passthrough el cuerpo pasa sin leerse (con el Accept-Encoding
+    del cliente, para poder reenviarlo comprimido tal cual); si no, se lee
+    entero y los GET se comparten con las llamadas idénticas en curso.
+    """
+    if PASSTHROUGH:
+        headers = dict(kwargs.pop('headers', None) or {},
+                       **{'Accept-Encoding': request.headers.get('Accept-Encoding', 'identity')})
+        return passthrough(client.open(method, path, route=route, headers=headers, **kwargs))
+    if method == 'GET':
+        response = shared_get(client, path, route, params=kwargs.get('params'))
+    else:
+        response = client.request(method, path, route=route, **kwargs)
+    return raw_response(response, WRITE_HEADERS)
+
+
+def shared_get(client, path, route, params=None, headers=None):
+    """GET al microservicio compartido con las peticiones idénticas en curso."""
+    key = flight_key(route, path, params, headers)
+    return singleflight.do(key, route, lambda: client.get(path, route=route, params=params, headers=headers))
+
+
+def shared_fetch(client, path, route, params=None):
+    """(CacheEntry, None) de un GET compartido, como ``cached_fetch``."""
+    return upstream_entry(shared_get(client, path, route, params=params)), None
+
+
+def cached_fetch(client, path, route, resource_id):
+    """(CacheEntry, X-Cache) de un GET de detalle, revalidado con If-None-Match si caducó."""
+    key = response_cache.key(route, resource_id)
+    entry = response_cache.lookup(key)
+    if entry is not None and entry.fresh:
+        return entry, 'HIT'
+
+    headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else None
+    response = shared_get(client, path, route, headers=headers)
+    if response.status_code == 304 and entry is not None:
+        response_cache.refresh(key, route)
+        return entry, 'REVALIDATED'
+
+    fetched = upstream_entry(response)
+    if response.status_code == 200:
+        response_cache.store(key, route, fetched)
+    return fetched, 'MISS'
+
+
+def cached_get(client, path, route, resource_id):
+    """GET de detalle servido desde la caché."""
+    return cache_response(*cached_fetch(client, path, route, resource_id))
+
+
+def cache_response(entry, cache_state):
+    response = body_response(entry.body, entry.status)
+    response.headers['X-Cache'] = cache_state
+    return response
 
 
 @app.route('/health', methods=['GET'])
@@ -34,24 +244,20 @@ def health():
 
 @app.route('/status', methods=['GET'])
 def status():
-    services_status = {}
-
-    for name, url in [
-        ('user-service', USER_SERVICE),
-        ('order-service', ORDER_SERVICE),
-        ('payment-service', PAYMENT_SERVICE),
-    ]:
-        try:
-            r = requests.get(f'{url}/health', timeout=2)
-            services_status[name] = 'online' if r.status_code == 200 else 'degraded'
-        except Exception:
-            services_status[name] = 'offline'
-
+    # El estado de cada servicio sale de su circuit breaker, sin sondear /health
     return jsonify({
         'service': 'api-gateway',
         'status': 'operational',
         'timestamp': datetime.utcnow().isoformat(),
-        'services': services_status,
+        'services': {client.name: SERVICE_STATUS[client.breaker.state] for client in UPSTREAMS},
+        'breakers': {client.name: client.breaker.stats() for client in UPSTREAMS},
+        'bulkheads': {client.name: client.bulkhead.stats() for client in UPSTREAMS},
+        'pools': {client.name: client.stats() for client in UPSTREAMS},
+        'cache': response_cache.stats(),
+        'singleflight': singleflight.stats(),
+        'streams': stream_slots.stats(),
+        'ratelimit': rate_limiter.stats(),
+        'shedding': load_shedder.stats(),
         'version': '1.0.0'
     }), 200
 
@@ -61,12 +267,24 @@ def status():
 @app.route('/api/users', methods=['GET', 'POST'])
 def users():
     try:
+        if request.method == 'GET' and wants_stream():
+            return stream_upstream(user_client, '/users', 'users')
         if request.method == 'GET':
-            response = requests.get(f'{USER_SERVICE}/users')
-        else:
-            response = requests.post(f'{USER_SERVICE}/users', json=request.json)
+            return proxy(user_client, 'GET', '/users', 'users', params=request.args)
+        response = proxy(user_client, 'POST', '/users', 'users', json=request.json)
+        # Una lectura posterior no debe unirse a una llamada anterior a la escritura
+        singleflight.forget('users')
+        return response
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'User service unavailable', 'message': str(e)}), 503
+
 
-        return jsonify(safe_json(response)), response.status_code
+@app.route('/api/users/bulk', methods=['POST'])
+def users_bulk():
+    try:
+        response = proxy(user_client, 'POST', '/users/bulk', 'users_bulk', json=request.json)
+        singleflight.forget('users')
+        return response
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'User service unavailable', 'message': str(e)}), 503
 
@@ -74,8 +292,7 @@ def users():
 @app.route('/api/users/<user_id>', methods=['GET'])
 def user_detail(user_id):
     try:
-        response = requests.get(f'{USER_SERVICE}/users/{user_id}')
-        return jsonify(safe_json(response)), response.status_code
+        return cached_get(user_client, f'/users/{user_id}', 'user_detail', user_id)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'User service unavailable', 'message': str(e)}), 503
 
@@ -85,30 +302,136 @@ def user_detail(user_id):
 @app.route('/api/orders', methods=['GET', 'POST'])
 def orders():
     try:
+        if request.method == 'GET' and wants_stream():
+            return stream_upstream(order_client, '/orders', 'orders')
         if request.method == 'GET':
-            response = requests.get(f'{ORDER_SERVICE}/orders')
-        else:
-            response = requests.post(f'{ORDER_SERVICE}/orders', json=request.json)
+            return proxy(order_client, 'GET', '/orders', 'orders', params=request.args)
+        response = proxy(order_client, 'POST', '/orders', 'orders', json=request.json,
+                         headers=idempotency_headers())
+        # Una lectura posterior no debe unirse a una llamada anterior a la escritura
+        singleflight.forget('orders')
+        return response
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Order service unavailable', 'message': str(e)}), 503
+
+
+@app.route('/api/orders/bulk', methods=['POST'])
+def orders_bulk():
+    try:
+        response = proxy(order_client, 'POST', '/orders/bulk', 'orders_bulk', json=request.json)
+        singleflight.forget('orders')
+        return response
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Order service unavailable', 'message': str(e)}), 503
+
 
-        return jsonify(safe_json(response)), response.status_code
+@app.route('/api/orders/stream', methods=['GET'])
+def orders_stream():
+    try:
+        stream_slots.try_acquire()
+    except BulkheadFullError as e:
+        return jsonify({'error': 'Too many stream clients', 'message': str(e)}), 503, \
+            {'Retry-After': str(SHED_RETRY_AFTER)}
+    try:
+        # Last-Event-ID permite al microservicio reenviar los cambios perdidos al reconectar
+        last_event_id = request.headers.get('Last-Event-ID')
+        headers = {'Last-Event-ID': last_event_id} if last_event_id else None
+        response = stream_upstream(order_client, '/orders/stream', 'orders_stream', SSE_MIMETYPE, headers)
     except requests.exceptions.RequestException as e:
+        stream_slots.release()
         return jsonify({'error': 'Order service unavailable', 'message': str(e)}), 503
+    except Exception:
+        stream_slots.release()
+        raise
+    # El hueco se libera cuando el cliente se desconecta
+    response.call_on_close(stream_slots.release)
+    return response
 
 
 @app.route('/api/orders/<order_id>', methods=['GET'])
 def order_detail(order_id):
     try:
-        response = requests.get(f'{ORDER_SERVICE}/orders/{order_id}')
-        return jsonify(safe_json(response)), response.status_code
+        return cached_get(order_client, f'/orders/{order_id}', 'order_detail', order_id)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Order service unavailable', 'message': str(e)}), 503
 
 
+def submit(fn, *args):
+    """Lanza ``fn`` en el pool con el contexto de la petición (tiempo upstream de /metrics)."""
+    return composite_executor.submit(copy_context().run, fn, *args)
+
+
+def part_error(name, future):
+    """(datos, error) de una parte opcional de la vista compuesta."""
+    try:
+        entry, _ = future.result()
+    except requests.exceptions.RequestException as e:
+        return None, {'error': f'{name} service unavailable', 'message': str(e), 'status': 503}
+    if entry.status != 200:
+        return None, {'error': entry.payload.get('error', f'{name} service error'), 'status': entry.status}
+    return entry.payload, None
+
+
+def truncated_payments(payload):
+    """Error de la parte de pagos si quedan más de los que trae la vista compuesta."""
+    cursor = payload.get('next_cursor') if payload else None
+    if cursor is None:
+        return None
+    return {'error': 'Payment list truncated',
+            'message': f'Order has more than {COMPOSITE_PAYMENTS_LIMIT} payments',
+            'next_cursor': cursor}
+
+
+@app.route('/api/orders/<order_id>/full', methods=['GET'])
+def order_full(order_id):
+    """Pedido con su usuario y sus pagos en una sola llamada.
+
+    Pedido y pagos se piden a la vez; el usuario en cuanto se conoce su
+    user_id. Si falla el usuario o los pagos se devuelve el pedido con
+    ``partial: true`` y el motivo en ``errors``; también si el pedido tiene
+    más pagos que ``COMPOSITE_PAYMENTS_LIMIT`` (con el ``next_cursor``).
+    """
+    payments = submit(lambda: shared_fetch(payment_client, '/payments', 'payments',
+                                           {'order_ref': order_id, 'limit': COMPOSITE_PAYMENTS_LIMIT}))
+    try:
+        entry, _ = cached_fetch(order_client, f'/orders/{order_id}', 'order_detail', order_id)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Order service unavailable', 'message': str(e)}), 503
+    if entry.status != 200:
+        return body_response(entry.body, entry.status)
+
+    order = entry.payload.get('order', {})
+    user_id = order.get('user_id')
+    errors = {}
+    user = None
+    if user_id is not None:
+        user_payload, errors['user'] = part_error('User', submit(
+            cached_fetch, user_client, f'/users/{user_id}', 'user_detail', user_id))
+        user = user_payload.get('user') if user_payload else None
+    payments_payload, errors['payments'] = part_error('Payment', payments)
+    errors['payments'] = errors['payments'] or truncated_payments(payments_payload)
+    errors = {part: error for part, error in errors.items() if error}
+
+    return jsonify({
+        'success': True,
+        'order': order,
+        'user': user,
+        'payments': payments_payload.get('payments', []) if payments_payload else [],
+        'partial': bool(errors),
+        'errors': errors
+    }), 200
+
+
 @app.route('/api/orders/<order_id>/status', methods=['PUT'])
 def order_status(order_id):
     try:
-        response = requests.put(f'{ORDER_SERVICE}/orders/{order_id}/status', json=request.json)
-        return jsonify(safe_json(response)), response.status_code
+        # Se invalida antes y después para no dejar en caché una lectura concurrente antigua
+        detail_key = response_cache.key('order_detail', order_id)
+        response_cache.invalidate(detail_key)
+        response = proxy(order_client, 'PUT', f'/orders/{order_id}/status', 'order_status', json=request.json)
+        response_cache.invalidate(detail_key)
+        singleflight.forget('orders', 'order_detail')
+        return response
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Order service unavailable', 'message': str(e)}), 503
 
@@ -118,12 +441,25 @@ def order_status(order_id):
 @app.route('/api/payments', methods=['GET', 'POST'])
 def payments():
     try:
+        if request.method == 'GET' and wants_stream():
+            return stream_upstream(payment_client, '/payments', 'payments')
         if request.method == 'GET':
-            response = requests.get(f'{PAYMENT_SERVICE}/payments')
-        else:
-            response = requests.post(f'{PAYMENT_SERVICE}/payments', json=request.json)
+            return proxy(payment_client, 'GET', '/payments', 'payments', params=request.args)
+        response = proxy(payment_client, 'POST', '/payments', 'payments', json=request.json,
+                         headers=idempotency_headers())
+        # Una lectura posterior no debe unirse a una llamada anterior a la escritura
+        singleflight.forget('payments')
+        return response
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Payment service unavailable', 'message': str(e)}), 503
+
 
-        return jsonify(safe_json(response)), response.status_code
+@app.route('/api/payments/bulk', methods=['POST'])
+def payments_bulk():
+    try:
+        response = proxy(payment_client, 'POST', '/payments/bulk', 'payments_bulk', json=request.json)
+        singleflight.forget('payments')
+        return response
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Payment service unavailable', 'message': str(e)}), 503
 
@@ -131,8 +467,21 @@ def payments():
 @app.route('/api/payments/<payment_id>', methods=['GET'])
 def payment_detail(payment_id):
     try:
-        response = requests.get(f'{PAYMENT_SERVICE}/payments/{payment_id}')
-        return jsonify(safe_json(response)), response.status_code
+        return cached_get(payment_client, f'/payments/{payment_id}', 'payment_detail', payment_id)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Payment service unavailable', 'message': str(e)}), 503
+
+
+@app.route('/api/payments/<payment_id>/status', methods=['PUT'])
+def payment_status(payment_id):
+    try:
+        detail_key = response_cache.key('payment_detail', payment_id)
+        response_cache.invalidate(detail_key)
+        response = proxy(payment_client, 'PUT', f'/payments/{payment_id}/status', 'payment_status',
+                         json=request.json)
+        response_cache.invalidate(detail_key)
+        singleflight.forget('payments', 'payment_detail')
+        return response
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Payment service unavailable', 'message': str(e)}), 503
 
@@ -146,8 +495,11 @@ def root():
         'endpoints': {
             'health': '/health',
             'status': '/status',
+            'metrics': '/metrics',
             'users': '/api/users',
             'orders': '/api/orders',
+            'orders_stream': '/api/orders/stream',
+            'order_full': '/api/orders/<id>/full',
             'payments': '/api/payments'
         },
         'architecture': 'Microservices',
@@ -0,0 +1,858 @@
+"""API Gateway en modo asíncrono (asyncio + aiohttp).
+
+Mantiene la misma tabla de rutas y los mismos sobres de error que
+``app.py``, pero reenvía las peticiones sin bloquear un worker por cada
+llamada lenta.
+
+Uso:
+    python async_app.py            # escucha en GATEWAY_PORT (5000 por defecto)
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+
+from cache import CacheEntry, ResponseCache, json_body
+from common.json_provider import JSON_MIMETYPE, dumps_bytes, loads
+from common.metrics import (CONTENT_TYPE, HTTP_IN_FLIGHT, METRICS_ENABLED, metrics_body,
+                            record_request, start_upstream_timer)
+from common.compression import StreamCompressor, choose_encoding, should_compress, weaken_etag
+from common.deadline import DEADLINE_HEADER, remaining, set_deadline
+from ratelimit import (EXEMPT_ROUTES, LONG_LIVED_ROUTES, SHED_RETRY_AFTER, STREAM_MAX_CLIENTS, RateLimiter,
+                       Rejected, client_id, load_shedder)
+from resilience import (SERVICE_STATUS, Bulkhead, BulkheadFullError, CircuitBreaker, CircuitOpenError,
+                        UpstreamRejected)
+from retry import RETRY_STATUSES, RetryPolicy
+from singleflight import AsyncSingleFlight, flight_key
+from upstream import (COMPOSITE_PAYMENTS_LIMIT, CONNECT_TIMEOUT, PASSTHROUGH, PASSTHROUGH_CHUNK_BYTES, POOL_SIZE,
+                      READ_TIMEOUT, ROUTE_BUDGETS, observe_overhead, observe_upstream, request_deadline)
+
+USER_SERVICE = os.getenv('USER_SERVICE_URL', 'http://user-service:5001')
+ORDER_SERVICE = os.getenv('ORDER_SERVICE_URL', 'http://order-service:5002')
+PAYMENT_SERVICE = os.getenv('PAYMENT_SERVICE_URL', 'http://payment-service:5003')
+GATEWAY_PORT = int(os.getenv('GATEWAY_PORT', '5000'))
+NDJSON_MIMETYPE = 'application/x-ndjson'
+SSE_MIMETYPE = 'text/event-stream'
+# Cabeceras del microservicio que se conservan al reenviar un stream
+STREAM_HEADERS = ('Cache-Control', 'X-Accel-Buffering')
+# Altas idempotentes: la clave va al microservicio y vuelve si la respuesta es repetida
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+WRITE_HEADERS = ('Idempotent-Replayed', 'Retry-After')
+# Cabeceras que el modo passthrough copia tal cual (el cuerpo no se toca)
+PASSTHROUGH_HEADERS = ('Content-Length', 'Content-Encoding', 'ETag', 'Vary') + STREAM_HEADERS + WRITE_HEADERS
+
+# Fallos de conexión, timeouts y rechazos del breaker/bulkhead acaban en el mismo 503
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, UpstreamRejected)
+
+
+def upstream_entry(status, body, headers):
+    """Respuesta del microservicio con su cuerpo JSON sin parsear (ver ``cache.json_body``)."""
+    return CacheEntry(json_body(body, headers.get('Content-Type')), status, headers.get('ETag'))
+
+
+class AsyncUpstreamClient:
+    """Equivalente asíncrono de ``upstream.UpstreamClient``."""
+
+    def __init__(self, name, base_url, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 route_budgets=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.route_budgets = ROUTE_BUDGETS if route_budgets is None else route_budgets
+        self.session = None
+        self.breaker = CircuitBreaker(name)
+        self.bulkhead = Bulkhead(name)
+        self.retry = RetryPolicy(name)
+
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._opened = 0
+        self._reused = 0
+        self._queued = 0
+
+    async def start(self):
+        """Crea la sesión; debe llamarse con el event loop ya en marcha."""
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_created)
+        trace.on_connection_reuseconn.append(self._on_connection_reused)
+        trace.on_connection_queued_start.append(self._on_connection_queued)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            trace_configs=[trace]
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _on_connection_created(self, session, ctx, params):
+        self._opened += 1
+
+    async def _on_connection_reused(self, session, ctx, params):
+        self._reused += 1
+
+    async def _on_connection_queued(self, session, ctx, params):
+        self._queued += 1
+
+    def timeout_for(self, route=None, total=None):
+        return aiohttp.ClientTimeout(
+            total=total,
+            sock_connect=self.connect_timeout,
+            sock_read=self.route_budgets.get(route, self.read_timeout)
+        )
+
+    def slow_call_seconds(self, route=None):
+        budget = self.route_budgets.get(route, self.read_timeout)
+        return self.breaker.slow_call_seconds * max(1.0, budget / self.read_timeout)
+
+    async def request(self, method, path, route=None, timeout=None, **kwargs):
+        """Devuelve (status, body, headers); propaga UPSTREAM_ERRORS al llamador.
+
+        Mismos reintentos, coberturas y plazo que ``upstream.UpstreamClient``.
+        """
+        if method != 'GET':
+            return await self._attempt(method, path, route, timeout, **kwargs)
+
+        self.retry.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                result = await self._attempt(method, path, route, timeout, **kwargs)
+            except UpstreamRejected:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = 'timeout' if isinstance(e, asyncio.TimeoutError) else 'connection'
+                delay = self.retry.retry_delay(route, attempt, reason, remaining())
+                if delay is None:
+                    raise
+            else:
+                status = result[0]
+                if status not in RETRY_STATUSES:
+                    return result
+                delay = self.retry.retry_delay(route, attempt, f'status_{status}', remaining())
+                if delay is None:
+                    return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @asynccontextmanager
+    async def open(self, method, path, route=None, timeout=None, **kwargs):
+        """Como ``request`` (reintentos y plazo, sin cobertura) pero sin leer el cuerpo.
+
+        La respuesta llega sin descomprimir: el cuerpo se puede reenviar
+        tal cual con su Content-Encoding.
+        """
+        if method == 'GET':
+            self.retry.budget.deposit()
+        attempt = 1
+        while True:
+            entered = False
+            try:
+                call_timeout, call_kwargs = self._with_deadline(timeout, kwargs)
+                async with self.stream(method, path, route=route, timeout=call_timeout,
+                                       auto_decompress=False, **call_kwargs) as response:
+                    delay = None
+                    if method == 'GET' and response.status in RETRY_STATUSES:
+                        delay = self.retry.retry_delay(route, attempt, f'status_{response.status}', remaining())
+                    if delay is None:
+                        entered = True
+                        yield response
+                        return
+            except UpstreamRejected:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Un fallo leyendo el cuerpo ya entregado no se puede reintentar
+                if entered or method != 'GET':
+                    raise
+                reason = 'timeout' if isinstance(e, asyncio.TimeoutError) else 'connection'
+                delay = self.retry.retry_delay(route, attempt, reason, remaining())
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _with_deadline(self, timeout, kwargs):
+        """(timeout, kwargs) recortados al plazo de la petición, con la cabecera de lo que queda."""
+        left = remaining()
+        if left is None:
+            return timeout, kwargs
+        if left <= 0:
+            raise asyncio.TimeoutError('Request deadline exceeded')
+        timeout = left if timeout is None else min(timeout, left)
+        return timeout, dict(kwargs, headers=dict(kwargs.get('headers') or {},
+                                                  **{DEADLINE_HEADER: str(int(left * 1000))}))
+
+    async def _attempt(self, method, path, route, timeout, **kwargs):
+        timeout, kwargs = self._with_deadline(timeout, kwargs)
+
+        hedge_after = self.retry.hedge_delay(route) if method == 'GET' else None
+        if hedge_after is None:
+            return await self._send(method, path, route, timeout, **kwargs)
+        return await self._hedged(hedge_after, method, path, route, timeout, **kwargs)
+
+    async def _hedged(self, hedge_after, method, path, route, timeout, **kwargs):
+        """Si no hay respuesta en ``hedge_after`` s lanza otra llamada y usa la primera buena."""
+        primary = asyncio.ensure_future(self._send(method, path, route, timeout, **kwargs))
+        names = {primary: 'primary'}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+            if done or not self.retry.allow_hedge(remaining()):
+                return await primary
+
+            hedge = asyncio.ensure_future(self._send(method, path, route, timeout, **kwargs))
+            names[hedge] = 'hedge'
+            pending = set(names)
+            fallback, failure = None, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        failure = failure or task.exception()
+                        continue
+                    if task.result()[0] < 500:
+                        self.retry.hedge_won(route, names[task])
+                        return task.result()
+                    fallback = task.result()
+            if fallback is not None:
+                return fallback
+            raise failure
+        finally:
+            # La llamada perdedora se cancela (libera su conexión y su hueco del bulkhead)
+            for task in names:
+                if not task.done():
+                    task.cancel()
+
+    async def _send(self, method, path, route, timeout, **kwargs):
+        async with self.stream(method, path, route=route, timeout=timeout, **kwargs) as response:
+            return response.status, await response.read(), response.headers
+
+    @asynccontextmanager
+    async def stream(self, method, path, route=None, timeout=None, hold_bulkhead=True, **kwargs):
+        """Entrega la respuesta sin leer el cuerpo, tras pasar breaker y bulkhead.
+
+        Con el breaker abierto o el bulkhead lleno lanza UpstreamRejected sin
+        llegar a contactar el servicio. Con ``hold_bulkhead=False`` el hueco se
+        libera al recibir las cabeceras (streams de larga duración como SSE).
+        """
+        self.bulkhead.try_acquire()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.bulkhead.release()
+            raise
+        held = True
+        self._requests += 1
+        self._in_flight += 1
+        started = time.monotonic()
+        recorded = False
+        try:
+            async with self.session.request(
+                method,
+                f'{self.base_url}{path}',
+                timeout=self.timeout_for(route, timeout),
+                **kwargs
+            ) as response:
+                elapsed = time.monotonic() - started
+                self.breaker.record(response.status < 500, elapsed, self.slow_call_seconds(route))
+                observe_upstream(self.name, route, elapsed, response.status >= 500)
+                recorded = True
+                if not hold_bulkhead:
+                    held = False
+                    self.bulkhead.release()
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._errors += 1
+            if not recorded:
+                elapsed = time.monotonic() - started
+                self.breaker.record(False, elapsed, self.slow_call_seconds(route))
+                observe_upstream(self.name, route, elapsed, True)
+            raise
+        finally:
+            self._in_flight -= 1
+            if held:
+                self.bulkhead.release()
+
+    def stats(self):
+        return {
+            'pool_size': self.pool_size,
+            'requests': self._requests,
+            'errors': self._errors,
+            'in_flight': self._in_flight,
+            'connections_opened': self._opened,
+            'connections_reused': self._reused,
+            'checkouts_queued': self._queued,
+            'timeouts': {
+                'connect': self.connect_timeout,
+                'read': self.read_timeout,
+                'routes': self.route_budgets
+            },
+            'retries': self.retry.stats()
+        }
+
+
+user_client = AsyncUpstreamClient('user-service', USER_SERVICE)
+order_client = AsyncUpstreamClient('order-service', ORDER_SERVICE)
+payment_client = AsyncUpstreamClient('payment-service', PAYMENT_SERVICE)
+UPSTREAMS = [user_client, order_client, payment_client]
+
+response_cache = ResponseCache()
+singleflight = AsyncSingleFlight()
+rate_limiter = RateLimiter()
+# Suscripciones SSE simultáneas (mismo tope que en app.py)
+stream_slots = Bulkhead('orders_stream', max_concurrent=STREAM_MAX_CLIENTS, wait=0)
+
+UNAVAILABLE = {
+    user_client: 'User service unavailable',
+    order_client: 'Order service unavailable',
+    payment_client: 'Payment service unavailable',
+}
+
+
+def body_response(body, status):
+    """Response con bytes JSON ya serializados."""
+    return web.Response(body=body, status=status, content_type=JSON_MIMETYPE)
+
+
+def json_response(payload, status=200):
+    return body_response(dumps_bytes(payload), status)
+
+
+def start_compression(request, response, length=None):
+    """Compresor para ``response`` (aún sin preparar) según Accept-Encoding, o None.
+
+    Ajusta las cabeceras: Content-Encoding, Vary, sin Content-Length y ETag débil.
+    """
+    if request.method == 'HEAD' or not should_compress(
+            response.status, response.content_type, response.headers.get('Content-Encoding'), length):
+        return None
+    vary = response.headers.get('Vary')
+    if not vary:
+        response.headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        response.headers['Vary'] = f'{vary}, Accept-Encoding'
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return None
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    if 'ETag' in response.headers:
+        response.headers['ETag'] = weaken_etag(response.headers['ETag'])
+    return StreamCompressor(encoding)
+
+
+async def read_json(request):
+    """Equivalente a ``request.json`` de Flask: None si no hay cuerpo válido."""
+    if not request.can_read_body:
+        return None
+    try:
+        return await request.json(loads=loads)
+    except Exception:
+        return None
+
+
+def wants_stream(request):
+    """El cliente pide exportación NDJSON (?stream=1 o Accept: application/x-ndjson)."""
+    return (request.query.get('stream', '').lower() in ('1', 'true', 'yes')
+            or NDJSON_MIMETYPE in request.headers.get('Accept', ''))
+
+
+async def stream_proxy(request, client, path, route, mimetype=NDJSON_MIMETYPE, headers=None,
+                       hold_bulkhead=True):
+    """Reenvía una respuesta en streaming (NDJSON, SSE) trozo a trozo, sin acumularla en memoria."""
+    response = None
+    try:
+        async with client.stream('GET', path, route=route, params=request.query,
+                                 headers=dict(headers or {}, Accept=mimetype),
+                                 hold_bulkhead=hold_bulkhead) as upstream:
+            response = web.StreamResponse(status=upstream.status)
+            response.content_type = upstream.content_type
+            for header in STREAM_HEADERS + ('Retry-After',):
+                if header in upstream.headers:
+                    response.headers[header] = upstream.headers[header]
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            compressor = start_compression(request, response)
+            await response.prepare(request)
+            async for chunk in upstream.content.iter_any():
+                await response.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                await response.write(compressor.finish())
+            await response.write_eof()
+            return response
+    except UPSTREAM_ERRORS as e:
+        if response is not None and response.prepared:
+            # Las cabeceras ya salieron: solo se puede cortar la respuesta
+            return response
+        return json_response({'error': UNAVAILABLE[client], 'message': str(e) or repr(e)}, 503)
+
+
+async def shared_request(client, path, route, params=None, headers=None):
+    """GET al microservicio compartido con las peticiones idénticas en curso."""
+    key = flight_key(route, path, params, headers)
+    return await singleflight.do(
+        key, route, lambda: client.request('GET', path, route=route, params=params, headers=headers))
+
+
+async def proxy(request, client, path, route, streamable=False):
+    """Reenvía la petición y aplica el mismo sobre de error 503 que app.py."""
+    if streamable and request.method == 'GET' and wants_stream(request):
+        return await stream_proxy(request, client, path, route)
+
+    if PASSTHROUGH:
+        return await passthrough_proxy(request, client, path, route)
+    try:
+        if request.method == 'GET':
+            # Paginación y filtros (?limit, ?after, ...) pasan tal cual al servicio
+            status, body, upstream_headers = await shared_request(client, path, route,
+                                                                  params=request.query or None)
+            return body_response(json_body(body, upstream_headers.get('Content-Type')), status)
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        status, body, upstream_headers = await client.request(
+            request.method, path, route=route, json=await read_json(request),
+            headers={IDEMPOTENCY_HEADER: key} if key else None)
+        response = body_response(json_body(body, upstream_headers.get('Content-Type')), status)
+        for header in WRITE_HEADERS:
+            if header in upstream_headers:
+                response.headers[header] = upstream_headers[header]
+        return response
+    except UPSTREAM_ERRORS as e:
+        return json_response({'error': UNAVAILABLE[client], 'message': str(e) or repr(e)}, 503)
+
+
+async def passthrough_proxy(request, client, path, route):
+    """Reenvía estado, cabeceras y cuerpo del microservicio sin parsearlo ni descomprimirlo.
+
+    La llamada lleva el Accept-Encoding del cliente, así que un cuerpo
+    comprimido pasa tal cual. Si la lectura falla a mitad ya no se puede
+    cambiar el código HTTP y la respuesta se corta.
+    """
+    headers = {'Accept-Encoding': request.headers.get('Accept-Encoding', 'identity')}
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key:
+        headers[IDEMPOTENCY_HEADER] = key
+    body = {} if request.method == 'GET' else {'json': await read_json(request)}
+    response = None
+    try:
+        async with client.open(request.method, path, route=route, params=request.query or None,
+                               headers=headers, **body) as upstream:
+            response = web.StreamResponse(status=upstream.status)
+            for header in ('Content-Type',) + PASSTHROUGH_HEADERS:
+                if header in upstream.headers:
+                    response.headers[header] = upstream.headers[header]
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            compressor = start_compression(request, response, upstream.content_length)
+            await response.prepare(request)
+            async for chunk in upstream.content.iter_chunked(PASSTHROUGH_CHUNK_BYTES):
+                await response.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                await response.write(compressor.finish())
+            await response.write_eof()
+            return response
+    except UPSTREAM_ERRORS as e:
+        if response is not None and response.prepared:
+            # Las cabeceras ya salieron: solo se puede cortar la respuesta
+            return response
+        return json_response({'error': UNAVAILABLE[client], 'message': str(e) or repr(e)}, 503)
+
+
+def cache_response(entry, cache_state):
+    response = body_response(entry.body, entry.status)
+    response.headers['X-Cache'] = cache_state
+    return response
+
+
+async def cached_fetch(client, path, route, resource_id):
+    """(CacheEntry, X-Cache) de un GET de detalle, revalidado con If-None-Match si caducó."""
+    key = response_cache.key(route, resource_id)
+    entry = response_cache.lookup(key)
+    if entry is not None and entry.fresh:
+        return entry, 'HIT'
+
+    headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else None
+    status, body, upstream_headers = await shared_request(client, path, route, headers=headers)
+    if status == 304 and entry is not None:
+        response_cache.refresh(key, route)
+        return entry, 'REVALIDATED'
+
+    fetched = upstream_entry(status, body, upstream_headers)
+    if status == 200:
+        response_cache.store(key, route, fetched)
+    return fetched, 'MISS'
+
+
+async def shared_fetch(client, path, route, params=None):
+    """(CacheEntry, None) de un GET compartido, como ``cached_fetch``."""
+    return upstream_entry(*await shared_request(client, path, route, params=params)), None
+
+
+async def cached_proxy(request, client, path, route, resource_id):
+    """GET de detalle servido desde la caché."""
+    try:
+        return cache_response(*await cached_fetch(client, path, route, resource_id))
+    except UPSTREAM_ERRORS as e:
+        return json_response({'error': UNAVAILABLE[client], 'message': str(e) or repr(e)}, 503)
+
+
+async def part_error(name, call):
+    """(datos, error) de una parte opcional de la vista compuesta."""
+    try:
+        entry, _ = await call
+    except UPSTREAM_ERRORS as e:
+        return None, {'error': f'{name} service unavailable', 'message': str(e) or repr(e), 'status': 503}
+    if entry.status != 200:
+        return None, {'error': entry.payload.get('error', f'{name} service error'), 'status': entry.status}
+    return entry.payload, None
+
+
+def truncated_payments(payload):
+    """Error de la parte de pagos si quedan más de los que trae la vista compuesta (ver app.py)."""
+    cursor = payload.get('next_cursor') if payload else None
+    if cursor is None:
+        return None
+    return {'error': 'Payment list truncated',
+            'message': f'Order has more than {COMPOSITE_PAYMENTS_LIMIT} payments',
+            'next_cursor': cursor}
+
+
+async def health(request):
+    return json_response({
+        'status': 'healthy',
+        'service': 'api-gateway',
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+
+async def status(request):
+    # El estado de cada servicio sale de su circuit breaker, sin sondear /health
+    return json_response({
+        'service': 'api-gateway',
+        'status': 'operational',
+        'mode': 'async',
+        'timestamp': datetime.utcnow().isoformat(),
+        'services': {client.name: SERVICE_STATUS[client.breaker.state] for client in UPSTREAMS},
+        'breakers': {client.name: client.breaker.stats() for client in UPSTREAMS},
+        'bulkheads': {client.name: client.bulkhead.stats() for client in UPSTREAMS},
+        'pools': {client.name: client.stats() for client in UPSTREAMS},
+        'cache': response_cache.stats(),
+        'singleflight': singleflight.stats(),
+        'streams': stream_slots.stats(),
+        'ratelimit': rate_limiter.stats(),
+        'shedding': load_shedder.stats(),
+        'version': '1.0.0'
+    })
+
+
+# ========== USER SERVICE ROUTES ==========
+
+async def users(request):
+    response = await proxy(request, user_client, '/users', 'users', streamable=True)
+    if request.method == 'POST':
+        # Una lectura posterior no debe unirse a una llamada anterior a la escritura
+        singleflight.forget('users')
+    return response
+
+
+async def users_bulk(request):
+    response = await proxy(request, user_client, '/users/bulk', 'users_bulk')
+    singleflight.forget('users')
+    return response
+
+
+async def user_detail(request):
+    user_id = request.match_info['user_id']
+    return await cached_proxy(request, user_client, f'/users/{user_id}', 'user_detail', user_id)
+
+
+# ========== ORDER SERVICE ROUTES ==========
+
+async def orders(request):
+    response = await proxy(request, order_client, '/orders', 'orders', streamable=True)
+    if request.method == 'POST':
+        # Una lectura posterior no debe unirse a una llamada anterior a la escritura
+        singleflight.forget('orders')
+    return response
+
+
+async def orders_bulk(request):
+    response = await proxy(request, order_client, '/orders/bulk', 'orders_bulk')
+    singleflight.forget('orders')
+    return response
+
+
+async def order_detail(request):
+    order_id = request.match_info['order_id']
+    return await cached_proxy(request, order_client, f'/orders/{order_id}', 'order_detail', order_id)
+
+
+async def orders_stream(request):
+    # Last-Event-ID permite al microservicio reenviar los cambios perdidos al reconectar
+    last_event_id = request.headers.get('Last-Event-ID')
+    headers = {'Last-Event-ID': last_event_id} if last_event_id else None
+    try:
+        stream_slots.try_acquire()
+    except BulkheadFullError as e:
+        response = json_response({'error': 'Too many stream clients', 'message': str(e)}, 503)
+        response.headers['Retry-After'] = str(SHED_RETRY_AFTER)
+        return response
+    try:
+        # Conexión de larga duración: no ocupa un hueco del bulkhead del servicio mientras dura
+        return await stream_proxy(request, order_client, '/orders/stream', 'orders_stream',
+                                  SSE_MIMETYPE, headers, hold_bulkhead=False)
+    finally:
+        stream_slots.release()
+
+
+async def order_full(request):
+    """Pedido con su usuario y sus pagos en una sola llamada (ver app.py)."""
+    order_id = request.match_info['order_id']
+    payments = asyncio.ensure_future(
+        part_error('Payment', shared_fetch(payment_client, '/payments', 'payments',
+                                           {'order_ref': order_id, 'limit': COMPOSITE_PAYMENTS_LIMIT})))
+    try:
+        try:
+            entry, _ = await cached_fetch(order_client, f'/orders/{order_id}', 'order_detail', order_id)
+        except UPSTREAM_ERRORS as e:
+            return json_response({'error': UNAVAILABLE[order_client], 'message': str(e) or repr(e)}, 503)
+        if entry.status != 200:
+            return body_response(entry.body, entry.status)
+
+        order = entry.payload.get('order', {})
+        user_id = order.get('user_id')
+        errors = {}
+        user = None
+        if user_id is not None:
+            user_payload, errors['user'] = await part_error(
+                'User', cached_fetch(user_client, f'/users/{user_id}', 'user_detail', user_id))
+            user = user_payload.get('user') if user_payload else None
+        payments_payload, errors['payments'] = await payments
+        errors['payments'] = errors['payments'] or truncated_payments(payments_payload)
+    finally:
+        payments.cancel()
+    errors = {part: error for part, error in errors.items() if error}
+
+    return json_response({
+        'success': True,
+        'order': order,
+        'user': user,
+        'payments': payments_payload.get('payments', []) if payments_payload else [],
+        'partial': bool(errors),
+        'errors': errors
+    })
+
+
+async def order_status(request):
+    order_id = request.match_info['order_id']
+    # Se invalida antes y después para no dejar en caché una lectura concurrente antigua
+    detail_key = response_cache.key('order_detail', order_id)
+    response_cache.invalidate(detail_key)
+    response = await proxy(request, order_client, f'/orders/{order_id}/status', 'order_status')
+    response_cache.invalidate(detail_key)
+    singleflight.forget('orders', 'order_detail')
+    return response
+
+
+# ========== PAYMENT SERVICE ROUTES ==========
+
+async def payments(request):
+    response = await proxy(request, payment_client, '/payments', 'payments', streamable=True)
+    if request.method == 'POST':
+        # Una lectura posterior no debe unirse a una llamada anterior a la escritura
+        singleflight.forget('payments')
+    return response
+
+
+async def payments_bulk(request):
+    response = await proxy(request, payment_client, '/payments/bulk', 'payments_bulk')
+    singleflight.forget('payments')
+    return response
+
+
+async def payment_detail(request):
+    payment_id = request.match_info['payment_id']
+    return await cached_proxy(request, payment_client, f'/payments/{payment_id}', 'payment_detail', payment_id)
+
+
+async def payment_status(request):
+    payment_id = request.match_info['payment_id']
+    detail_key = response_cache.key('payment_detail', payment_id)
+    response_cache.invalidate(detail_key)
+    response = await proxy(request, payment_client, f'/payments/{payment_id}/status', 'payment_status')
+    response_cache.invalidate(detail_key)
+    singleflight.forget('payments', 'payment_detail')
+    return response
+
+
+async def root(request):
+    return json_response({
+        'service': 'API Gateway',
+        'version': '1.0.0',
+        'author': 'Alejandro De Mendoza',
+        'endpoints': {
+            'health': '/health',
+            'status': '/status',
+            'metrics': '/metrics',
+            'users': '/api/users',
+            'orders': '/api/orders',
+            'orders_stream': '/api/orders/stream',
+            'order_full': '/api/orders/<id>/full',
+            'payments': '/api/payments'
+        },
+        'architecture': 'Microservices',
+        'communication': ['REST', 'RabbitMQ']
+    })
+
+
+async def metrics(request):
+    return web.Response(body=metrics_body().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Latencia por ruta, peticiones en curso y errores (equivalente a instrument_flask)."""
+    if not METRICS_ENABLED:
+        return await handler(request)
+    started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    start_upstream_timer()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except asyncio.CancelledError:
+        # El cliente cortó la conexión: no es un error del gateway
+        status = 499
+        raise
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        seconds = time.perf_counter() - started
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        record_request(request.method, route, status, seconds)
+        observe_overhead(route, seconds)
+
+
+@web.middleware
+async def deadline_middleware(request, handler):
+    """Plazo de la petición: presupuesto de la ruta o X-Request-Timeout-Ms del cliente."""
+    route = getattr(request.match_info.handler, '__name__', None)
+    set_deadline(request_deadline(route, request.headers.get(DEADLINE_HEADER)))
+    try:
+        return await handler(request)
+    finally:
+        # La tarea de la conexión atiende las siguientes peticiones keep-alive
+        set_deadline(None)
+
+
+@web.middleware
+async def admission_middleware(request, handler):
+    """Token bucket por cliente y ruta (429) y load shedding (503), antes de llamar a nadie."""
+    route = getattr(request.match_info.handler, '__name__', None)
+    if request.match_info.http_exception is not None or route is None or route in EXEMPT_ROUTES:
+        return await handler(request)
+    client = client_id(request.headers, request.remote)
+    try:
+        if rate_limiter.store.blocking:
+            # Redis: la llamada bloquea, fuera del event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, rate_limiter.check, client, route, request.method)
+        else:
+            rate_limiter.check(client, route, request.method)
+        shed_slot = load_shedder.enter(track=route not in LONG_LIVED_ROUTES)
+    except Rejected as e:
+        response = json_response(e.payload(), e.status_code)
+        response.headers.update(e.headers())
+        return response
+    try:
+        return await handler(request)
+    finally:
+        if shed_slot:
+            load_shedder.leave()
+
+
+@web.middleware
+async def compression_middleware(request, handler):
+    """Comprime las respuestas ya completas; los streams se comprimen en su handler."""
+    response = await handler(request)
+    if response.prepared or not isinstance(response, web.Response) or not isinstance(response.body, bytes):
+        return response
+    compressor = start_compression(request, response, len(response.body))
+    if compressor is not None:
+        response.body = compressor.compress(response.body, flush=False) + compressor.finish()
+    return response
+
+
+@web.middleware
+async def error_envelope(request, handler):
+    """Sobres JSON para 404/500 y cabeceras CORS (como flask_cors con '*')."""
+    if request.method == 'OPTIONS':
+        response = web.Response(status=200)
+    else:
+        try:
+            response = await handler(request)
+        except web.HTTPNotFound:
+            response = json_response({'error': 'Not Found', 'message': 'The requested endpoint does not exist'}, 404)
+        except web.HTTPMethodNotAllowed as e:
+            response = json_response({'error': 'Method Not Allowed', 'message': e.text}, 405)
+        except Exception as e:
+            print(f"Unhandled error in async gateway: {e}")
+            response = json_response({'error': 'Internal Server Error', 'message': 'An unexpected error occurred'}, 500)
+
+    if response.prepared:
+        return response
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    if request.method == 'OPTIONS':
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = request.headers.get(
+            'Access-Control-Request-Headers', 'Content-Type')
+    return response
+
+
+async def start_clients(app):
+    for client in UPSTREAMS:
+        await client.start()
+
+
+async def close_clients(app):
+    for client in UPSTREAMS:
+        await client.close()
+
+
+def create_app():
+    app = web.Application(middlewares=[metrics_middleware, compression_middleware, error_envelope,
+                                       admission_middleware, deadline_middleware])
+    app.router.add_get('/health', health)
+    app.router.add_get('/status', status)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_route('GET', '/api/users', users)
+    app.router.add_route('POST', '/api/users', users)
+    app.router.add_post('/api/users/bulk', users_bulk)
+    app.router.add_get('/api/users/{user_id}', user_detail)
+    app.router.add_route('GET', '/api/orders', orders)
+    app.router.add_route('POST', '/api/orders', orders)
+    app.router.add_post('/api/orders/bulk', orders_bulk)
+    # Antes que /api/orders/{order_id}: aiohttp resuelve las rutas por orden de registro
+    app.router.add_get('/api/orders/stream', orders_stream)
+    app.router.add_get('/api/orders/{order_id}', order_detail)
+    app.router.add_get('/api/orders/{order_id}/full', order_full)
+    app.router.add_put('/api/orders/{order_id}/status', order_status)
+    app.router.add_route('GET', '/api/payments', payments)
+    app.router.add_route('POST', '/api/payments', payments)
+    app.router.add_post('/api/payments/bulk', payments_bulk)
+    app.router.add_get('/api/payments/{payment_id}', payment_detail)
+    app.router.add_put('/api/payments/{payment_id}/status', payment_status)
+    app.router.add_get('/', root)
+    app.on_startup.append(start_clients)
+    app.on_cleanup.append(close_clients)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=GATEWAY_PORT)
@@ -0,0 +1,153 @@
+"""Caché en memoria (LRU + TTL, acotada en bytes) para lecturas de detalle.
+
+Las entradas caducadas no se borran al instante: se conservan para
+revalidarlas contra el microservicio con ``If-None-Match`` y reutilizarlas
+si responde 304. Cada proceso del gateway tiene su propia caché.
+
+Se guardan los bytes JSON del microservicio tal cual: un hit se sirve sin
+serializar nada y el JSON solo se parsea si lo necesita una vista compuesta.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from common.json_provider import dumps_bytes, loads
+from upstream import parse_route_budgets
+
+CACHE_ENABLED = os.getenv('GATEWAY_CACHE_ENABLED', 'true').lower() == 'true'
+CACHE_MAX_BYTES = int(os.getenv('GATEWAY_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv('GATEWAY_CACHE_TTL', '30'))
+# TTL por ruta, mismo formato que UPSTREAM_ROUTE_TIMEOUTS
+CACHE_ROUTE_TTLS = parse_route_budgets(
+    os.getenv('GATEWAY_CACHE_TTLS', 'user_detail=300,order_detail=10,payment_detail=10'))
+
+
+def json_body(body, content_type=None):
+    """Bytes JSON que se reenvían sin tocar; lo que no es JSON va en el sobre ``{"raw": ...}``."""
+    if content_type and 'json' in content_type:
+        return body
+    try:
+        loads(body)
+    except ValueError:
+        return dumps_bytes({'raw': body.decode('utf-8', errors='replace')})
+    return body
+
+
+class CacheEntry:
+    """Respuesta de un microservicio (también las que no se guardan en la caché)."""
+    __slots__ = ('body', 'status', 'etag', 'size', 'expires_at', '_payload')
+
+    def __init__(self, body, status, etag=None, expires_at=0.0):
+        self.body = body
+        self.status = status
+        self.etag = etag
+        self.size = len(body)
+        self.expires_at = expires_at
+        self._payload = None
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires_at
+
+    @property
+    def payload(self):
+        """JSON parseado la primera vez que se pide."""
+        if self._payload is None:
+            try:
+                self._payload = loads(self.body)
+            except ValueError:
+                self._payload = {'raw': self.body.decode('utf-8', errors='replace')}
+        return self._payload
+
+
+class ResponseCache:
+    """LRU acotada por bytes con TTL por ruta y contadores para /status."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, default_ttl=CACHE_TTL, route_ttls=None,
+                 enabled=CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.route_ttls = CACHE_ROUTE_TTLS if route_ttls is None else route_ttls
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(route, resource_id):
+        return f'{route}:{resource_id}'
+
+    def ttl_for(self, route):
+        return self.route_ttls.get(route, self.default_ttl)
+
+    def lookup(self, key):
+        """Entrada (fresca o caducada) o None. Cuenta hit solo si está fresca."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def store(self, key, route, entry):
+        if not self.enabled or entry.size > self.max_bytes:
+            return
+        entry.expires_at = time.monotonic() + self.ttl_for(route)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def refresh(self, key, route):
+        """El microservicio respondió 304: la entrada vuelve a ser fresca."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.expires_at = time.monotonic() + self.ttl_for(route)
+            self.revalidated += 1
+            return entry
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,400 @@
+"""Rate limiting por cliente y ruta (token bucket) y load shedding del gateway.
+
+Cada cliente tiene un bucket por ruta y método (``orders:POST``) que se
+rellena a ``tasa`` tokens por segundo hasta ``ráfaga``; cada petición gasta
+uno y, sin tokens, el gateway responde 429 con ``Retry-After`` sin llamar al
+microservicio. El cliente es su IP (o la cabecera ``GATEWAY_CLIENT_ID_HEADER``
+si la pone un proxy de confianza delante del gateway).
+
+Los buckets viven en memoria del proceso (``MemoryBucketStore``), así que con
+varios workers o réplicas cada uno aplica el límite por separado. Con
+``GATEWAY_RATE_LIMIT_STORE=redis`` se comparten en Redis
+(``RedisBucketStore``): el bucket se actualiza en un script Lua atómico con el
+reloj de Redis. Si Redis no responde, la petición pasa (fail-open) y durante
+``GATEWAY_RATE_LIMIT_REDIS_BACKOFF`` segundos no se vuelve a consultar, para
+no pagar el timeout en cada petición.
+
+``LoadShedder`` rechaza con 503 antes de llamar a nadie cuando el gateway ya
+tiene demasiadas peticiones en curso o cuando la latencia media de los
+microservicios en la ventana reciente supera el umbral. Por latencia rechaza
+una fracción creciente (``1 - umbral/latencia``), nunca todo, para que sigan
+llegando medidas y el shedding se apague cuando el servicio se recupera.
+"""
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from common.metrics import REGISTRY
+
+RATE_LIMIT_ENABLED = os.getenv('GATEWAY_RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+# Límite por defecto y por ruta: 'tasa/ráfaga' (tokens por segundo / tamaño del bucket); 0 = sin límite
+RATE_LIMIT_DEFAULT = os.getenv('GATEWAY_RATE_LIMIT_DEFAULT', '50/100')
+RATE_LIMITS = os.getenv(
+    'GATEWAY_RATE_LIMITS',
+    'users:POST=5/10,orders:POST=10/20,payments:POST=10/20,'
+    'users_bulk=0.2/2,orders_bulk=0.2/2,payments_bulk=0.2/2')
+RATE_LIMIT_STORE = os.getenv('GATEWAY_RATE_LIMIT_STORE', 'memory')
+RATE_LIMIT_REDIS_URL = os.getenv('GATEWAY_RATE_LIMIT_REDIS_URL', 'redis://redis:6379/0')
+RATE_LIMIT_REDIS_TIMEOUT = float(os.getenv('GATEWAY_RATE_LIMIT_REDIS_TIMEOUT', '0.05'))
+# Tras un fallo de Redis no se le consulta durante este tiempo (las peticiones pasan sin esperar)
+RATE_LIMIT_REDIS_BACKOFF = float(os.getenv('GATEWAY_RATE_LIMIT_REDIS_BACKOFF', '5'))
+# Como mucho un mensaje de error cada tanto (el resto solo se cuenta)
+RATE_LIMIT_REDIS_LOG_INTERVAL = float(os.getenv('GATEWAY_RATE_LIMIT_REDIS_LOG_INTERVAL', '60'))
+# Buckets en memoria por proceso; al pasarse se descarta el menos usado (vuelve lleno)
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv('GATEWAY_RATE_LIMIT_MAX_BUCKETS', '100000'))
+CLIENT_ID_HEADER = os.getenv('GATEWAY_CLIENT_ID_HEADER', '')
+TRUST_FORWARDED_FOR = os.getenv('GATEWAY_TRUST_FORWARDED_FOR', 'false').lower() == 'true'
+
+# Load shedding (0 = desactivado)
+SHED_MAX_IN_FLIGHT = int(os.getenv('GATEWAY_SHED_MAX_IN_FLIGHT', '0'))
+SHED_LATENCY_MS = float(os.getenv('GATEWAY_SHED_LATENCY_MS', '0'))
+SHED_WINDOW_SECONDS = float(os.getenv('GATEWAY_SHED_WINDOW_SECONDS', '5'))
+SHED_MIN_SAMPLES = int(os.getenv('GATEWAY_SHED_MIN_SAMPLES', '20'))
+SHED_RETRY_AFTER = int(os.getenv('GATEWAY_SHED_RETRY_AFTER', '1'))
+
+# Rutas que nunca se limitan: sondas y observabilidad
+EXEMPT_ROUTES = frozenset(('health', 'status', 'metrics', 'root'))
+# Suscripciones SSE: pasan por el shedding pero no cuentan como en curso (ocuparían un hueco durante horas);
+# su número lo acota STREAM_MAX_CLIENTS
+LONG_LIVED_ROUTES = frozenset(('orders_stream',))
+# Suscripciones SSE simultáneas por proceso; en modo Flask cada una ocupa un hilo
+STREAM_MAX_CLIENTS = int(os.getenv(
+    'GATEWAY_STREAM_MAX_CLIENTS', str(max(1, int(os.getenv('GUNICORN_THREADS', '4')) // 2))))
+
+RATE_LIMITED = REGISTRY.counter(
+    'gateway_rate_limited_total', 'Peticiones rechazadas con 429 por el rate limiter', ('route',))
+SHED = REGISTRY.counter(
+    'gateway_shed_total', 'Peticiones rechazadas con 503 por load shedding', ('reason',))
+
+
+def parse_limit(raw):
+    """'10/20' -> (10.0, 20.0); '10' -> (10.0, 10.0); '0' -> None (sin límite)."""
+    rate, _, burst = raw.strip().partition('/')
+    rate = float(rate)
+    burst = float(burst) if burst else rate
+    if rate <= 0 or burst <= 0:
+        return None
+    return rate, max(burst, 1.0)
+
+
+def parse_limits(raw):
+    """Convierte 'orders:POST=10/20,users=5' en {'orders:POST': (10.0, 20.0), 'users': (5.0, 5.0)}."""
+    limits = {}
+    for entry in (raw or '').split(','):
+        if '=' not in entry:
+            continue
+        route, value = entry.split('=', 1)
+        try:
+            limits[route.strip()] = parse_limit(value)
+        except ValueError:
+            print(f"Ignoring invalid rate limit: {entry}")
+    return limits
+
+
+def client_id(headers, remote_addr):
+    """Identidad del cliente para el rate limiting.
+
+    La cabecera configurada solo tiene sentido si la pone un proxy de
+    confianza (si no, cada cliente se inventaría una nueva). De
+    ``X-Forwarded-For`` se toma la última entrada: la que añadió el proxy.
+    """
+    if CLIENT_ID_HEADER:
+        value = headers.get(CLIENT_ID_HEADER)
+        if value:
+            return 'id:' + hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+    if TRUST_FORWARDED_FOR:
+        forwarded = headers.get('X-Forwarded-For')
+        if forwarded:
+            return 'ip:' + forwarded.split(',')[-1].strip()
+    return f'ip:{remote_addr}'
+
+
+class Rejected(Exception):
+    """El gateway rechaza la petición antes de llamar a ningún microservicio."""
+    status_code = 503
+    error = 'Service Unavailable'
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def payload(self):
+        return {'error': self.error, 'message': str(self)}
+
+    def headers(self):
+        # Retry-After en segundos enteros, redondeado hacia arriba
+        return {'Retry-After': str(max(1, math.ceil(self.retry_after)))}
+
+
+class RateLimited(Rejected):
+    status_code = 429
+    error = 'Too Many Requests'
+
+
+class Overloaded(Rejected):
+    status_code = 503
+    error = 'Service Unavailable'
+
+
+class MemoryBucketStore:
+    """Buckets en un dict del proceso (LRU acotada)."""
+    blocking = False
+
+    def __init__(self, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst, cost=1.0):
+        """(permitido, tokens que quedan, segundos hasta tener ``cost`` tokens)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, tokens, 0.0 if allowed else (cost - tokens) / rate
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'buckets': len(self._buckets), 'max_buckets': self.max_buckets}
+
+
+# Refill + consumo en una sola operación atómica; TIME de Redis para no depender
+# del reloj de cada réplica. Lua trunca los números devueltos: van como texto.
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens), tostring(wait)}
+"""
+
+
+class RedisBucketStore:
+    """Buckets compartidos por todos los workers y réplicas del gateway."""
+    blocking = True
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL, timeout=RATE_LIMIT_REDIS_TIMEOUT, prefix='ratelimit:',
+                 backoff=RATE_LIMIT_REDIS_BACKOFF, log_interval=RATE_LIMIT_REDIS_LOG_INTERVAL):
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        self.backoff = backoff
+        self.log_interval = log_interval
+        self._client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._take = self._client.register_script(TAKE_SCRIPT)
+        self._lock = threading.Lock()
+        self._skip_until = 0.0
+        self._logged_at = None
+        self._unlogged = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def take(self, key, rate, burst, cost=1.0):
+        if time.monotonic() < self._skip_until:
+            # Redis falló hace poco: se deja pasar sin esperar otro timeout
+            with self._lock:
+                self.skipped += 1
+            return True, burst, 0.0
+        try:
+            allowed, tokens, wait = self._take(keys=[self.prefix + key], args=[rate, burst, cost])
+        except Exception as e:
+            # Sin Redis no se limita: mejor dejar pasar que tumbar el gateway
+            self._failed(e)
+            return True, burst, 0.0
+        return bool(allowed), float(tokens), float(wait)
+
+    def _failed(self, error):
+        now = time.monotonic()
+        with self._lock:
+            self.errors += 1
+            self._skip_until = now + self.backoff
+            if self._logged_at is not None and now - self._logged_at < self.log_interval:
+                self._unlogged += 1
+                return
+            self._logged_at = now
+            unlogged, self._unlogged = self._unlogged, 0
+        suppressed = f' ({unlogged} more errors since the last report)' if unlogged else ''
+        print(f"Rate limit store unavailable, skipping it for {self.backoff:g}s: {error}{suppressed}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'redis',
+                'url': self.url.rsplit('@', 1)[-1],
+                'available': time.monotonic() >= self._skip_until,
+                'errors': self.errors,
+                'skipped': self.skipped
+            }
+
+
+def create_store(backend=RATE_LIMIT_STORE):
+    if backend == 'redis':
+        return RedisBucketStore()
+    return MemoryBucketStore()
+
+
+class RateLimiter:
+    """Token bucket por cliente, ruta y método."""
+
+    def __init__(self, store=None, default=RATE_LIMIT_DEFAULT, limits=RATE_LIMITS, enabled=RATE_LIMIT_ENABLED):
+        self.enabled = enabled
+        self.store = store if store is not None else create_store()
+        self.default = parse_limit(default) if isinstance(default, str) else default
+        self.limits = parse_limits(limits) if isinstance(limits, str) else limits
+        self.allowed = 0
+        self.limited = 0
+
+    def limit_for(self, route, method):
+        """(tasa, ráfaga) de ``route`` para ``method``, o None si no se limita."""
+        scope = f'{route}:{method}'
+        if scope in self.limits:
+            return self.limits[scope]
+        return self.limits.get(route, self.default)
+
+    def check(self, client, route, method):
+        """Gasta un token del bucket; lanza RateLimited si no queda ninguno."""
+        if not self.enabled:
+            return
+        limit = self.limit_for(route, method)
+        if limit is None:
+            return
+        rate, burst = limit
+        allowed, _, wait = self.store.take(f'{client}|{route}:{method}', rate, burst)
+        if allowed:
+            self.allowed += 1
+            return
+        self.limited += 1
+        RATE_LIMITED.inc(route=route)
+        raise RateLimited(f'Rate limit exceeded for {method} {route} ({rate:g} requests/s, burst {burst:g})', wait)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'default': self.default,
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'store': self.store.stats()
+        }
+
+
+class LoadShedder:
+    """Rechazo temprano por peticiones en curso o por latencia de los microservicios."""
+
+    def __init__(self, max_in_flight=SHED_MAX_IN_FLIGHT, latency_ms=SHED_LATENCY_MS,
+                 window=SHED_WINDOW_SECONDS, min_samples=SHED_MIN_SAMPLES, retry_after=SHED_RETRY_AFTER):
+        self.max_in_flight = max_in_flight
+        self.latency_threshold = latency_ms / 1000
+        self.window = window
+        self.min_samples = min_samples
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._samples = deque()
+        self._latency_sum = 0.0
+
+        self.shed_in_flight = 0
+        self.shed_latency = 0
+        self.peak_in_flight = 0
+
+    @property
+    def enabled(self):
+        return self.max_in_flight > 0 or self.latency_threshold > 0
+
+    def observe(self, seconds):
+        """Latencia de una llamada a un microservicio (la alimenta ``observe_upstream``)."""
+        if self.latency_threshold <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, seconds))
+            self._latency_sum += seconds
+            self._expire(now)
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._latency_sum -= self._samples.popleft()[1]
+
+    def _latency(self, now):
+        """Latencia media de la ventana, o None si hay pocas muestras."""
+        self._expire(now)
+        if len(self._samples) < max(1, self.min_samples):
+            return None
+        return self._latency_sum / len(self._samples)
+
+    def enter(self, track=True):
+        """Admite la petición (True: hay que llamar a ``leave``) o lanza Overloaded.
+
+        Con ``track=False`` se aplican los umbrales pero no se cuenta en curso.
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                self.shed_in_flight += 1
+                reason = 'in_flight'
+                message = f'Gateway overloaded ({self._in_flight} requests in flight)'
+            else:
+                latency = self._latency(time.monotonic()) if self.latency_threshold else None
+                if latency is not None and latency > self.latency_threshold \
+                        and random.random() < 1 - self.latency_threshold / latency:
+                    self.shed_latency += 1
+                    reason = 'latency'
+                    message = f'Gateway overloaded (upstream latency {latency * 1000:.0f} ms)'
+                elif not track:
+                    return False
+                else:
+                    self._in_flight += 1
+                    self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+                    return True
+        SHED.inc(reason=reason)
+        raise Overloaded(message, self.retry_after)
+
+    def leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            latency = self._latency(time.monotonic())
+            return {
+                'enabled': self.enabled,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'max_in_flight': self.max_in_flight,
+                'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+                'latency_threshold_ms': self.latency_threshold * 1000,
+                'shed_in_flight': self.shed_in_flight,
+                'shed_latency': self.shed_latency
+            }
+
+
+# Uno por proceso: lo alimentan todas las llamadas upstream (ver upstream.observe_upstream)
+load_shedder = LoadShedder()
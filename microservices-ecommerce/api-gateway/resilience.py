@@ -0,0 +1,189 @@
+"""Circuit breaker y bulkhead por microservicio.
+
+Cuando un servicio falla o se vuelve lento, el breaker se abre y el gateway
+responde 503 al instante en lugar de dejar workers colgados. El bulkhead
+limita cuántas llamadas simultáneas puede acaparar cada servicio, de modo
+que uno lento no deja sin capacidad al resto.
+
+Ambas piezas son síncronas y sin esperas internas (salvo ``Bulkhead.acquire``
+con timeout), así que sirven tanto para el gateway Flask como para el asyncio.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '2.0'))
+BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', '0.8'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '10'))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv('BREAKER_HALF_OPEN_CALLS', '3'))
+BULKHEAD_MAX_CONCURRENT = int(os.getenv('BULKHEAD_MAX_CONCURRENT', os.getenv('UPSTREAM_POOL_SIZE', '20')))
+BULKHEAD_WAIT = float(os.getenv('BULKHEAD_WAIT', '0'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Estado del breaker tal como se muestra en /status
+SERVICE_STATUS = {CLOSED: 'online', HALF_OPEN: 'degraded', OPEN: 'offline'}
+
+
+class UpstreamRejected(requests.exceptions.RequestException):
+    """El gateway rechaza la llamada sin llegar a enviarla al microservicio."""
+
+
+class CircuitOpenError(UpstreamRejected):
+    pass
+
+
+class BulkheadFullError(UpstreamRejected):
+    pass
+
+
+class CircuitBreaker:
+    """Breaker closed/open/half-open sobre una ventana de las últimas llamadas."""
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 slow_rate=BREAKER_SLOW_RATE, open_seconds=BREAKER_OPEN_SECONDS,
+                 half_open_calls=BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._trial_successes = 0
+
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._trial_calls = 0
+            self._trial_successes = 0
+        return self._state
+
+    def before_call(self):
+        """Lanza CircuitOpenError si la llamada no debe salir hacia el servicio."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._trial_calls < self.half_open_calls:
+                self._trial_calls += 1
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f'Circuit breaker open for {self.name}')
+
+    def record(self, success, latency, slow_call_seconds=None):
+        slow = latency >= (slow_call_seconds or self.slow_call_seconds)
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                if not success or slow:
+                    self._trip()
+                else:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.half_open_calls:
+                        self._state = CLOSED
+                        self._outcomes.clear()
+                return
+
+            self._outcomes.append((success, slow))
+            if state == CLOSED and len(self._outcomes) >= self.min_calls:
+                calls = len(self._outcomes)
+                failures = sum(1 for ok, _ in self._outcomes if not ok)
+                slow_calls = sum(1 for _, is_slow in self._outcomes if is_slow)
+                if failures / calls >= self.error_rate or slow_calls / calls >= self.slow_rate:
+                    self._trip()
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._outcomes)
+            failures = sum(1 for ok, _ in self._outcomes if not ok)
+            slow_calls = sum(1 for _, slow in self._outcomes if slow)
+            return {
+                'state': state,
+                'window_calls': calls,
+                'error_rate': round(failures / calls, 3) if calls else 0.0,
+                'slow_rate': round(slow_calls / calls, 3) if calls else 0.0,
+                'rejected': self.rejected,
+                'times_opened': self.times_opened
+            }
+
+
+class Bulkhead:
+    """Límite de llamadas concurrentes hacia un microservicio."""
+
+    def __init__(self, name, max_concurrent=BULKHEAD_MAX_CONCURRENT, wait=BULKHEAD_WAIT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.wait = wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self.rejected = 0
+        self.peak = 0
+
+    def try_acquire(self):
+        """Ocupa un hueco sin esperar (válido también dentro del event loop)."""
+        with self._cond:
+            return self._take()
+
+    def acquire(self):
+        """Ocupa un hueco esperando como mucho ``wait`` segundos (modo con hilos)."""
+        deadline = time.monotonic() + self.wait
+        with self._cond:
+            while self._active >= self.max_concurrent:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._take()
+
+    def _take(self):
+        if self._active >= self.max_concurrent:
+            self.rejected += 1
+            raise BulkheadFullError(
+                f'Too many concurrent requests to {self.name} ({self.max_concurrent} in flight)')
+        self._active += 1
+        self.peak = max(self.peak, self._active)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'max_concurrent': self.max_concurrent,
+                'peak': self.peak,
+                'rejected': self.rejected
+            }
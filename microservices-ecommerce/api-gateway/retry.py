@@ -0,0 +1,170 @@
+"""Reintentos con backoff y peticiones de cobertura (hedging) hacia los microservicios.
+
+- Solo se reintentan GETs (idempotentes) que fallan por conexión, timeout o
+  502/503/504, con backoff exponencial y jitter completo. Los rechazos del
+  breaker y del bulkhead no se reintentan: están protegiendo al servicio.
+- Cada microservicio tiene un presupuesto de reintentos (token bucket): cada
+  petición original aporta ``GATEWAY_RETRY_BUDGET_RATIO`` fichas, se suman
+  ``GATEWAY_RETRY_BUDGET_MIN_PER_SECOND`` por segundo y cada reintento o
+  cobertura gasta una. Con el servicio caído los reintentos no multiplican
+  la carga por ``GATEWAY_RETRY_ATTEMPTS``.
+- Cobertura: en las rutas de ``GATEWAY_HEDGE_AFTER_MS`` (p. ej.
+  ``user_detail=50``) se lanza una segunda llamada si la primera no ha
+  respondido en ese tiempo y se usa la que llegue antes.
+
+Ningún reintento se hace si su espera no cabe en el plazo de la petición
+(``common.deadline``). Las piezas son síncronas y sin esperas internas, así
+que sirven tanto para el gateway Flask como para el asyncio.
+"""
+import os
+import random
+import threading
+import time
+
+from common.metrics import REGISTRY
+
+RETRY_ENABLED = os.getenv('GATEWAY_RETRY_ENABLED', 'true').lower() == 'true'
+# Intentos totales por GET (1 = sin reintentos)
+RETRY_ATTEMPTS = int(os.getenv('GATEWAY_RETRY_ATTEMPTS', '3'))
+RETRY_BASE = float(os.getenv('GATEWAY_RETRY_BASE_MS', '25')) / 1000.0
+RETRY_MAX = float(os.getenv('GATEWAY_RETRY_MAX_MS', '500')) / 1000.0
+RETRY_BUDGET_RATIO = float(os.getenv('GATEWAY_RETRY_BUDGET_RATIO', '0.1'))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('GATEWAY_RETRY_BUDGET_MIN_PER_SECOND', '1'))
+RETRY_BUDGET_MAX = float(os.getenv('GATEWAY_RETRY_BUDGET_MAX', '20'))
+RETRY_STATUSES = frozenset((502, 503, 504))
+# Tiempo mínimo que debe quedar en el plazo para que merezca la pena otro intento
+MIN_ATTEMPT_SECONDS = 0.01
+
+
+def parse_hedge_delays(raw):
+    """Convierte 'user_detail=50,order_detail=80' (ms) en {'user_detail': 0.05, ...}."""
+    delays = {}
+    for entry in (raw or '').split(','):
+        if '=' not in entry:
+            continue
+        route, milliseconds = entry.split('=', 1)
+        try:
+            delays[route.strip()] = float(milliseconds) / 1000.0
+        except ValueError:
+            print(f"Ignoring invalid hedge delay: {entry}")
+    return delays
+
+
+HEDGE_AFTER = parse_hedge_delays(os.getenv('GATEWAY_HEDGE_AFTER_MS', ''))
+
+RETRIES = REGISTRY.counter(
+    'gateway_retries_total', 'Reintentos de GET hacia microservicios por motivo',
+    ('upstream', 'route', 'reason'))
+RETRIES_DENIED = REGISTRY.counter(
+    'gateway_retries_denied_total', 'Reintentos o coberturas descartados por presupuesto o plazo',
+    ('upstream', 'reason'))
+HEDGES = REGISTRY.counter(
+    'gateway_hedged_requests_total', 'Llamadas de cobertura lanzadas y cuál respondió antes',
+    ('upstream', 'route', 'winner'))
+
+
+class RetryBudget:
+    """Token bucket de reintentos de un microservicio."""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND,
+                 max_tokens=RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._refilled_at = time.monotonic()
+        self.spent = 0
+        self.denied = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+
+    def deposit(self):
+        """Una petición original: aporta ``ratio`` fichas."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.spent += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            self._refill()
+            return {
+                'tokens': round(self._tokens, 2),
+                'max_tokens': self.max_tokens,
+                'ratio': self.ratio,
+                'min_per_second': self.min_per_second,
+                'spent': self.spent,
+                'denied': self.denied
+            }
+
+
+class RetryPolicy:
+    """Decide si se reintenta (y cuánto esperar) y si se lanza una cobertura."""
+
+    def __init__(self, name, attempts=RETRY_ATTEMPTS, base=RETRY_BASE, maximum=RETRY_MAX,
+                 hedge_after=None, enabled=RETRY_ENABLED):
+        self.name = name
+        self.attempts = max(1, attempts) if enabled else 1
+        self.base = base
+        self.maximum = maximum
+        self.hedge_after = HEDGE_AFTER if hedge_after is None else hedge_after
+        self.budget = RetryBudget()
+
+    def backoff(self, attempt):
+        """Espera antes del reintento ``attempt`` (1, 2...): jitter completo sobre base * 2^(n-1)."""
+        return random.uniform(0, min(self.maximum, self.base * (2 ** (attempt - 1))))
+
+    def retry_delay(self, route, attempt, reason, remaining=None):
+        """Segundos a esperar antes de reintentar o None si no se reintenta.
+
+        ``attempt`` es el número del intento que acaba de fallar (1 = el
+        original) y ``remaining`` lo que queda del plazo de la petición.
+        """
+        if attempt >= self.attempts:
+            return None
+        delay = self.backoff(attempt)
+        if remaining is not None and remaining - delay < MIN_ATTEMPT_SECONDS:
+            RETRIES_DENIED.inc(upstream=self.name, reason='deadline')
+            return None
+        if not self.budget.try_spend():
+            RETRIES_DENIED.inc(upstream=self.name, reason='budget')
+            return None
+        RETRIES.inc(upstream=self.name, route=route or 'none', reason=reason)
+        return delay
+
+    def hedge_delay(self, route):
+        """Segundos tras los que lanzar una cobertura en ``route`` (None = sin cobertura)."""
+        return self.hedge_after.get(route)
+
+    def allow_hedge(self, remaining=None):
+        if remaining is not None and remaining < MIN_ATTEMPT_SECONDS:
+            return False
+        if not self.budget.try_spend():
+            RETRIES_DENIED.inc(upstream=self.name, reason='budget')
+            return False
+        return True
+
+    def hedge_won(self, route, winner):
+        HEDGES.inc(upstream=self.name, route=route or 'none', winner=winner)
+
+    def stats(self):
+        return {
+            'attempts': self.attempts,
+            'backoff_base_ms': round(self.base * 1000, 1),
+            'backoff_max_ms': round(self.maximum * 1000, 1),
+            'hedge_after_ms': {route: round(delay * 1000, 1) for route, delay in self.hedge_after.items()},
+            'budget': self.budget.stats()
+        }
@@ -0,0 +1,242 @@
+"""Coalescencia de GETs idénticos concurrentes (single-flight).
+
+Cuando muchos paneles refrescan a la vez, el gateway recibe el mismo
+``GET /api/orders`` decenas de veces en paralelo. La primera petición
+(líder) hace la llamada al microservicio y las que llegan mientras está en
+curso se unen a ella y reciben la misma respuesta, sin tocar el upstream.
+
+``GATEWAY_SINGLEFLIGHT_WINDOW_MS`` amplía la ventana de unión: una respuesta
+recién terminada se sigue compartiendo durante esos milisegundos. Con 0 (por
+defecto) solo se comparte la llamada en curso. Las escrituras que pasan por
+el gateway descartan las llamadas de sus rutas con ``forget()`` para que una
+lectura posterior no reciba datos anteriores a la escritura.
+
+Solo se coalescen GETs sin cabeceras del cliente: la clave es ruta, path y
+query normalizada. Cada petición unida espera como mucho su propio plazo
+(``remaining()``), no el de la líder. ``SingleFlight`` sirve al gateway Flask (hilos) y
+``AsyncSingleFlight`` al de aiohttp (tareas).
+"""
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+from common.deadline import remaining
+from common.metrics import METRICS_ENABLED, REGISTRY
+from upstream import DeadlineExceeded
+
+SINGLEFLIGHT_ENABLED = os.getenv('GATEWAY_SINGLEFLIGHT_ENABLED', 'true').lower() == 'true'
+SINGLEFLIGHT_WINDOW = float(os.getenv('GATEWAY_SINGLEFLIGHT_WINDOW_MS', '0')) / 1000.0
+
+SHARED_CALLS = REGISTRY.counter(
+    'gateway_singleflight_shared_total', 'Peticiones servidas con la llamada upstream de otra',
+    ('route',))
+
+
+def _pairs(params):
+    # MultiDict de werkzeug: items() solo da el primer valor de cada clave
+    if hasattr(params, 'getlist'):
+        return params.items(multi=True)
+    return params.items()
+
+
+def flight_key(route, path, params=None, headers=None):
+    """Clave estable: el orden de los parámetros de la query no importa."""
+    query = urlencode(sorted(_pairs(params))) if params else ''
+    extra = urlencode(sorted(headers.items())) if headers else ''
+    return f'{route} {path}?{query} {extra}'
+
+
+class _FlightStats:
+    """Contadores comunes de las dos variantes."""
+
+    def __init__(self, window=SINGLEFLIGHT_WINDOW, enabled=SINGLEFLIGHT_ENABLED):
+        self.window = window
+        self.enabled = enabled
+        self.calls = 0
+        self.shared = 0
+        self.forgotten = 0
+        self._shared_by_route = {}
+
+    def _count_shared(self, route):
+        self.shared += 1
+        self._shared_by_route[route] = self._shared_by_route.get(route, 0) + 1
+        if METRICS_ENABLED:
+            SHARED_CALLS.inc(route=route)
+
+    def _stats(self, in_flight):
+        served = self.calls + self.shared
+        return {
+            'enabled': self.enabled,
+            'window_ms': self.window * 1000,
+            'in_flight': in_flight,
+            'upstream_calls': self.calls,
+            'saved_calls': self.shared,
+            'saved_ratio': round(self.shared / served, 3) if served else 0.0,
+            'saved_by_route': dict(self._shared_by_route),
+            'forgotten': self.forgotten
+        }
+
+
+class _Call:
+    __slots__ = ('route', 'done', 'result', 'error', 'finished_at')
+
+    def __init__(self, route):
+        self.route = route
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight(_FlightStats):
+    """Single-flight para hilos (gateway Flask)."""
+
+    def __init__(self, window=SINGLEFLIGHT_WINDOW, enabled=SINGLEFLIGHT_ENABLED):
+        super().__init__(window, enabled)
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _joinable(self, call, now):
+        if not call.done.is_set():
+            return True
+        return call.error is None and now - call.finished_at < self.window
+
+    def _sweep(self, now):
+        expired = [key for key, call in self._calls.items()
+                   if call.done.is_set() and not self._joinable(call, now)]
+        for key in expired:
+            del self._calls[key]
+
+    def do(self, key, route, fn):
+        """Devuelve ``fn()`` o el resultado de la llamada idéntica en curso.
+
+        Si la llamada compartida falla, todas las peticiones unidas reciben
+        la misma excepción. Una petición unida cuyo plazo vence antes recibe
+        ``DeadlineExceeded``, igual que si hubiera llamado ella al upstream.
+        """
+        if not self.enabled:
+            return fn()
+
+        with self._lock:
+            now = time.monotonic()
+            call = self._calls.get(key)
+            leader = call is None or not self._joinable(call, now)
+            if leader:
+                self._sweep(now)
+                call = self._calls[key] = _Call(route)
+                self.calls += 1
+            else:
+                self._count_shared(route)
+
+        if not leader:
+            left = remaining()
+            if not call.done.wait(None if left is None else max(0.0, left)):
+                raise DeadlineExceeded('Request deadline exceeded')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.finished_at = time.monotonic()
+            call.done.set()
+            if call.error is not None or self.window <= 0:
+                with self._lock:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+
+    def forget(self, *routes):
+        """Las siguientes lecturas de ``routes`` ya no se unen a llamadas previas."""
+        with self._lock:
+            stale = [key for key, call in self._calls.items() if call.route in routes]
+            for key in stale:
+                del self._calls[key]
+            self.forgotten += len(stale)
+
+    def stats(self):
+        with self._lock:
+            in_flight = sum(1 for call in self._calls.values() if not call.done.is_set())
+            return self._stats(in_flight)
+
+
+class AsyncSingleFlight(_FlightStats):
+    """Single-flight para asyncio (gateway aiohttp).
+
+    La llamada compartida corre en su propia tarea: si el cliente líder
+    corta la conexión, las peticiones unidas siguen esperando el resultado.
+    """
+
+    def __init__(self, window=SINGLEFLIGHT_WINDOW, enabled=SINGLEFLIGHT_ENABLED):
+        super().__init__(window, enabled)
+        self._calls = {}
+
+    def _joinable(self, entry, now):
+        task, route, finished_at = entry
+        if not task.done():
+            return True
+        # El callback que anota el fin corre en la siguiente vuelta del loop
+        finished = finished_at[0] if finished_at[0] is not None else now
+        return (not task.cancelled() and task.exception() is None
+                and now - finished < self.window)
+
+    def _sweep(self, now):
+        expired = [key for key, entry in self._calls.items()
+                   if entry[0].done() and not self._joinable(entry, now)]
+        for key in expired:
+            del self._calls[key]
+
+    async def do(self, key, route, factory):
+        """Espera ``await factory()`` o la llamada idéntica en curso, dentro del plazo."""
+        if not self.enabled:
+            return await factory()
+
+        now = time.monotonic()
+        entry = self._calls.get(key)
+        if entry is not None and self._joinable(entry, now):
+            self._count_shared(route)
+        else:
+            self._sweep(now)
+            entry = self._calls[key] = self._start(key, route, factory)
+            self.calls += 1
+        left = remaining()
+        if left is None:
+            return await asyncio.shield(entry[0])
+        try:
+            return await asyncio.wait_for(asyncio.shield(entry[0]), max(0.0, left))
+        except asyncio.TimeoutError:
+            if entry[0].done():
+                raise
+            # La llamada compartida sigue en curso para las demás peticiones
+            raise asyncio.TimeoutError('Request deadline exceeded') from None
+
+    def _start(self, key, route, factory):
+        task = asyncio.ensure_future(factory())
+        finished_at = [None]
+        entry = (task, route, finished_at)
+
+        def _finished(done):
+            finished_at[0] = time.monotonic()
+            # Marca la excepción como recogida aunque todos los clientes se hayan ido
+            failed = done.cancelled() or done.exception() is not None
+            if (failed or self.window <= 0) and self._calls.get(key) is entry:
+                del self._calls[key]
+
+        task.add_done_callback(_finished)
+        return entry
+
+    def forget(self, *routes):
+        stale = [key for key, entry in self._calls.items() if entry[1] in routes]
+        for key in stale:
+            del self._calls[key]
+        self.forgotten += len(stale)
+
+    def stats(self):
+        in_flight = sum(1 for entry in self._calls.values() if not entry[0].done())
+        return self._stats(in_flight)
@@ -0,0 +1,332 @@
+"""Cliente HTTP hacia los microservicios con pool de conexiones keep-alive.
+
+Cada microservicio tiene su propia ``requests.Session`` con un pool de
+conexiones persistentes, de modo que las peticiones reenviadas por el
+gateway reutilizan sockets TCP en lugar de abrir uno nuevo por llamada.
+
+Los GET se reintentan y, en las rutas configuradas, se cubren con una
+segunda llamada (``retry.py``). Ninguna llamada supera el plazo de la
+petición, que viaja al microservicio en ``X-Request-Timeout-Ms``.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextvars import copy_context
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.deadline import DEADLINE_HEADER, parse_timeout_ms, remaining
+from common.metrics import METRICS_ENABLED, REGISTRY, add_upstream_time, upstream_time
+from ratelimit import load_shedder
+from resilience import Bulkhead, CircuitBreaker, CircuitOpenError, UpstreamRejected
+from retry import RETRY_STATUSES, RetryPolicy
+
+# Configuración del pool y de timeouts (segundos)
+POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '20'))
+POOL_BLOCK = os.getenv('UPSTREAM_POOL_BLOCK', 'false').lower() == 'true'
+CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '1.0'))
+READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '5.0'))
+# Passthrough: el cuerpo del microservicio se reenvía trozo a trozo sin parsearlo.
+# Desactivado por defecto: sin cuerpo guardado, los listados no se pueden coalescer (single-flight)
+PASSTHROUGH = os.getenv('GATEWAY_PASSTHROUGH', 'false').lower() == 'true'
+PASSTHROUGH_CHUNK_BYTES = int(os.getenv('GATEWAY_PASSTHROUGH_CHUNK_BYTES', '65536'))
+# Pagos que trae la vista compuesta de un pedido (no más que PAYMENTS_MAX_PAGE_SIZE)
+COMPOSITE_PAYMENTS_LIMIT = int(os.getenv('GATEWAY_COMPOSITE_PAYMENTS_LIMIT', '1000'))
+
+
+def parse_route_budgets(raw):
+    """Convierte 'orders=10,users=2' en {'orders': 10.0, 'users': 2.0}."""
+    budgets = {}
+    for entry in (raw or '').split(','):
+        if '=' not in entry:
+            continue
+        route, seconds = entry.split('=', 1)
+        try:
+            budgets[route.strip()] = float(seconds)
+        except ValueError:
+            print(f"Ignoring invalid route budget: {entry}")
+    return budgets
+
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'gateway_upstream_duration_seconds', 'Espera de la respuesta del microservicio (hasta cabeceras)',
+    ('upstream', 'route'))
+UPSTREAM_FAILURES = REGISTRY.counter(
+    'gateway_upstream_errors_total', 'Llamadas a microservicios fallidas o con 5xx', ('upstream', 'route'))
+GATEWAY_OVERHEAD = REGISTRY.histogram(
+    'gateway_overhead_duration_seconds', 'Tiempo propio del gateway: latencia total menos upstream',
+    ('route',))
+
+
+def observe_upstream(upstream, route, seconds, failed):
+    """Registra una llamada a un microservicio y la suma al tiempo upstream de la petición."""
+    load_shedder.observe(seconds)
+    if not METRICS_ENABLED:
+        return
+    add_upstream_time(seconds)
+    UPSTREAM_LATENCY.observe(seconds, upstream=upstream, route=route or 'none')
+    if failed:
+        UPSTREAM_FAILURES.inc(upstream=upstream, route=route or 'none')
+
+
+def observe_overhead(route, seconds):
+    GATEWAY_OVERHEAD.observe(max(0.0, seconds - upstream_time()), route=route)
+
+
+# Timeout de lectura por ruta del gateway (nombre del endpoint Flask)
+ROUTE_BUDGETS = parse_route_budgets(
+    os.getenv('UPSTREAM_ROUTE_TIMEOUTS', 'users_bulk=60,orders_bulk=60,payments_bulk=60,orders_stream=60'))
+
+# Hilos para las llamadas con cobertura (la original y la de cobertura corren en paralelo)
+HEDGE_WORKERS = int(os.getenv('GATEWAY_HEDGE_WORKERS', '32'))
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge')
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """No queda tiempo del plazo de la petición para llamar al microservicio."""
+
+
+def request_deadline(route, client_timeout=None):
+    """Plazo en segundos de una petición al gateway.
+
+    El presupuesto de la ruta (conexión + lectura), o el ``X-Request-Timeout-Ms``
+    del cliente si es menor.
+    """
+    budget = CONNECT_TIMEOUT + ROUTE_BUDGETS.get(route, READ_TIMEOUT)
+    requested = parse_timeout_ms(client_timeout)
+    return budget if requested is None else min(budget, requested)
+
+
+class UpstreamClient:
+    """Cliente con pool keep-alive para un microservicio concreto."""
+
+    def __init__(self, name, base_url, pool_size=POOL_SIZE, pool_block=POOL_BLOCK,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 route_budgets=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.route_budgets = ROUTE_BUDGETS if route_budgets is None else route_budgets
+
+        # Un solo host por cliente: basta con un pool de hasta pool_size sockets
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=pool_block,
+            max_retries=0
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+
+        self.breaker = CircuitBreaker(name)
+        self.bulkhead = Bulkhead(name)
+        self.retry = RetryPolicy(name)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+
+    def timeout_for(self, route=None):
+        """Tupla (connect, read) para requests según el presupuesto de la ruta."""
+        return (self.connect_timeout, self.route_budgets.get(route, self.read_timeout))
+
+    def slow_call_seconds(self, route=None):
+        """Umbral de llamada lenta del breaker, escalado con el presupuesto de la ruta.
+
+        Una carga masiva con 60 s de presupuesto no debe contar como lenta a los 2 s.
+        """
+        budget = self.route_budgets.get(route, self.read_timeout)
+        return self.breaker.slow_call_seconds * max(1.0, budget / self.read_timeout)
+
+    def request(self, method, path, route=None, timeout=None, **kwargs):
+        """Envía la petición por el pool; propaga RequestException al llamador.
+
+        Los GET (salvo streams) se reintentan si fallan por conexión, timeout
+        o 502/503/504, dentro del presupuesto de reintentos y del plazo. Con
+        el breaker abierto o el bulkhead lleno se lanza UpstreamRejected
+        (subclase de RequestException) sin llegar a contactar el servicio.
+        """
+        if kwargs.get('stream'):
+            # Streams de larga duración (NDJSON, SSE): sin plazo ni reintentos
+            return self._send(method, path, route, timeout, **kwargs)
+        return self._request(method, path, route, timeout, **kwargs)
+
+    def open(self, method, path, route=None, timeout=None, **kwargs):
+        """Como ``request`` (reintentos, cobertura y plazo) pero sin leer el cuerpo.
+
+        El llamador lo consume de ``response.raw`` y cierra la respuesta; la
+        conexión vuelve al pool al terminar de leerlo.
+        """
+        return self._request(method, path, route, timeout, stream=True, **kwargs)
+
+    def _request(self, method, path, route, timeout, **kwargs):
+        if method != 'GET':
+            return self._attempt(method, path, route, timeout, **kwargs)
+
+        self.retry.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                response = self._attempt(method, path, route, timeout, **kwargs)
+            except UpstreamRejected:
+                raise
+            except requests.exceptions.RequestException as e:
+                reason = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection'
+                delay = self.retry.retry_delay(route, attempt, reason, remaining())
+                if delay is None:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = self.retry.retry_delay(route, attempt, f'status_{response.status_code}', remaining())
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, method, path, route, timeout, **kwargs):
+        """Un intento dentro del plazo: timeouts recortados y cabecera con lo que queda."""
+        left = remaining()
+        if left is not None:
+            if left <= 0:
+                raise DeadlineExceeded('Request deadline exceeded')
+            connect, read = timeout or self.timeout_for(route)
+            timeout = (min(connect, left), min(read, left))
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{DEADLINE_HEADER: str(int(left * 1000))})
+
+        hedge_after = self.retry.hedge_delay(route) if method == 'GET' else None
+        if hedge_after is None:
+            return self._send(method, path, route, timeout, **kwargs)
+        return self._hedged(hedge_after, method, path, route, timeout, **kwargs)
+
+    def _hedged(self, hedge_after, method, path, route, timeout, **kwargs):
+        """Si no hay respuesta en ``hedge_after`` s lanza otra llamada y usa la primera buena."""
+        primary = _hedge_executor.submit(copy_context().run, self._send, method, path, route, timeout, **kwargs)
+        try:
+            return primary.result(timeout=hedge_after)
+        except FutureTimeout:
+            pass
+        if not self.retry.allow_hedge(remaining()):
+            return primary.result()
+
+        hedge = _hedge_executor.submit(copy_context().run, self._send, method, path, route, timeout, **kwargs)
+        names = {primary: 'primary', hedge: 'hedge'}
+        pending = set(names)
+        fallback, failure = None, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    failure = failure or e
+                    continue
+                if response.status_code < 500:
+                    self.retry.hedge_won(route, names[future])
+                    for other in pending:
+                        # La llamada perdedora devuelve su conexión al pool al terminar
+                        other.add_done_callback(_close_response)
+                    if fallback is not None:
+                        fallback.close()
+                    return response
+                # Dos 5xx: se devuelve el último y la conexión del anterior vuelve al pool
+                if fallback is not None:
+                    fallback.close()
+                fallback = response
+        if fallback is not None:
+            return fallback
+        raise failure
+
+    def _send(self, method, path, route, timeout, **kwargs):
+        """Una llamada al microservicio a través del breaker y el bulkhead."""
+        self.bulkhead.acquire()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.bulkhead.release()
+            raise
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+        started = time.monotonic()
+        try:
+            response = self.session.request(
+                method,
+                f'{self.base_url}{path}',
+                timeout=timeout or self.timeout_for(route),
+                **kwargs
+            )
+        except requests.exceptions.RequestException:
+            elapsed = time.monotonic() - started
+            self.breaker.record(False, elapsed, self.slow_call_seconds(route))
+            observe_upstream(self.name, route, elapsed, True)
+            with self._lock:
+                self._errors += 1
+            raise
+        else:
+            elapsed = time.monotonic() - started
+            self.breaker.record(response.status_code < 500, elapsed, self.slow_call_seconds(route))
+            observe_upstream(self.name, route, elapsed, response.status_code >= 500)
+            return response
+        finally:
+            self.bulkhead.release()
+            with self._lock:
+                self._in_flight -= 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def stats(self):
+        """Estadísticas del pool de conexiones para /status."""
+        opened = 0
+        served = 0
+        idle = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            served += pool.num_requests
+            if pool.pool is not None:
+                # La cola se rellena con None para los huecos aún sin socket
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'requests': self._requests,
+                'errors': self._errors,
+                'in_flight': self._in_flight,
+                'connections_opened': opened,
+                'connections_reused': max(served - opened, 0),
+                'idle_connections': idle,
+                'timeouts': {
+                    'connect': self.connect_timeout,
+                    'read': self.read_timeout,
+                    'routes': self.route_budgets
+                },
+                'retries': self.retry.stats()
+            }
+
+    def close(self):
+        self.session.close()
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
@@ -0,0 +1,10 @@
+"""Punto de entrada WSGI del API Gateway (modo Flask) para gunicorn.
+
+    gunicorn -c common/gunicorn_conf.py --bind 0.0.0.0:5000 wsgi:app
+
+El modo asyncio usa el worker de aiohttp con la misma configuración::
+
+    gunicorn -c common/gunicorn_conf.py -k aiohttp.GunicornWebWorker \\
+        --bind 0.0.0.0:5000 'async_app:create_app()'
+"""
+from app import app  # noqa: F401
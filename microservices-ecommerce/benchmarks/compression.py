@@ -0,0 +1,140 @@
+"""Benchmark: coste de CPU de gzip/brotli frente a los bytes ahorrados.
+
+Comprime listados con la forma de ``GET /orders``, ``/payments`` y ``/users``
+(pedidos con arrays ``items`` de tamaño variable, datos pseudoaleatorios con
+semilla fija). Los cuerpos se serializan con ``common.json_provider``, igual
+que en los servicios. Para cada codificación y nivel mide:
+
+- la CPU de compresión y de descompresión por respuesta;
+- la proporción de bytes ahorrados;
+- los µs de CPU que cuesta cada KB ahorrado.
+
+Con ``--chunk-bytes`` mide además la compresión trozo a trozo con vaciado
+por trozo, que es lo que hace el gateway en streaming.
+
+Uso:
+    python benchmarks/compression.py --items 20,200,2000 --gzip-levels 1,3,6,9 --brotli-qualities 1,3,5,11
+"""
+import argparse
+import gzip
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from loadgen import ROOT_DIR
+
+sys.path.insert(0, ROOT_DIR)
+
+from common.compression import StreamCompressor, brotli, compress_bytes  # noqa: E402
+from common.json_provider import dumps_bytes  # noqa: E402
+
+PRODUCTS = ['Laptop', 'Mouse', 'Teclado mecánico', 'Monitor 27"', 'Audífonos', 'Webcam HD',
+            'Silla ergonómica', 'Base refrigerante', 'Disco SSD 1TB', 'Cable USB-C']
+STATUSES = ['pending', 'paid', 'payment_failed', 'shipped', 'delivered', 'cancelled']
+METHODS = ['credit_card', 'debit_card', 'paypal', 'bank_transfer']
+
+
+def build_bodies(items, seed=42):
+    """Cuerpos JSON de los tres listados con ``items`` registros cada uno."""
+    rng = random.Random(seed)
+    started = datetime(2026, 1, 1)
+    orders, payments, users = [], [], []
+    for i in range(1, items + 1):
+        created_at = started + timedelta(seconds=rng.randint(0, 30 * 86400))
+        lines = [{'product_id': rng.randint(1, 500), 'product': rng.choice(PRODUCTS),
+                  'quantity': rng.randint(1, 5), 'price': round(rng.uniform(5, 2500), 2)}
+                 for _ in range(rng.randint(1, 8))]
+        orders.append({'_id': f'{rng.getrandbits(96):024x}', 'user_id': rng.randint(1, 10000),
+                       'items': lines, 'total': round(sum(l['price'] * l['quantity'] for l in lines), 2),
+                       'status': rng.choice(STATUSES), 'created_at': created_at,
+                       'updated_at': created_at + timedelta(minutes=rng.randint(0, 600))})
+        payments.append({'id': i, 'order_id': rng.randint(1, 100000), 'user_id': rng.randint(1, 10000),
+                         'amount': round(rng.uniform(5, 10000), 2), 'currency': 'COP',
+                         'payment_method': rng.choice(METHODS), 'status': rng.choice(STATUSES[:3]),
+                         'transaction_id': f'{rng.getrandbits(128):032x}', 'created_at': created_at})
+        users.append({'id': i, 'name': f'Usuario {rng.randint(1, 10 ** 6)}',
+                      'email': f'user{rng.randint(1, 10 ** 9)}@example.com', 'created_at': created_at})
+    return {
+        'orders': dumps_bytes({'success': True, 'count': items, 'orders': orders, 'next_cursor': None}),
+        'payments': dumps_bytes({'success': True, 'count': items, 'payments': payments, 'next_cursor': None}),
+        'users': dumps_bytes({'success': True, 'count': items, 'users': users, 'next_cursor': None}),
+    }
+
+
+def decompress(data, encoding):
+    return brotli.decompress(data) if encoding == 'br' else gzip.decompress(data)
+
+
+def compress_chunked(body, encoding, level, chunk_bytes):
+    compressor = StreamCompressor(encoding, level)
+    parts = [compressor.compress(body[i:i + chunk_bytes]) for i in range(0, len(body), chunk_bytes)]
+    parts.append(compressor.finish())
+    return b''.join(parts)
+
+
+def cpu_ms(fn, min_seconds):
+    """CPU media por llamada (ms), repitiendo hasta acumular ``min_seconds``."""
+    calls = 0
+    started = time.process_time()
+    while True:
+        result = fn()
+        calls += 1
+        elapsed = time.process_time() - started
+        if elapsed >= min_seconds:
+            return result, elapsed * 1000 / calls
+
+
+def measure(body, encoding, level, args):
+    if args.chunk_bytes:
+        compressed, compress_ms = cpu_ms(
+            lambda: compress_chunked(body, encoding, level, args.chunk_bytes), args.min_seconds)
+    else:
+        compressed, compress_ms = cpu_ms(lambda: compress_bytes(body, encoding, level), args.min_seconds)
+    restored, decompress_ms = cpu_ms(lambda: decompress(compressed, encoding), args.min_seconds)
+    assert restored == body
+    saved = len(body) - len(compressed)
+    return {
+        'bytes': len(compressed),
+        'saved_ratio': round(saved / len(body), 3),
+        'compress_ms': round(compress_ms, 3),
+        'decompress_ms': round(decompress_ms, 3),
+        'compress_mb_s': round(len(body) / 1024 / 1024 / (compress_ms / 1000), 1) if compress_ms else None,
+        'cpu_us_per_kb_saved': round(compress_ms * 1000 / (saved / 1024), 2) if saved > 0 else None,
+    }
+
+
+def parse_levels(raw):
+    return [int(level) for level in raw.split(',') if level.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', default='20,200,2000', help='Registros por listado (lista separada por comas)')
+    parser.add_argument('--gzip-levels', default='1,3,6,9')
+    parser.add_argument('--brotli-qualities', default='1,3,5,11')
+    parser.add_argument('--chunk-bytes', type=int, default=0,
+                        help='Comprime en trozos de este tamaño con vaciado por trozo (0: de una vez)')
+    parser.add_argument('--min-seconds', type=float, default=0.2, help='CPU mínima medida por caso')
+    args = parser.parse_args()
+
+    encodings = [('gzip', level) for level in parse_levels(args.gzip_levels)]
+    if brotli is not None:
+        encodings += [('br', quality) for quality in parse_levels(args.brotli_qualities)]
+    else:
+        print('brotli no está instalado: solo se mide gzip', file=sys.stderr)
+
+    report = {}
+    for items in parse_levels(args.items):
+        for name, body in build_bodies(items).items():
+            report[f'{name}[{items}]'] = {
+                'identity_bytes': len(body),
+                **{f'{encoding}-{level}': measure(body, encoding, level, args) for encoding, level in encodings}
+            }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
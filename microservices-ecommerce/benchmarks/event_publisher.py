@@ -0,0 +1,109 @@
+"""Benchmark: publicación síncrona por mensaje frente a EventPublisher por lotes.
+
+Usa el broker en memoria (``common.memory_broker``) con una latencia de
+confirmación simulada por lote, que es lo que domina con RabbitMQ real:
+publicar dentro de la petición paga ese viaje en cada POST, mientras que
+``EventPublisher`` lo paga una vez por lote y fuera de la petición.
+
+Uso:
+    python benchmarks/event_publisher.py --events 20000 --producers 8 --confirm-latency-ms 1
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from loadgen import ROOT_DIR, percentile
+
+sys.path.insert(0, ROOT_DIR)
+
+from common.events import EventPublisher, build_message  # noqa: E402
+from common.memory_broker import InMemoryBroker, InMemoryTransport  # noqa: E402
+
+PAYLOAD = {'user_id': 1, 'items': [{'product': 'Laptop', 'quantity': 1}], 'total': 2500.0, 'status': 'pending'}
+
+
+def drive(producers, events, call):
+    """Reparte ``events`` llamadas entre ``producers`` hilos y mide cada una."""
+    latencies = []
+    lock = threading.Lock()
+    per_thread = events // producers
+
+    def worker():
+        local = []
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            call()
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(producers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+
+def report(latencies, elapsed, broker):
+    return {
+        'events': len(latencies),
+        'throughput_eps': round(len(latencies) / elapsed, 1),
+        'call_p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'call_p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'broker_batches': broker.batches,
+        'delivered': broker.published,
+    }
+
+
+def bench_per_message(args):
+    broker = InMemoryBroker(confirm_latency=args.confirm_latency_ms / 1000.0)
+    transport = InMemoryTransport(broker)
+    lock = threading.Lock()
+
+    def call():
+        # Un canal compartido con confirmación síncrona de cada mensaje
+        message = build_message('OrderCreated', PAYLOAD, 'benchmark')
+        with lock:
+            transport.publish_batch([message])
+
+    latencies, elapsed = drive(args.producers, args.events, call)
+    return report(latencies, elapsed, broker)
+
+
+def bench_batched(args):
+    broker = InMemoryBroker(confirm_latency=args.confirm_latency_ms / 1000.0)
+    publisher = EventPublisher('benchmark', url='memory://', batch_size=args.batch_size,
+                               linger=args.linger_ms / 1000.0, buffer_size=args.events,
+                               transport=InMemoryTransport(broker))
+
+    started = time.perf_counter()
+    latencies, _ = drive(args.producers, args.events,
+                         lambda: publisher.publish('OrderCreated', PAYLOAD))
+    publisher.flush(timeout=60)
+    # Throughput hasta la última confirmación, no solo hasta encolar
+    result = report(latencies, time.perf_counter() - started, broker)
+    publisher.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--producers', type=int, default=8)
+    parser.add_argument('--confirm-latency-ms', type=float, default=1.0)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--linger-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'per_message_confirm': bench_per_message(args),
+        'batched_confirms': bench_batched(args),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark: gateway Flask (app.py) frente al gateway asíncrono (async_app.py).
+
+Ambos gateways apuntan a los mismos microservicios falsos
+(``stub_upstreams.py``) con un retardo artificial, de modo que se mide
+solo el coste del gateway y su capacidad para solapar esperas.
+
+Uso:
+    python benchmarks/gateway_modes.py --requests 3000 --concurrency 64 --delay-ms 20
+"""
+import argparse
+import json
+import os
+import time
+import urllib.request
+
+from loadgen import ROOT_DIR, free_port, run_load, spawn, stop
+
+GATEWAY_DIR = os.path.join(ROOT_DIR, 'api-gateway')
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_upstreams.py')
+
+FLASK_SERVER = (
+    "import os, app; from werkzeug.serving import run_simple; "
+    "run_simple('127.0.0.1', int(os.environ['GATEWAY_PORT']), app.app, threaded=True)"
+)
+
+MIX = [
+    ('GET', '/api/orders', None, 'GET /api/orders'),
+    ('GET', '/api/users/1', None, 'GET /api/users/<id>'),
+    ('GET', '/api/payments', None, 'GET /api/payments'),
+    ('POST', '/api/orders', {'user_id': 1, 'items': [{'product': 'Laptop', 'quantity': 1}]}, 'POST /api/orders'),
+]
+
+
+def time_status(port):
+    started = time.perf_counter()
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/status') as response:
+        response.read()
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def bench_mode(mode, upstream_url, args):
+    port = free_port()
+    env = {
+        'USER_SERVICE_URL': upstream_url,
+        'ORDER_SERVICE_URL': upstream_url,
+        'PAYMENT_SERVICE_URL': upstream_url,
+        'GATEWAY_PORT': str(port),
+        # Un único cliente genera toda la carga: sin rate limiting
+        'GATEWAY_RATE_LIMIT_ENABLED': 'false',
+        'PYTHONPATH': os.pathsep.join([GATEWAY_DIR, ROOT_DIR]),
+    }
+    cmd = ['-c', FLASK_SERVER] if mode == 'flask' else ['async_app.py']
+    proc = spawn(cmd, port, cwd=GATEWAY_DIR, env=env)
+    try:
+        # Calentamiento para abrir los pools antes de medir
+        run_load(f'http://127.0.0.1:{port}', lambda i: MIX[i % len(MIX)], total=100,
+                 concurrency=args.concurrency)
+        result = run_load(f'http://127.0.0.1:{port}', lambda i: MIX[i % len(MIX)],
+                          total=args.requests, concurrency=args.concurrency)
+        result['status_ms'] = time_status(port)
+        return result
+    finally:
+        stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--delay-ms', type=float, default=20)
+    parser.add_argument('--items', type=int, default=50)
+    parser.add_argument('--modes', default='flask,async')
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = spawn([STUB, '--port', str(stub_port), '--delay-ms', str(args.delay_ms),
+                  '--items', str(args.items)], stub_port)
+    try:
+        report = {mode: bench_mode(mode, f'http://127.0.0.1:{stub_port}', args)
+                  for mode in args.modes.split(',')}
+    finally:
+        stop(stub)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Utilidades comunes de los benchmarks: procesos auxiliares y generador de carga."""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Port {port} did not open within {timeout}s')
+
+
+def spawn(args, port, cwd=None, env=None, log=None, timeout=15.0):
+    """Lanza un proceso Python auxiliar y espera a que escuche en ``port``.
+
+    ``log`` es un fichero abierto donde va su salida (por defecto se descarta).
+    """
+    proc_env = dict(os.environ)
+    proc_env.update(env or {})
+    output = log or subprocess.DEVNULL
+    proc = subprocess.Popen([sys.executable] + args, cwd=cwd, env=proc_env,
+                            stdout=output, stderr=subprocess.STDOUT if log else subprocess.DEVNULL)
+    try:
+        wait_for_port(port, timeout)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, errors, elapsed):
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'errors': errors,
+        'throughput_rps': round(total / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def _report(results, elapsed):
+    all_latencies = [lat for bucket in results.values() for lat in bucket['latencies']]
+    all_errors = sum(bucket['errors'] for bucket in results.values())
+    return {
+        'overall': summarize(all_latencies, all_errors, elapsed),
+        'routes': {label: summarize(bucket['latencies'], bucket['errors'], elapsed)
+                   for label, bucket in sorted(results.items())},
+    }
+
+
+async def _drive(base_url, next_request, total, concurrency, results):
+    counter = iter(range(total))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            for i in counter:
+                method, path, body, label = next_request(i)
+                started = time.perf_counter()
+                ok = False
+                try:
+                    async with session.request(method, base_url + path, json=body) as response:
+                        await response.read()
+                        ok = response.status < 500
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                elapsed = time.perf_counter() - started
+                bucket = results.setdefault(label, {'latencies': [], 'errors': 0})
+                if ok:
+                    bucket['latencies'].append(elapsed)
+                else:
+                    bucket['errors'] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def run_load(base_url, next_request, total=2000, concurrency=32):
+    """Ejecuta ``total`` peticiones con ``concurrency`` clientes simultáneos.
+
+    ``next_request(i)`` devuelve (método, ruta, cuerpo_json, etiqueta). Devuelve
+    un resumen global y otro por etiqueta con throughput y p50/p95/p99.
+    """
+    results = {}
+    started = time.perf_counter()
+    asyncio.run(_drive(base_url, next_request, total, concurrency, results))
+    return _report(results, time.perf_counter() - started)
+
+
+class FlowFailed(Exception):
+    """Un paso del flujo falló; el resto del flujo no tiene sentido."""
+
+
+class _Exhausted(Exception):
+    pass
+
+
+class FlowSession:
+    """Cliente de un usuario virtual: cada llamada se mide con su etiqueta."""
+
+    def __init__(self, session, base_url, budget, results, rng):
+        self._session = session
+        self._base_url = base_url
+        self._budget = budget
+        self._results = results
+        self.rng = rng
+
+    async def call(self, label, method, path, json=None, headers=None):
+        """Hace la petición y devuelve el JSON de la respuesta.
+
+        Lanza ``FlowFailed`` si falla (error de red o status >= 400), después
+        de contarla como error de ``label``.
+        """
+        if next(self._budget, None) is None:
+            raise _Exhausted()
+        started = time.perf_counter()
+        payload = None
+        ok = False
+        try:
+            async with self._session.request(method, self._base_url + path, json=json,
+                                             headers=headers) as response:
+                body = await response.read()
+                ok = response.status < 400
+                if ok and body:
+                    payload = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            ok = False
+        elapsed = time.perf_counter() - started
+        bucket = self._results.setdefault(label, {'latencies': [], 'errors': 0})
+        if ok:
+            bucket['latencies'].append(elapsed)
+            return payload
+        bucket['errors'] += 1
+        raise FlowFailed(f'{method} {path}')
+
+
+async def _drive_flows(base_url, flows, total, concurrency, results, seed):
+    budget = iter(range(total))
+    weights = [weight for weight, _ in flows]
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def virtual_user(index):
+            rng = random.Random(seed * 1000003 + index)
+            client = FlowSession(session, base_url, budget, results, rng)
+            while True:
+                flow = rng.choices(flows, weights)[0][1]
+                try:
+                    await flow(client)
+                except FlowFailed:
+                    continue
+                except _Exhausted:
+                    return
+
+        await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+
+
+def run_flows(base_url, flows, total=2000, concurrency=32, seed=0):
+    """Como ``run_load`` pero con flujos de varios pasos (crear pedido, pagarlo...).
+
+    ``flows`` es una lista de (peso, corrutina); cada usuario virtual elige
+    un flujo según los pesos y lo ejecuta con ``await flow(session)``, donde
+    ``session.call(etiqueta, método, ruta, json, headers)`` devuelve el JSON
+    de la respuesta. Se detiene al hacer ``total`` peticiones.
+    """
+    results = {}
+    started = time.perf_counter()
+    asyncio.run(_drive_flows(base_url, flows, total, concurrency, results, seed))
+    return _report(results, time.perf_counter() - started)
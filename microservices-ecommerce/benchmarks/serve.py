@@ -0,0 +1,30 @@
+"""Arranca un servicio con gunicorn, opcionalmente sobre mongomock.
+
+Se ejecuta desde el directorio del servicio y recibe los argumentos de
+gunicorn tal cual; ``--mongomock`` instala el sustituto de MongoDB
+(``standins.install_mongomock``) antes de que gunicorn cargue la aplicación.
+
+Uso:
+    python ../benchmarks/serve.py --mongomock -c ../common/gunicorn_conf.py --bind 127.0.0.1:5002 wsgi:app
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import install_mongomock  # noqa: E402
+
+
+def main():
+    args = sys.argv[1:]
+    if '--mongomock' in args:
+        args.remove('--mongomock')
+        install_mongomock()
+
+    from gunicorn.app.wsgiapp import run
+    sys.argv = ['gunicorn'] + args
+    run()
+
+
+if __name__ == '__main__':
+    main()
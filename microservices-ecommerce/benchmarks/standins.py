@@ -0,0 +1,136 @@
+"""Sustitutos locales de las dependencias de los servicios para los benchmarks.
+
+- PostgreSQL embebido: ``initdb`` + ``pg_ctl`` en un directorio temporal y
+  un puerto libre (necesita los binarios de PostgreSQL; se buscan en
+  ``PG_BIN``, en el PATH y en ``/usr/lib/postgresql/*/bin``). Cada servicio
+  usa su propio esquema (``with_search_path``), igual que con un servidor
+  existente.
+- MongoDB: ``install_mongomock()`` sustituye ``pymongo.MongoClient`` por un
+  cliente de mongomock con un almacén compartido por todo el proceso.
+- RabbitMQ: ``RABBITMQ_URL=memory://`` (``common.memory_broker``).
+"""
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+from urllib.parse import quote
+
+from loadgen import free_port
+
+
+def with_search_path(url, schema):
+    """Añade ``options=-csearch_path=<schema>`` a la URL de conexión."""
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}options={quote(f'-csearch_path={schema}')}"
+
+
+def _run_admin(url, statements):
+    import psycopg2
+
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        for statement in statements:
+            cur.execute(statement)
+        cur.close()
+    finally:
+        conn.close()
+
+
+def reset_schemas(url, *schemas):
+    """Borra y vuelve a crear ``schemas`` (vacíos) en la base de datos de ``url``."""
+    _run_admin(url, [sql for schema in schemas
+                     for sql in (f'DROP SCHEMA IF EXISTS {schema} CASCADE', f'CREATE SCHEMA {schema}')])
+
+
+def drop_schemas(url, *schemas):
+    _run_admin(url, [f'DROP SCHEMA IF EXISTS {schema} CASCADE' for schema in schemas])
+
+
+def find_pg_bin():
+    """Directorio con ``initdb`` y ``pg_ctl`` o None."""
+    candidates = [os.getenv('PG_BIN')]
+    pg_ctl = shutil.which('pg_ctl')
+    if pg_ctl:
+        candidates.append(os.path.dirname(pg_ctl))
+    candidates += sorted(glob.glob('/usr/lib/postgresql/*/bin'), reverse=True)
+    for path in candidates:
+        if path and os.path.exists(os.path.join(path, 'initdb')) and os.path.exists(os.path.join(path, 'pg_ctl')):
+            return path
+    return None
+
+
+class EmbeddedPostgres:
+    """Servidor PostgreSQL desechable (datos en un directorio temporal).
+
+    Se arranca con ``fsync=off``: los benchmarks miden el servicio, no el disco.
+    """
+
+    def __init__(self, bin_dir):
+        self.bin_dir = bin_dir
+        self.data_dir = None
+        self.port = None
+
+    def _run(self, tool, *args):
+        subprocess.run([os.path.join(self.bin_dir, tool)] + list(args), check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def start(self):
+        """Crea el cluster, lo arranca y devuelve su URL de conexión."""
+        self.data_dir = tempfile.mkdtemp(prefix='bench-pg-')
+        self.port = free_port()
+        try:
+            self._run('initdb', '-D', self.data_dir, '-U', 'postgres', '-A', 'trust', '--no-sync')
+            options = (f'-p {self.port} -k {self.data_dir} -c listen_addresses=127.0.0.1 '
+                       f'-c fsync=off -c max_connections=200')
+            self._run('pg_ctl', '-D', self.data_dir, '-o', options, '-w',
+                      '-l', os.path.join(self.data_dir, 'server.log'), 'start')
+        except subprocess.CalledProcessError as e:
+            self.stop()
+            raise RuntimeError(f'Could not start embedded PostgreSQL: {e.stderr.decode(errors="replace")}') from e
+        return f'postgresql://postgres@127.0.0.1:{self.port}/postgres'
+
+    def stop(self):
+        if self.data_dir is None:
+            return
+        try:
+            self._run('pg_ctl', '-D', self.data_dir, '-m', 'fast', '-w', 'stop')
+        except subprocess.CalledProcessError:
+            pass
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        self.data_dir = None
+
+
+class _Topology:
+    """Lo que ``order-service/mongo.py`` consulta de la topología del driver."""
+    topology_type_name = 'Single'
+
+    def has_readable_server(self):
+        return True
+
+
+def install_mongomock():
+    """Sustituye ``pymongo.MongoClient`` por mongomock antes de importar el servicio.
+
+    Todos los clientes del proceso comparten el almacén, así que los datos
+    sobreviven a ``close_client()`` (p. ej. el del master de gunicorn antes
+    del fork). Cada proceso tiene su copia: con mongomock el Order Service
+    debe ir con un solo worker.
+    """
+    import mongomock
+    import pymongo
+    from mongomock.store import ServerStore
+
+    store = ServerStore()
+
+    class SharedMongoClient(mongomock.MongoClient):
+        topology_description = _Topology()
+
+        def __init__(self, host=None, port=None, **kwargs):
+            kwargs.pop('event_listeners', None)
+            super().__init__(host, port, _store=store, **kwargs)
+
+    pymongo.MongoClient = SharedMongoClient
+    return SharedMongoClient
@@ -0,0 +1,77 @@
+"""Microservicios falsos para benchmarks del gateway.
+
+Levanta un servidor aiohttp que responde como user/order/payment-service
+(rutas /health, /users, /orders, /payments y sus detalles) con un retardo
+artificial configurable, sin necesitar PostgreSQL ni MongoDB.
+
+Uso:
+    python stub_upstreams.py --port 5901 --delay-ms 20 --items 50
+"""
+import argparse
+import asyncio
+import json
+
+from aiohttp import web
+
+
+def build_payloads(items):
+    users = [{'id': i, 'name': f'User {i}', 'email': f'user{i}@example.com',
+              'status': 'active'} for i in range(1, items + 1)]
+    orders = [{'_id': f'{i:024x}', 'user_id': i, 'status': 'pending', 'total': 1200,
+               'items': [{'product': 'Laptop', 'quantity': 1, 'price': 1200}]}
+              for i in range(1, items + 1)]
+    payments = [{'id': i, 'order_id': i, 'user_id': i, 'amount': 1200.0,
+                 'currency': 'COP', 'status': 'pending'} for i in range(1, items + 1)]
+    return {
+        'users': json.dumps({'success': True, 'count': items, 'users': users}).encode(),
+        'orders': json.dumps({'success': True, 'count': items, 'orders': orders}).encode(),
+        'payments': json.dumps({'success': True, 'count': items, 'payments': payments}).encode(),
+    }
+
+
+def create_app(delay_ms=0, items=10):
+    payloads = build_payloads(items)
+    delay = delay_ms / 1000.0
+
+    async def respond(body, status=200):
+        if delay:
+            await asyncio.sleep(delay)
+        return web.Response(body=body, status=status, content_type='application/json')
+
+    async def health(request):
+        return await respond(b'{"status": "healthy"}')
+
+    def collection(name):
+        async def handler(request):
+            if request.method == 'POST':
+                await request.read()
+                return await respond(json.dumps({'success': True, name[:-1]: {'id': 1}}).encode(), 201)
+            return await respond(payloads[name])
+        return handler
+
+    def detail(name):
+        async def handler(request):
+            return await respond(json.dumps({'success': True, name[:-1]: {'id': request.match_info['id']}}).encode())
+        return handler
+
+    async def update_status(request):
+        await request.read()
+        return await respond(b'{"success": true, "message": "Status updated successfully"}')
+
+    app = web.Application()
+    app.router.add_get('/health', health)
+    for name in ('users', 'orders', 'payments'):
+        app.router.add_route('*', f'/{name}', collection(name))
+        app.router.add_get(f'/{name}/{{id}}', detail(name))
+        app.router.add_put(f'/{name}/{{id}}/status', update_status)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stub upstreams para benchmarks')
+    parser.add_argument('--port', type=int, default=5901)
+    parser.add_argument('--delay-ms', type=float, default=0)
+    parser.add_argument('--items', type=int, default=10)
+    args = parser.parse_args()
+    web.run_app(create_app(args.delay_ms, args.items), host='127.0.0.1', port=args.port,
+                print=None, access_log=None)
@@ -0,0 +1,386 @@
+"""Prueba de carga de extremo a extremo: los cuatro servicios sobre sustitutos locales.
+
+Arranca con gunicorn (``common/gunicorn_conf.py``) el API Gateway y los
+microservicios que necesiten las mezclas elegidas, sobre:
+
+- PostgreSQL: ``--database-url`` (un servidor existente) o, si no se indica,
+  un PostgreSQL embebido (``standins.EmbeddedPostgres``). User y Payment
+  Service usan cada uno su esquema (``bench_users``, ``bench_payments``),
+  que se crea vacío al empezar y se borra al terminar.
+- MongoDB: ``--mongodb-url`` (un mongod existente, base ``bench_orderdb``) o
+  mongomock dentro del Order Service.
+- RabbitMQ: el broker en memoria (``RABBITMQ_URL=memory://``).
+
+Siembra usuarios, pedidos y pagos con los endpoints ``/bulk`` y ejecuta cada
+mezcla a través del gateway con ``--concurrency`` usuarios virtuales. El
+informe (JSON) da throughput y p50/p95/p99 por mezcla y por ruta.
+
+Con ``--baseline`` compara el resultado con un informe guardado antes (con
+``--save-baseline``, en la misma máquina y con los mismos parámetros) y sale
+con código 1 si alguna ruta pierde más de ``--tolerance`` de throughput,
+empeora su p95/p99 más de ``--tolerance`` (y de ``--slack-ms``) o falla más.
+
+Uso:
+    python benchmarks/suite.py --mixes mixed --requests 3000 --concurrency 32
+    python benchmarks/suite.py --mixes orders --save-baseline benchmarks/baseline-orders.json
+    python benchmarks/suite.py --mixes orders --baseline benchmarks/baseline-orders.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import sys
+import uuid
+
+from loadgen import ROOT_DIR, free_port, run_flows, spawn, stop
+from standins import EmbeddedPostgres, drop_schemas, find_pg_bin, reset_schemas, with_search_path
+
+SERVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py')
+GUNICORN_CONF = os.path.join(ROOT_DIR, 'common', 'gunicorn_conf.py')
+
+# servicio -> (directorio, variable con su URL en el gateway, esquema de PostgreSQL)
+SERVICES = {
+    'user': ('user-service', 'USER_SERVICE_URL', 'bench_users'),
+    'order': ('order-service', 'ORDER_SERVICE_URL', None),
+    'payment': ('payment-service', 'PAYMENT_SERVICE_URL', 'bench_payments'),
+}
+MONGO_DB = 'bench_orderdb'
+PRODUCTS = [('Laptop', 1200), ('Mouse', 25), ('Monitor', 300), ('Keyboard', 45)]
+ORDER_STATUSES = ['confirmed', 'shipped', 'delivered']
+# Métricas que se comparan con la línea base: (clave, True si más es mejor)
+COMPARED = [('throughput_rps', True), ('p95_ms', False), ('p99_ms', False)]
+
+
+class Dataset:
+    """Ids sembrados que usan los flujos."""
+
+    def __init__(self):
+        self.user_ids = []
+        self.order_ids = []
+        self.payment_ids = []
+
+
+def new_order(rng, user_id):
+    product, price = rng.choice(PRODUCTS)
+    quantity = rng.randint(1, 3)
+    return {'user_id': user_id,
+            'items': [{'product': product, 'quantity': quantity, 'price': price}],
+            'total': price * quantity}
+
+
+# ---------- flujos ----------
+# Cada flujo es una corrutina que recibe la sesión del usuario virtual; las
+# etiquetas agrupan las rutas con parámetros.
+
+def browse_flow(data):
+    async def flow(session):
+        rng = session.rng
+        await session.call('GET /api/orders', 'GET', '/api/orders?limit=20')
+        await session.call('GET /api/orders/<id>', 'GET', f'/api/orders/{rng.choice(data.order_ids)}')
+        await session.call('GET /api/users/<id>', 'GET', f'/api/users/{rng.choice(data.user_ids)}')
+        await session.call('GET /api/payments', 'GET', f'/api/payments?limit=20&user_id={rng.choice(data.user_ids)}')
+        await session.call('GET /api/payments/<id>', 'GET', f'/api/payments/{rng.choice(data.payment_ids)}')
+    return flow
+
+
+def checkout_flow(data):
+    async def flow(session):
+        rng = session.rng
+        user_id = rng.choice(data.user_ids)
+        order = new_order(rng, user_id)
+        created = await session.call('POST /api/orders', 'POST', '/api/orders', json=order,
+                                     headers={'Idempotency-Key': uuid.uuid4().hex})
+        order_id = created['order']['_id']
+        # payments.order_id es numérico (número sintético); order_ref enlaza con el pedido
+        payment = await session.call('POST /api/payments', 'POST', '/api/payments', json={
+            'order_id': rng.randint(1, 10 ** 6), 'order_ref': order_id, 'user_id': user_id,
+            'amount': order['total'], 'payment_method': 'credit_card'},
+            headers={'Idempotency-Key': uuid.uuid4().hex})
+        # Con RabbitMQ el pedido pasa a 'paid' por la saga de Order Service; el broker
+        # en memoria es de cada proceso y aquí el evento no llega al Order Service
+        await session.call('PUT /api/payments/<id>/status', 'PUT',
+                           f"/api/payments/{payment['payment']['id']}/status", json={'status': 'completed'})
+        await session.call('GET /api/orders/<id>', 'GET', f'/api/orders/{order_id}')
+    return flow
+
+
+def order_reads_flow(data):
+    async def flow(session):
+        await session.call('GET /api/orders', 'GET', '/api/orders?limit=20')
+        await session.call('GET /api/orders/<id>', 'GET', f'/api/orders/{session.rng.choice(data.order_ids)}')
+    return flow
+
+
+def order_writes_flow(data):
+    async def flow(session):
+        rng = session.rng
+        created = await session.call('POST /api/orders', 'POST', '/api/orders',
+                                     json=new_order(rng, rng.randint(1, 1000)),
+                                     headers={'Idempotency-Key': uuid.uuid4().hex})
+        order_id = created['order']['_id']
+        await session.call('PUT /api/orders/<id>/status', 'PUT', f'/api/orders/{order_id}/status',
+                           json={'status': rng.choice(ORDER_STATUSES)})
+    return flow
+
+
+# mezcla -> (servicios que necesita, [(peso, fábrica de flujo)])
+MIXES = {
+    'browse': ({'user', 'order', 'payment'}, [(1, browse_flow)]),
+    'checkout': ({'user', 'order', 'payment'}, [(1, checkout_flow)]),
+    'mixed': ({'user', 'order', 'payment'}, [(4, browse_flow), (1, checkout_flow)]),
+    # Solo Order Service: no necesita PostgreSQL
+    'orders': ({'order'}, [(3, order_reads_flow), (1, order_writes_flow)]),
+}
+
+
+# ---------- entorno ----------
+
+class Environment:
+    """Sustitutos, microservicios y gateway en marcha; ``close()`` lo para todo."""
+
+    def __init__(self, args, services):
+        self.args = args
+        self.services = services
+        self.pg_schemas = [SERVICES[name][2] for name in sorted(services) if SERVICES[name][2]]
+        self.procs = []
+        self.postgres = None
+        self.database_url = None
+        self.gateway_url = None
+        self.log = open(args.log, 'a') if args.log else None
+
+    def _common_env(self, service_dir):
+        env = {
+            'PYTHONPATH': os.pathsep.join([service_dir, ROOT_DIR]),
+            'RABBITMQ_URL': 'memory://',
+            'GUNICORN_WORKERS': str(self.args.workers),
+            'GUNICORN_THREADS': str(self.args.threads),
+            'GUNICORN_LOG_LEVEL': 'warning',
+        }
+        env.update(self.args.env)
+        return env
+
+    def _start(self, service_dir, env, mongomock=False):
+        port = free_port()
+        cmd = [SERVE] + (['--mongomock'] if mongomock else []) + [
+            '-c', GUNICORN_CONF, '--bind', f'127.0.0.1:{port}', 'wsgi:app']
+        self.procs.append(spawn(cmd, port, cwd=service_dir, env=env, log=self.log, timeout=60))
+        return f'http://127.0.0.1:{port}'
+
+    def _start_postgres(self):
+        if self.args.database_url:
+            return self.args.database_url
+        bin_dir = find_pg_bin()
+        if bin_dir is None:
+            raise RuntimeError('PostgreSQL binaries not found: set PG_BIN or pass --database-url '
+                               '(or use --mixes orders, which only needs the Order Service)')
+        self.postgres = EmbeddedPostgres(bin_dir)
+        return self.postgres.start()
+
+    def start(self):
+        urls = {}
+        if self.pg_schemas:
+            self.database_url = self._start_postgres()
+            reset_schemas(self.database_url, *self.pg_schemas)
+
+        for name in sorted(self.services):
+            directory, url_var, schema = SERVICES[name]
+            service_dir = os.path.join(ROOT_DIR, directory)
+            env = self._common_env(service_dir)
+            mongomock = False
+            if schema:
+                env['DATABASE_URL'] = with_search_path(self.database_url, schema)
+            elif self.args.mongodb_url:
+                env.update({'MONGODB_URL': self.args.mongodb_url, 'MONGODB_DB': MONGO_DB})
+                drop_mongo_database(self.args.mongodb_url)
+            else:
+                # Los datos de mongomock viven en el proceso: un solo worker
+                env.update({'MONGODB_DB': MONGO_DB, 'GUNICORN_WORKERS': '1'})
+                mongomock = True
+            urls[url_var] = self._start(service_dir, env, mongomock)
+
+        gateway_dir = os.path.join(ROOT_DIR, 'api-gateway')
+        env = self._common_env(gateway_dir)
+        # Todos los usuarios virtuales salen de la misma IP: sin rate limiting salvo --env explícito
+        env.setdefault('GATEWAY_RATE_LIMIT_ENABLED', 'false')
+        # Los servicios que no se arrancan apuntan a un puerto cerrado
+        closed = f'http://127.0.0.1:{free_port()}'
+        for _, url_var, _ in SERVICES.values():
+            env[url_var] = urls.get(url_var, closed)
+        self.gateway_url = self._start(gateway_dir, env)
+
+    def close(self):
+        for proc in reversed(self.procs):
+            stop(proc)
+        self.procs.clear()
+        if self.database_url and self.postgres is None and not self.args.keep_data:
+            try:
+                drop_schemas(self.database_url, *self.pg_schemas)
+            except Exception as e:
+                print(f'Could not drop benchmark schemas: {e}', file=sys.stderr)
+        if self.postgres is not None:
+            self.postgres.stop()
+        if self.log is not None:
+            self.log.close()
+
+
+def drop_mongo_database(url):
+    from pymongo import MongoClient
+
+    client = MongoClient(url, serverSelectionTimeoutMS=5000)
+    try:
+        client.drop_database(MONGO_DB)
+    finally:
+        client.close()
+
+
+# ---------- siembra ----------
+
+def post_bulk(base_url, path, key, items):
+    """POST /<recurso>/bulk en lotes de 1000; devuelve los ids creados."""
+    import requests
+
+    ids = []
+    for start in range(0, len(items), 1000):
+        response = requests.post(f'{base_url}{path}', json={key: items[start:start + 1000]}, timeout=120)
+        if response.status_code not in (201, 207):
+            raise RuntimeError(f'Seeding {path} failed: {response.status_code} {response.text[:200]}')
+        ids += [result['id'] for result in response.json()['results'] if result['status'] == 201]
+    return ids
+
+
+def seed(base_url, services, args):
+    import random
+
+    rng = random.Random(args.seed)
+    data = Dataset()
+    run_id = uuid.uuid4().hex[:8]
+    if 'user' in services:
+        data.user_ids = post_bulk(base_url, '/api/users/bulk', 'users', [
+            {'name': f'Bench User {i}', 'email': f'bench-{run_id}-{i}@example.com'}
+            for i in range(args.users)])
+    else:
+        data.user_ids = list(range(1, args.users + 1))
+    if 'order' in services:
+        data.order_ids = post_bulk(base_url, '/api/orders/bulk', 'orders', [
+            new_order(rng, rng.choice(data.user_ids)) for _ in range(args.orders)])
+    if 'payment' in services:
+        data.payment_ids = post_bulk(base_url, '/api/payments/bulk', 'payments', [
+            {'order_id': i + 1, 'user_id': rng.choice(data.user_ids), 'amount': rng.choice(PRODUCTS)[1],
+             'payment_method': 'credit_card', 'transaction_id': f'TXN-{run_id}-{i}'}
+            for i in range(args.orders)])
+    return data
+
+
+# ---------- línea base ----------
+
+def compare(report, baseline, tolerance, slack_ms):
+    """Lista de regresiones de ``report`` frente a ``baseline`` (mismas mezclas y rutas)."""
+    regressions = []
+    for mix, base_result in baseline.get('mixes', {}).items():
+        result = report['mixes'].get(mix)
+        if result is None:
+            continue
+        pairs = [('overall', base_result['overall'], result['overall'])]
+        pairs += [(route, base, result['routes'].get(route)) for route, base in base_result['routes'].items()]
+        for route, base, current in pairs:
+            if current is None:
+                regressions.append(f'{mix} {route}: missing from this run')
+                continue
+            for key, higher_is_better in COMPARED:
+                old, new = base[key], current[key]
+                if higher_is_better and new < old * (1 - tolerance):
+                    regressions.append(f'{mix} {route}: {key} {new} < {old}')
+                elif not higher_is_better and new > old * (1 + tolerance) + slack_ms:
+                    regressions.append(f'{mix} {route}: {key} {new} > {old}')
+            old_rate = base['errors'] / base['requests'] if base['requests'] else 0.0
+            new_rate = current['errors'] / current['requests'] if current['requests'] else 0.0
+            if new_rate > old_rate + 0.001:
+                regressions.append(f'{mix} {route}: error rate {new_rate:.2%} > {old_rate:.2%}')
+    return regressions
+
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        env[name] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mixes', default='mixed', help=f"separadas por comas: {', '.join(MIXES)}")
+    parser.add_argument('--requests', type=int, default=3000, help='peticiones por mezcla')
+    parser.add_argument('--warmup', type=int, default=300, help='peticiones de calentamiento por mezcla')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=1, help='GUNICORN_WORKERS de cada servicio')
+    parser.add_argument('--threads', type=int, default=16, help='GUNICORN_THREADS de cada servicio')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=2000, help='pedidos (y pagos) sembrados')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', help='PostgreSQL existente (por defecto, uno embebido)')
+    parser.add_argument('--mongodb-url', help='mongod existente (por defecto, mongomock)')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='variable extra para todos los servicios (p. ej. GATEWAY_CACHE_ENABLED=false)')
+    parser.add_argument('--log', help='fichero donde va la salida de los servicios')
+    parser.add_argument('--keep-data', action='store_true', help='no borrar los esquemas al terminar')
+    parser.add_argument('--output', help='escribe el informe en este fichero además de en stdout')
+    parser.add_argument('--save-baseline', help='guarda el informe como línea base')
+    parser.add_argument('--baseline', help='línea base con la que comparar (código 1 si hay regresiones)')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='pérdida de throughput o aumento de p95/p99 tolerados (0.2 = 20 %%)')
+    parser.add_argument('--slack-ms', type=float, default=2.0,
+                        help='margen absoluto para p95/p99, evita falsos positivos en latencias pequeñas')
+    args = parser.parse_args()
+    args.env = parse_env(args.env)
+
+    mixes = [mix for mix in args.mixes.split(',') if mix]
+    unknown = [mix for mix in mixes if mix not in MIXES]
+    if unknown:
+        parser.error(f"unknown mixes: {', '.join(unknown)}")
+    services = set().union(*(MIXES[mix][0] for mix in mixes))
+
+    report = {
+        'config': {'requests': args.requests, 'concurrency': args.concurrency, 'workers': args.workers,
+                   'threads': args.threads, 'users': args.users, 'orders': args.orders,
+                   'cpus': os.cpu_count(), 'python': sys.version.split()[0], 'env': args.env},
+        'mixes': {},
+    }
+    environment = Environment(args, services)
+    try:
+        try:
+            environment.start()
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+        data = seed(environment.gateway_url, services, args)
+        for mix in mixes:
+            flows = [(weight, factory(data)) for weight, factory in MIXES[mix][1]]
+            run_flows(environment.gateway_url, flows, total=args.warmup,
+                      concurrency=args.concurrency, seed=args.seed + 1)
+            report['mixes'][mix] = run_flows(environment.gateway_url, flows, total=args.requests,
+                                             concurrency=args.concurrency, seed=args.seed)
+    finally:
+        environment.close()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                f.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ('requests', 'concurrency', 'workers', 'threads'):
+            if baseline.get('config', {}).get(key) != report['config'][key]:
+                print(f'Warning: baseline was recorded with {key}={baseline["config"].get(key)}',
+                      file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance, args.slack_ms)
+        if regressions:
+            print('Regressions against baseline:\n  ' + '\n  '.join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
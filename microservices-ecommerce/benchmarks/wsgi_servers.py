@@ -0,0 +1,93 @@
+"""Benchmark: servidor de desarrollo de Flask frente a gunicorn.
+
+Levanta el gateway Flask (``api-gateway/app.py``) como se hacía con
+``python app.py`` (werkzeug con ``debug=True``, sin recargador) y con
+gunicorn usando ``common/gunicorn_conf.py`` en las combinaciones de workers
+e hilos pedidas. Todos apuntan a los mismos microservicios falsos
+(``stub_upstreams.py``). La caché y la coalescencia del gateway se
+desactivan para que cada petición llegue al upstream y se mida el servidor.
+
+Uso:
+    python benchmarks/wsgi_servers.py --requests 3000 --concurrency 64 --configs 1x8,2x8,4x8
+"""
+import argparse
+import json
+import os
+import sys
+
+from loadgen import ROOT_DIR, free_port, run_load, spawn, stop
+
+GATEWAY_DIR = os.path.join(ROOT_DIR, 'api-gateway')
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_upstreams.py')
+GUNICORN_CONF = os.path.join(ROOT_DIR, 'common', 'gunicorn_conf.py')
+
+DEV_SERVER = (
+    "import os, app; "
+    "app.app.run(host='127.0.0.1', port=int(os.environ['GATEWAY_PORT']), debug=True, use_reloader=False)"
+)
+
+MIX = [
+    ('GET', '/api/orders', None, 'GET /api/orders'),
+    ('GET', '/api/users/1', None, 'GET /api/users/<id>'),
+    ('GET', '/api/payments', None, 'GET /api/payments'),
+    ('POST', '/api/orders', {'user_id': 1, 'items': [{'product': 'Laptop', 'quantity': 1}]}, 'POST /api/orders'),
+]
+
+
+def bench_server(name, upstream_url, args):
+    port = free_port()
+    env = {
+        'USER_SERVICE_URL': upstream_url,
+        'ORDER_SERVICE_URL': upstream_url,
+        'PAYMENT_SERVICE_URL': upstream_url,
+        'GATEWAY_PORT': str(port),
+        'GATEWAY_CACHE_ENABLED': 'false',
+        'GATEWAY_SINGLEFLIGHT_ENABLED': 'false',
+        'GATEWAY_RATE_LIMIT_ENABLED': 'false',
+        'PYTHONPATH': os.pathsep.join([GATEWAY_DIR, ROOT_DIR]),
+    }
+    if name == 'dev':
+        cmd = ['-c', DEV_SERVER]
+    else:
+        workers, threads = name.split('x')
+        env.update({'GUNICORN_WORKERS': workers, 'GUNICORN_THREADS': threads,
+                    'GUNICORN_LOG_LEVEL': 'warning'})
+        cmd = ['-m', 'gunicorn', '-c', GUNICORN_CONF, '--bind', f'127.0.0.1:{port}', 'wsgi:app']
+    proc = spawn(cmd, port, cwd=GATEWAY_DIR, env=env)
+    try:
+        # Calentamiento: abre los pools de todos los workers antes de medir
+        run_load(f'http://127.0.0.1:{port}', lambda i: MIX[i % len(MIX)], total=200,
+                 concurrency=args.concurrency)
+        return run_load(f'http://127.0.0.1:{port}', lambda i: MIX[i % len(MIX)],
+                        total=args.requests, concurrency=args.concurrency)
+    finally:
+        stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--delay-ms', type=float, default=10)
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--configs', default='1x8,2x8,4x8',
+                        help='combinaciones de gunicorn WORKERSxTHREADS separadas por comas')
+    args = parser.parse_args()
+
+    servers = ['dev'] + [config for config in args.configs.split(',') if config]
+    stub_port = free_port()
+    stub = spawn([STUB, '--port', str(stub_port), '--delay-ms', str(args.delay_ms),
+                  '--items', str(args.items)], stub_port)
+    try:
+        report = {'cpus': os.cpu_count(), 'python': sys.version.split()[0]}
+        for name in servers:
+            report['dev (werkzeug, debug)' if name == 'dev' else f'gunicorn {name}'] = \
+                bench_server(name, f'http://127.0.0.1:{stub_port}', args)
+    finally:
+        stop(stub)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Código compartido entre los microservicios (se copia en cada imagen Docker)."""
@@ -0,0 +1,42 @@
+"""Utilidades comunes de los endpoints de creación en lote (``POST /<recurso>/bulk``).
+
+Cada elemento recibe su propio resultado con el código que habría devuelto
+el endpoint individual (201, 400, 409...). La respuesta es 201 si se crearon
+todos y 207 (Multi-Status) si alguno falló.
+"""
+import os
+
+from flask import jsonify
+
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '10000'))
+# Filas por sentencia INSERT (execute_values) o por lote de insert_many
+BULK_PAGE_SIZE = int(os.getenv('BULK_PAGE_SIZE', '1000'))
+
+
+def bulk_items(data, key):
+    """Devuelve (elementos, error) a partir de ``{key: [...]}`` o de una lista JSON."""
+    items = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return None, f'Expected a non-empty list in "{key}"'
+    if len(items) > BULK_MAX_ITEMS:
+        return None, f'Too many items: {len(items)} (max {BULK_MAX_ITEMS})'
+    return items, None
+
+
+def bulk_created(index, resource_id):
+    return {'index': index, 'status': 201, 'id': resource_id}
+
+
+def bulk_error(index, status, message):
+    return {'index': index, 'status': status, 'error': message}
+
+
+def bulk_response(results):
+    created = sum(1 for result in results if result['status'] == 201)
+    failed = len(results) - created
+    return jsonify({
+        'success': failed == 0,
+        'created': created,
+        'failed': failed,
+        'results': results
+    }), (201 if failed == 0 else 207)
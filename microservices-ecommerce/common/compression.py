@@ -0,0 +1,155 @@
+"""Compresión de respuestas negociada con ``Accept-Encoding`` (brotli o gzip).
+
+``enable_compression(app)`` comprime en un ``after_request`` las respuestas
+JSON, NDJSON y de texto desde ``COMPRESSION_MIN_BYTES``. Las respuestas en
+streaming (NDJSON, passthrough del gateway) se comprimen trozo a trozo y
+cada trozo se vacía al cliente según llega. SSE no se comprime: cada evento
+debe salir al momento y son mensajes pequeños.
+
+Las respuestas que ya traen ``Content-Encoding`` (p. ej. un cuerpo que el
+gateway reenvía comprimido por el microservicio) no se tocan. Brotli solo
+se ofrece si el módulo ``brotli`` está instalado.
+"""
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '3'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '3'))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain')
+
+# En caso de empate en q se prefiere el primero
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' o None según ``Accept-Encoding`` (respeta los q, q=0 excluye)."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    wildcard = weights.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = weights.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def should_compress(status, mimetype, content_encoding=None, length=None):
+    """True si la respuesta merece comprimirse (``length`` None: tamaño desconocido, streaming)."""
+    return (COMPRESSION_ENABLED
+            and 200 <= status < 300 and status not in (204, 206)
+            and not content_encoding
+            and (mimetype or '').split(';')[0].strip() in COMPRESSIBLE_MIMETYPES
+            and (length is None or length >= COMPRESSION_MIN_BYTES))
+
+
+class StreamCompressor:
+    """Compresor incremental: ``compress`` devuelve lo que ya se puede enviar."""
+
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding
+        if encoding == 'br':
+            quality = COMPRESSION_BROTLI_QUALITY if level is None else level
+            self._compressor = brotli.Compressor(quality=quality)
+        else:
+            level = COMPRESSION_GZIP_LEVEL if level is None else level
+            # wbits=31: formato gzip (cabecera y CRC) en lugar de zlib
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk, flush=True):
+        """Comprime ``chunk``; con ``flush`` el cliente puede descomprimirlo ya."""
+        if self.encoding == 'br':
+            data = self._compressor.process(chunk)
+            return data + self._compressor.flush() if flush else data
+        data = self._compressor.compress(chunk)
+        return data + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else data
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def compress_bytes(data, encoding, level=None):
+    compressor = StreamCompressor(encoding, level)
+    return compressor.compress(data, flush=False) + compressor.finish()
+
+
+def compress_chunks(chunks, encoding):
+    """Generador que comprime un iterable de trozos; lo cierra siempre al terminar."""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def weaken_etag(etag):
+    """Un ETag fuerte identifica los bytes exactos; tras comprimir pasa a ser débil."""
+    if etag and not etag.startswith('W/'):
+        return f'W/{etag}'
+    return etag
+
+
+def enable_compression(app):
+    """Comprime las respuestas de ``app`` según ``Accept-Encoding``.
+
+    Debe registrarse antes que ``enable_conditional_get``: los hooks
+    ``after_request`` se ejecutan en orden inverso, así que el ETag y el 304
+    se calculan sobre el cuerpo sin comprimir.
+    """
+    if not COMPRESSION_ENABLED:
+        return app
+    from flask import request
+
+    @app.after_request
+    def compress_response(response):
+        if request.method == 'HEAD' or not should_compress(
+                response.status_code, response.mimetype, response.headers.get('Content-Encoding'),
+                response.content_length):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_chunks(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESSION_MIN_BYTES:
+                return response
+            response.set_data(compress_bytes(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = weaken_etag(response.headers['ETag'])
+        return response
+
+    return app
@@ -0,0 +1,506 @@
+"""Consumo de eventos de dominio de RabbitMQ en segundo plano.
+
+``EventConsumer`` suscribe una cola durable a unas routing keys del exchange
+de eventos y reparte los mensajes entre ``concurrency`` hilos manejadores:
+
+- Prefetch: el broker entrega como mucho ``CONSUMER_PREFETCH`` mensajes sin
+  ack por proceso, así que un consumidor lento no acapara la cola.
+- Acks por lotes: en lugar de un ack por mensaje se confirma con
+  ``multiple=True`` el último de un tramo contiguo ya procesado, cada
+  ``CONSUMER_ACK_BATCH`` mensajes o a los ``CONSUMER_ACK_LINGER_MS``.
+- Orden por clave: los mensajes con la misma clave (``key(event)``, p. ej. el
+  pedido) van siempre al mismo hilo y se procesan en orden.
+- Reintentos: si el handler lanza una excepción (p. ej. MongoDB en plena
+  conmutación) se reintenta en el mismo hilo con backoff exponencial desde
+  ``CONSUMER_RETRY_DELAY_MS`` durante ``CONSUMER_RETRY_BUDGET_SECONDS`` (unos
+  segundos: mientras tanto su tag bloquea el tramo de acks).
+- Cola de reintento: si sigue fallando, se publica una copia en
+  ``<cola>.retry`` y el original se confirma con los demás, así que no ocupa
+  el prefetch. Esa cola no tiene consumidores: a los
+  ``CONSUMER_REQUEUE_DELAY_MS`` (TTL) el broker devuelve la copia a la cola
+  principal. La cabecera ``x-retry-count`` cuenta las vueltas; los mensajes
+  posteriores de la misma clave no esperan al aparcado, así que los handlers
+  deben tolerar eventos fuera de orden.
+- Dead-lettering: un mensaje envenenado (no es JSON o le falta el sobre del
+  evento) se rechaza sin reencolar al momento; uno que sigue fallando tras
+  ``CONSUMER_MAX_REQUEUES`` vueltas, también. Ambos acaban en la cola
+  ``<cola>.dead`` (exchange ``<exchange>.dlx``) para revisarlo a mano. Si el
+  consumidor se cierra mientras reintenta, el mensaje se queda sin ack y el
+  broker lo reentrega.
+
+La entrega es al menos una vez (un mensaje sin ack se entrega de nuevo tras
+una reconexión), así que los handlers deben ser idempotentes.
+``RABBITMQ_URL=memory://`` usa el broker en memoria de ``common.memory_broker``.
+"""
+import atexit
+import functools
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from common.events import EVENTS_EXCHANGE, EVENTS_RETRY_MAX_SECONDS, RABBITMQ_URL, Message
+from common.json_provider import loads
+
+CONSUMER_PREFETCH = int(os.getenv('CONSUMER_PREFETCH', '50'))
+CONSUMER_CONCURRENCY = int(os.getenv('CONSUMER_CONCURRENCY', '4'))
+CONSUMER_ACK_BATCH = int(os.getenv('CONSUMER_ACK_BATCH', '20'))
+CONSUMER_ACK_LINGER_MS = float(os.getenv('CONSUMER_ACK_LINGER_MS', '50'))
+CONSUMER_RETRY_DELAY_MS = float(os.getenv('CONSUMER_RETRY_DELAY_MS', '100'))
+# Tiempo reintentando un handler en su hilo antes de aparcar el mensaje en la cola de reintento
+CONSUMER_RETRY_BUDGET_SECONDS = float(os.getenv('CONSUMER_RETRY_BUDGET_SECONDS', '2'))
+# Espera en la cola de reintento (TTL) y vueltas por ella antes de dead-letter
+CONSUMER_REQUEUE_DELAY_MS = float(os.getenv('CONSUMER_REQUEUE_DELAY_MS', '30000'))
+CONSUMER_MAX_REQUEUES = int(os.getenv('CONSUMER_MAX_REQUEUES', '10'))
+RETRY_COUNT_HEADER = 'x-retry-count'
+# Propiedades AMQP que conserva la copia publicada en la cola de reintento
+RETRY_PROPERTIES = ('content_type', 'delivery_mode', 'message_id', 'type', 'app_id', 'timestamp')
+
+
+class ConsumeError(Exception):
+    """Se perdió (o no se pudo abrir) la conexión con el broker."""
+
+
+def dead_letter_names(queue_name, exchange=EVENTS_EXCHANGE):
+    """(exchange, cola) de dead-letter de ``queue_name``."""
+    return f'{exchange}.dlx', f'{queue_name}.dead'
+
+
+def retry_queue_name(queue_name):
+    """Cola con TTL donde esperan los mensajes antes de volver a ``queue_name``."""
+    return f'{queue_name}.retry'
+
+
+def retry_count(message):
+    """Vueltas que lleva el mensaje por la cola de reintento."""
+    headers = message.properties.get('headers') or {}
+    try:
+        return int(headers.get(RETRY_COUNT_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def retry_message(message, attempt):
+    """Copia del mensaje para la cola de reintento con el contador actualizado."""
+    properties = {name: message.properties[name] for name in RETRY_PROPERTIES
+                  if message.properties.get(name) is not None}
+    properties['headers'] = dict(message.properties.get('headers') or {}, **{RETRY_COUNT_HEADER: attempt})
+    return Message(message.routing_key, message.body, properties)
+
+
+class PikaConsumerTransport:
+    """Una conexión y un canal de consumo; el ioloop corre en el hilo de ``run``.
+
+    Declara el exchange topic, la cola durable con su dead-letter exchange,
+    la cola de reintento (TTL y dead-letter de vuelta a la principal por el
+    exchange por defecto) y los bindings, fija el prefetch y consume. Los acks y rechazos llegan desde
+    los hilos manejadores con ``add_callback_threadsafe``.
+    """
+
+    def __init__(self, url, exchange, queue_name, routing_keys, prefetch,
+                 requeue_delay=CONSUMER_REQUEUE_DELAY_MS / 1000.0):
+        import pika
+        self._pika = pika
+        self.url = url
+        self.exchange = exchange
+        self.queue = queue_name
+        self.routing_keys = list(routing_keys)
+        self.prefetch = prefetch
+        self.dead_letter_exchange, self.dead_letter_queue = dead_letter_names(queue_name, exchange)
+        self.retry_queue = retry_queue_name(queue_name)
+        self.requeue_delay = requeue_delay
+        self._connection = None
+        self._channel = None
+        self._error = None
+        self._closing = False
+
+    def run(self, on_message):
+        """Consume hasta ``close()``; lanza ``ConsumeError`` si se pierde la conexión."""
+        self._error = None
+        self._closing = False
+        self._channel = None
+        self._connection = self._pika.SelectConnection(
+            self._pika.URLParameters(self.url),
+            on_open_callback=lambda connection: connection.channel(
+                on_open_callback=functools.partial(self._on_channel_open, on_message)),
+            on_open_error_callback=self._on_closed,
+            on_close_callback=self._on_closed)
+        self._connection.ioloop.start()
+        if self._error is not None and not self._closing:
+            raise ConsumeError(self._error)
+
+    # Callbacks, todos en el hilo del ioloop
+
+    def _on_channel_open(self, on_message, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+
+        def deliver(_channel, method, properties, body):
+            on_message(method.delivery_tag, Message(method.routing_key, body, dict(
+                {name: getattr(properties, name) for name in RETRY_PROPERTIES},
+                headers=properties.headers, redelivered=method.redelivered)))
+
+        def consume():
+            self._channel = channel
+            channel.basic_consume(self.queue, on_message_callback=deliver)
+
+        # Cada paso declara algo y, en su callback, lanza el siguiente
+        steps = [
+            lambda done: channel.basic_qos(prefetch_count=self.prefetch, callback=done),
+            lambda done: channel.exchange_declare(
+                exchange=self.exchange, exchange_type='topic', durable=True, callback=done),
+            lambda done: channel.exchange_declare(
+                exchange=self.dead_letter_exchange, exchange_type='direct', durable=True, callback=done),
+            lambda done: channel.queue_declare(self.dead_letter_queue, durable=True, callback=done),
+            lambda done: channel.queue_bind(
+                self.dead_letter_queue, self.dead_letter_exchange, routing_key=self.queue, callback=done),
+            lambda done: channel.queue_declare(self.queue, durable=True, callback=done, arguments={
+                'x-dead-letter-exchange': self.dead_letter_exchange,
+                'x-dead-letter-routing-key': self.queue}),
+            lambda done: channel.queue_declare(self.retry_queue, durable=True, callback=done, arguments={
+                'x-message-ttl': int(self.requeue_delay * 1000),
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': self.queue}),
+        ] + [
+            functools.partial(lambda key, done: channel.queue_bind(
+                self.queue, self.exchange, routing_key=key, callback=done), key)
+            for key in self.routing_keys
+        ]
+
+        def run_steps(remaining):
+            if not remaining:
+                consume()
+                return
+            remaining[0](lambda _frame: run_steps(remaining[1:]))
+
+        run_steps(steps)
+
+    def _on_channel_closed(self, channel, reason):
+        self._channel = None
+        if self._error is None:
+            self._error = f'Channel closed: {reason}'
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def _on_closed(self, connection, reason):
+        self._channel = None
+        if self._error is None:
+            self._error = str(reason) or repr(reason)
+        connection.ioloop.stop()
+
+    def _on_ioloop(self, callback):
+        connection = self._connection
+        if connection is None:
+            return
+        try:
+            connection.ioloop.add_callback_threadsafe(callback)
+        except Exception:
+            # El ioloop ya se cerró: el broker reentregará lo que no tenga ack
+            pass
+
+    # API del transporte
+
+    def ack(self, tag, multiple=False):
+        channel = self._channel
+        if channel is not None:
+            self._on_ioloop(lambda: channel.basic_ack(tag, multiple=multiple) if channel.is_open else None)
+
+    def reject(self, tag):
+        channel = self._channel
+        if channel is not None:
+            self._on_ioloop(lambda: channel.basic_nack(tag, requeue=False) if channel.is_open else None)
+
+    def retry(self, message):
+        """Publica ``message`` en la cola de reintento; sale antes que el ack del original."""
+        channel = self._channel
+        if channel is None:
+            return
+        properties = self._pika.BasicProperties(**message.properties)
+        self._on_ioloop(lambda: channel.basic_publish('', self.retry_queue, message.body, properties)
+                        if channel.is_open else None)
+
+    def close(self):
+        self._closing = True
+        connection = self._connection
+        if connection is not None:
+            self._on_ioloop(lambda: connection.close() if connection.is_open else connection.ioloop.stop())
+
+
+def create_consumer_transport(url, exchange, queue_name, routing_keys, prefetch,
+                              requeue_delay=CONSUMER_REQUEUE_DELAY_MS / 1000.0):
+    if url.startswith('memory://'):
+        from common.memory_broker import InMemoryConsumerTransport, get_broker
+        return InMemoryConsumerTransport(get_broker(), queue_name, routing_keys, prefetch,
+                                         dead_letter_queue=dead_letter_names(queue_name, exchange)[1],
+                                         requeue_delay=requeue_delay)
+    return PikaConsumerTransport(url, exchange, queue_name, routing_keys, prefetch, requeue_delay)
+
+
+# ---------- consumidor ----------
+
+class EventConsumer:
+    """Hilo de consumo + ``concurrency`` hilos manejadores con acks por lotes.
+
+    ``handler(event)`` recibe el sobre del evento ya decodificado
+    (``event_id``, ``event_type``, ``data``...); si lanza una excepción se
+    reintenta con backoff durante ``retry_budget``, luego pasa por la cola de
+    reintento hasta ``max_requeues`` veces y después va a dead-letter.
+    """
+
+    def __init__(self, name, queue_name, routing_keys, handler, key=None, url=RABBITMQ_URL,
+                 exchange=EVENTS_EXCHANGE, prefetch=CONSUMER_PREFETCH, concurrency=CONSUMER_CONCURRENCY,
+                 ack_batch=CONSUMER_ACK_BATCH, ack_linger=CONSUMER_ACK_LINGER_MS / 1000.0,
+                 retry_delay=CONSUMER_RETRY_DELAY_MS / 1000.0, retry_max=EVENTS_RETRY_MAX_SECONDS,
+                 retry_budget=CONSUMER_RETRY_BUDGET_SECONDS, requeue_delay=CONSUMER_REQUEUE_DELAY_MS / 1000.0,
+                 max_requeues=CONSUMER_MAX_REQUEUES, enabled=True, transport=None):
+        self.name = name
+        self.queue = queue_name
+        self.routing_keys = list(routing_keys)
+        self.handler = handler
+        self.key = key
+        self.url = url
+        self.exchange = exchange
+        self.prefetch = max(1, prefetch)
+        self.concurrency = max(1, concurrency)
+        # Con más acks pendientes que prefetch el broker dejaría de entregar
+        self.ack_batch = max(1, min(ack_batch, self.prefetch))
+        self.ack_linger = ack_linger
+        self.retry_delay = retry_delay
+        self.retry_max = retry_max
+        self.retry_budget = retry_budget
+        self.requeue_delay = requeue_delay
+        self.max_requeues = max_requeues
+        self.enabled = enabled
+
+        self._transport = transport
+        self._lock = threading.Condition()
+        self._thread = None
+        self._workers = []
+        self._pid = os.getpid()
+        self._closed = False
+        # Seguimiento de acks del canal actual (``_generation``)
+        self._generation = 0
+        self._outstanding = deque()
+        self._settled = {}
+        self._ack_upto = None
+        self._pending_acks = 0
+
+        self.received = 0
+        self.handled = 0
+        self.retries = 0
+        self.requeued = 0
+        self.dead_lettered = 0
+        self.poisoned = 0
+        self.ack_calls = 0
+        self.acked = 0
+        self.connects = 0
+        self.failures = 0
+        self.last_error = None
+        atexit.register(self.close)
+
+    # ---------- ciclo de vida ----------
+
+    def start(self):
+        """Arranca el consumo (una vez por proceso; llamar tras el fork)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = None
+                self._workers = []
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._closed = False
+            if self._transport is None:
+                self._transport = create_consumer_transport(
+                    self.url, self.exchange, self.queue, self.routing_keys, self.prefetch,
+                    self.requeue_delay)
+            self._workers = [queue.Queue() for _ in range(self.concurrency)]
+            for index, work in enumerate(self._workers):
+                threading.Thread(target=self._work, args=(work,), name=f'{self.name}-handler-{index}',
+                                 daemon=True).start()
+            threading.Thread(target=self._flush_loop, name=f'{self.name}-acks', daemon=True).start()
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-consumer', daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=2.0):
+        """Deja de consumir; lo que quede sin ack se reentrega a otro consumidor."""
+        with self._lock:
+            if self._closed or self._thread is None:
+                self._closed = True
+                return
+            self._closed = True
+            self._lock.notify_all()
+            thread, workers = self._thread, self._workers
+        self._flush()
+        if self._transport is not None:
+            self._transport.close()
+        for work in workers:
+            work.put(None)
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self):
+        backoff = 0.1
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                self._generation += 1
+                generation = self._generation
+                self._outstanding.clear()
+                self._settled.clear()
+                self._ack_upto = None
+                self._pending_acks = 0
+                self.connects += 1
+            started = time.monotonic()
+            try:
+                self._transport.run(functools.partial(self._dispatch, generation))
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                    self.last_error = str(e)
+            if time.monotonic() - started > 10:
+                backoff = 0.1
+            with self._lock:
+                if self._closed:
+                    return
+                self._lock.wait(backoff)
+            backoff = min(backoff * 2, self.retry_max)
+
+    # ---------- entrega y handlers ----------
+
+    def _dispatch(self, generation, tag, message):
+        """Llamado por el transporte con cada mensaje (en su hilo)."""
+        with self._lock:
+            self._outstanding.append(tag)
+            self.received += 1
+        try:
+            event = loads(message.body)
+            if not isinstance(event, dict):
+                raise ValueError('event is not a JSON object')
+            if not isinstance(event.get('event_type'), str):
+                raise ValueError('event has no event_type')
+        except ValueError as e:
+            # Envenenado: reintentarlo no lo arreglaría
+            with self._lock:
+                self.poisoned += 1
+                self.last_error = f'Invalid event: {e}'
+            self._settle(generation, tag, False)
+            return
+        partition = self.key(event) if self.key is not None else None
+        index = hash(partition) % self.concurrency if partition is not None else tag % self.concurrency
+        self._workers[index].put((generation, tag, message, event))
+
+    def _work(self, work):
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            generation, tag, message, event = item
+            self._settle(generation, tag, self._handle(event), message)
+
+    def _handle(self, event):
+        """True si se procesó, False si sigue fallando y None si se cerró a medias (sin ack)."""
+        deadline = time.monotonic() + self.retry_budget
+        delay = self.retry_delay
+        while True:
+            try:
+                self.handler(event)
+                return True
+            except Exception as e:
+                with self._lock:
+                    self.last_error = f"{event.get('event_type')}: {e}"
+                    if self._closed:
+                        return None
+                    wait = min(delay, deadline - time.monotonic())
+                    if wait <= 0:
+                        return False
+                    self.retries += 1
+                    # Espera interrumpible: ``close`` despierta a todos
+                    self._lock.wait(wait)
+                    if self._closed:
+                        return None
+                delay = min(delay * 2, self.retry_max)
+
+    # ---------- acks ----------
+
+    def _settle(self, generation, tag, ok, message=None):
+        """Marca el mensaje como terminado y avanza el tramo contiguo confirmable.
+
+        Un fallo con ``message`` y vueltas disponibles se aparca en la cola de
+        reintento y su tag se confirma como uno procesado; el resto va a
+        dead-letter.
+        """
+        if ok is None:
+            # Cierre en mitad de los reintentos: sin ack, el broker lo reentrega
+            return
+        flush = False
+        with self._lock:
+            if generation != self._generation:
+                # Canal anterior: el broker ya lo reentregó
+                return
+            if ok:
+                self.handled += 1
+            elif message is not None and retry_count(message) < self.max_requeues:
+                self.requeued += 1
+                self._transport.retry(retry_message(message, retry_count(message) + 1))
+                ok = True
+            else:
+                self.dead_lettered += 1
+                self._transport.reject(tag)
+            self._settled[tag] = ok
+            # Solo se confirma con ``multiple`` hasta el último de un tramo sin huecos
+            while self._outstanding and self._outstanding[0] in self._settled:
+                done = self._outstanding.popleft()
+                if self._settled.pop(done):
+                    self._ack_upto = done
+                    self._pending_acks += 1
+            flush = self._pending_acks >= self.ack_batch
+        if flush:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending_acks:
+                return
+            tag, count = self._ack_upto, self._pending_acks
+            self._pending_acks = 0
+            self.ack_calls += 1
+            self.acked += count
+            # Bajo el lock para no cruzarse con el reinicio de ``_run`` tras una reconexión
+            self._transport.ack(tag, multiple=True)
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                self._lock.wait(self.ack_linger)
+            self._flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'broker': 'memory' if self.url.startswith('memory://') else 'rabbitmq',
+                'queue': self.queue,
+                'routing_keys': self.routing_keys,
+                'prefetch': self.prefetch,
+                'concurrency': self.concurrency,
+                'ack_batch': self.ack_batch,
+                'received': self.received,
+                'handled': self.handled,
+                'retries': self.retries,
+                'requeued': self.requeued,
+                'max_requeues': self.max_requeues,
+                'dead_lettered': self.dead_lettered,
+                'poisoned': self.poisoned,
+                'in_flight': len(self._outstanding),
+                'acked': self.acked,
+                'avg_ack_batch': round(self.acked / self.ack_calls, 1) if self.ack_calls else 0.0,
+                'connects': self.connects,
+                'failures': self.failures,
+                'last_error': self.last_error
+            }
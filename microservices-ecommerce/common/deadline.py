@@ -0,0 +1,89 @@
+"""Plazo (deadline) por petición propagado del gateway a los microservicios.
+
+El gateway fija un plazo a cada petición (el presupuesto de la ruta o uno
+menor que pida el cliente) y lo reenvía en la cabecera
+``X-Request-Timeout-Ms`` con los milisegundos que quedan en el momento de
+cada llamada. Es un tiempo relativo, así que no depende de que los relojes
+de las máquinas estén sincronizados.
+
+En los microservicios ``enable_deadlines(app)`` lee la cabecera:
+
+- si el plazo ya venció al empezar (la petición esperó en la cola del
+  servidor y el cliente ya se fue), responde 504 sin hacer nada;
+- ``remaining()`` da los segundos que quedan; ``PgPool`` lo aplica como
+  ``statement_timeout`` y Order Service como timeout de pymongo, así las
+  consultas no siguen trabajando para un cliente que ya abandonó.
+"""
+import math
+import time
+from contextvars import ContextVar
+
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+
+# Instante (time.monotonic) en que vence la petición en curso, o None
+_deadline = ContextVar('request_deadline', default=None)
+
+
+def parse_timeout_ms(raw):
+    """Segundos de la cabecera o None si falta o no es válida."""
+    if not raw:
+        return None
+    try:
+        milliseconds = float(raw)
+    except ValueError:
+        return None
+    return milliseconds / 1000.0 if math.isfinite(milliseconds) else None
+
+
+def set_deadline(seconds):
+    """Fija el plazo de la petición en curso (None = sin plazo)."""
+    _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def remaining():
+    """Segundos que quedan (puede ser negativo) o None si no hay plazo."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def remaining_ms():
+    seconds = remaining()
+    return None if seconds is None else max(0, int(seconds * 1000))
+
+
+def deadline_headers():
+    """Cabecera con el tiempo que queda, para reenviarla en una llamada."""
+    milliseconds = remaining_ms()
+    return {DEADLINE_HEADER: str(milliseconds)} if milliseconds is not None else {}
+
+
+def enable_deadlines(app, scope=None):
+    """Aplica ``X-Request-Timeout-Ms`` a cada petición del microservicio.
+
+    ``scope(seconds)``, si se indica, devuelve un context manager que queda
+    activo durante la petición (p. ej. ``pymongo.timeout``).
+    """
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _start_deadline():
+        seconds = parse_timeout_ms(request.headers.get(DEADLINE_HEADER))
+        set_deadline(seconds)
+        if seconds is None:
+            return None
+        if seconds <= 0:
+            return jsonify({'error': 'Request deadline exceeded'}), 504
+        if scope is not None:
+            g._deadline_scope = scope(seconds)
+            g._deadline_scope.__enter__()
+        return None
+
+    @app.teardown_request
+    def _finish_deadline(exc):
+        context = g.pop('_deadline_scope', None)
+        if context is not None:
+            context.__exit__(None, None, None)
+        # Los hilos del servidor se reutilizan: el plazo no pasa a la siguiente petición
+        set_deadline(None)
+
+    return app
@@ -0,0 +1,62 @@
+"""Configuración de gunicorn compartida por los cuatro servicios.
+
+Uso en la imagen (WORKDIR /app, con ``common`` copiado dentro)::
+
+    gunicorn -c common/gunicorn_conf.py --bind 0.0.0.0:5001 wsgi:app
+
+En local, desde el directorio del servicio::
+
+    PYTHONPATH=.. gunicorn -c ../common/gunicorn_conf.py --bind 0.0.0.0:5001 wsgi:app
+
+La aplicación se carga en el proceso master antes del fork (``preload_app``)
+y los hooks llaman, si existen, a las funciones homónimas del módulo WSGI
+del servicio (``wsgi.py``):
+
+- ``on_starting()``: una sola vez en el master, antes de crear los workers
+  (``init_db()``: sin carreras entre workers creando tablas e índices).
+- ``post_worker_init()``: en cada worker ya arrancado (pools, hilos de fondo).
+- ``worker_exit()``: al salir cada worker, tras terminar las peticiones en
+  curso (vacía la cola de eventos y cierra conexiones).
+
+Con SIGTERM los workers dejan de aceptar conexiones y disponen de
+``GUNICORN_GRACEFUL_TIMEOUT`` segundos para acabar las peticiones en curso.
+"""
+import importlib
+import multiprocessing
+import os
+
+# Workers (procesos) e hilos por worker; cada worker tiene sus propios pools
+workers = int(os.getenv('GUNICORN_WORKERS', str(max(2, multiprocessing.cpu_count()))))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# Reciclar workers tras N peticiones (0 = nunca) con algo de aleatoriedad
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+preload_app = True
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def _call(server, name):
+    """Llama a ``name()`` del módulo WSGI del servicio si la define."""
+    module_name = server.app.app_uri.split(':', 1)[0]
+    hook = getattr(importlib.import_module(module_name), name, None)
+    if hook is not None:
+        hook()
+
+
+def on_starting(server):
+    _call(server, 'on_starting')
+
+
+def post_worker_init(worker):
+    _call(worker, 'post_worker_init')
+
+
+def worker_exit(server, worker):
+    _call(server, 'worker_exit')
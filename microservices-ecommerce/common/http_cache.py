@@ -0,0 +1,20 @@
+"""ETag e If-None-Match para las respuestas JSON de los microservicios.
+
+Permite que el gateway revalide su caché con un 304 sin cuerpo en lugar de
+volver a transferir el recurso completo.
+"""
+from flask import request
+
+
+def enable_conditional_get(app):
+    """Añade ETag a las respuestas GET JSON y responde 304 si coincide If-None-Match."""
+
+    @app.after_request
+    def conditional_get(response):
+        if (request.method == 'GET' and response.status_code == 200
+                and not response.is_streamed and response.mimetype == 'application/json'):
+            response.add_etag()
+            response.make_conditional(request)
+        return response
+
+    return app
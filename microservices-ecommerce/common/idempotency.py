@@ -0,0 +1,267 @@
+"""Cabecera ``Idempotency-Key`` para las altas (POST /payments y POST /orders).
+
+El cliente (o el gateway al reintentar) manda la misma clave en cada intento
+de la misma operación. El primer intento la reserva, ejecuta el alta y
+guarda la respuesta; los siguientes reciben esa respuesta guardada con
+``Idempotent-Replayed: true`` sin volver a ejecutar nada. Las claves caducan
+a los ``IDEMPOTENCY_TTL_SECONDS``.
+
+- Reutilizar una clave con otro cuerpo devuelve 422.
+- Un duplicado concurrente espera hasta ``IDEMPOTENCY_WAIT_SECONDS`` a que
+  termine el original; si no termina a tiempo recibe 409 con ``Retry-After``.
+
+``PgIdempotencyStore`` reserva la clave en la misma transacción que el alta:
+un duplicado concurrente queda bloqueado en el índice único hasta el commit
+y luego ve la respuesta, y si el alta falla la reserva desaparece con el
+rollback. ``MongoIdempotencyStore`` no cuenta con transacciones (mongod
+standalone): reserva la clave con un lease y un ``_id`` de recurso fijado de
+antemano, de modo que quien retome una reserva abandonada no crea otro.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import Response, jsonify, request
+
+from common.deadline import remaining
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '5'))
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '30'))
+# Cada cuántas reservas se borran (en lote) claves caducadas de PostgreSQL
+IDEMPOTENCY_PURGE_EVERY = int(os.getenv('IDEMPOTENCY_PURGE_EVERY', '1000'))
+MAX_KEY_LENGTH = 255
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+class IdempotencyError(Exception):
+    status_code = 409
+
+
+class IdempotencyMismatch(IdempotencyError):
+    status_code = 422
+
+
+class IdempotencyInProgress(IdempotencyError):
+    status_code = 409
+
+
+class StoredResponse:
+    """Respuesta guardada de un intento anterior con la misma clave."""
+    __slots__ = ('status_code', 'body')
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+
+class Claim:
+    """Reserva de una clave; ``resource_id`` es el id a usar en el alta (Mongo)."""
+    __slots__ = ('key', 'token', 'resource_id')
+
+    def __init__(self, key, token=None, resource_id=None):
+        self.key = key
+        self.token = token
+        self.resource_id = resource_id
+
+
+def idempotency_key():
+    """(clave o None, error): la clave de la petición, validada."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return None, None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        return None, f'{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} printable characters'
+    return key, None
+
+
+def request_fingerprint(data):
+    """Huella de método, ruta y cuerpo JSON (independiente del orden de las claves)."""
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode('utf-8')).hexdigest()
+
+
+def replay_response(stored):
+    response = Response(stored.body, status=stored.status_code, mimetype='application/json')
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotency_error(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = error.status_code
+    if isinstance(error, IdempotencyInProgress):
+        response.headers['Retry-After'] = '1'
+    return response
+
+
+def _mismatch(key):
+    return IdempotencyMismatch(f'{IDEMPOTENCY_HEADER} {key!r} was already used with a different request')
+
+
+def _in_progress(key):
+    return IdempotencyInProgress(f'A request with {IDEMPOTENCY_HEADER} {key!r} is still in progress')
+
+
+class PgIdempotencyStore:
+    """Tabla ``idempotency_keys``; la reserva va en la transacción del alta."""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL_SECONDS, wait=IDEMPOTENCY_WAIT_SECONDS,
+                 purge_every=IDEMPOTENCY_PURGE_EVERY):
+        self.ttl = ttl
+        self.wait = wait
+        self.purge_every = purge_every
+        self._claims = 0
+
+    def create_table(self, cur):
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key VARCHAR(255) PRIMARY KEY,
+                request_hash CHAR(64) NOT NULL,
+                status_code SMALLINT,
+                response TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)')
+
+    def claim(self, cur, key, fingerprint):
+        """Reserva ``key`` en la transacción de ``cur`` (sin commit).
+
+        Devuelve un ``Claim`` si esta petición debe ejecutar el alta o la
+        ``StoredResponse`` del intento que ya la completó. Una clave caducada
+        se reutiliza. Lanza ``IdempotencyMismatch`` o ``IdempotencyInProgress``.
+        """
+        import psycopg2.errors
+        # Un duplicado concurrente espera aquí al commit (o rollback) del original
+        cur.execute("SELECT set_config('lock_timeout', %s, true)", (f'{int(self.wait * 1000)}ms',))
+        try:
+            cur.execute('''
+                INSERT INTO idempotency_keys (key, request_hash, expires_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                ON CONFLICT (key) DO UPDATE
+                SET request_hash = EXCLUDED.request_hash, status_code = NULL, response = NULL,
+                    created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+                WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+                RETURNING key
+            ''', (key, fingerprint, self.ttl))
+        except psycopg2.errors.LockNotAvailable:
+            raise _in_progress(key)
+        claimed = cur.fetchone() is not None
+        cur.execute("SELECT set_config('lock_timeout', '0', true)")
+        if claimed:
+            self._claims += 1
+            if self.purge_every and self._claims % self.purge_every == 0:
+                self.purge(cur)
+            return Claim(key)
+
+        cur.execute('SELECT request_hash, status_code, response FROM idempotency_keys WHERE key = %s', (key,))
+        row = cur.fetchone()
+        request_hash, status_code, body = (row['request_hash'], row['status_code'], row['response']) \
+            if isinstance(row, dict) else row
+        if request_hash != fingerprint:
+            raise _mismatch(key)
+        return StoredResponse(status_code, body)
+
+    def complete(self, cur, claim, status_code, body):
+        """Guarda la respuesta; se confirma con el commit del alta."""
+        cur.execute('UPDATE idempotency_keys SET status_code = %s, response = %s WHERE key = %s',
+                    (status_code, body, claim.key))
+
+    def purge(self, cur, limit=1000):
+        """Borra hasta ``limit`` claves caducadas sin bloquear a otras transacciones."""
+        cur.execute('''
+            DELETE FROM idempotency_keys WHERE key IN (
+                SELECT key FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP
+                LIMIT %s FOR UPDATE SKIP LOCKED
+            )
+        ''', (limit,))
+
+
+class MongoIdempotencyStore:
+    """Colección ``idempotency_keys`` (``_id`` = clave) con índice TTL sobre ``expires_at``."""
+
+    def __init__(self, get_collection, ttl=IDEMPOTENCY_TTL_SECONDS, wait=IDEMPOTENCY_WAIT_SECONDS,
+                 lease=IDEMPOTENCY_LEASE_SECONDS):
+        self._get_collection = get_collection
+        self.ttl = ttl
+        self.wait = wait
+        self.lease = lease
+
+    def create_indexes(self):
+        # MongoDB borra los documentos caducados en segundo plano (cada ~60 s)
+        self._get_collection().create_index('expires_at', expireAfterSeconds=0)
+
+    def claim(self, key, fingerprint):
+        """``Claim`` si esta petición debe ejecutar el alta o la ``StoredResponse`` guardada.
+
+        Si otro intento la tiene reservada se espera a que termine; una reserva
+        cuyo lease venció (proceso caído) se retoma con el mismo ``resource_id``.
+        """
+        from bson import ObjectId
+        from pymongo.errors import DuplicateKeyError
+
+        collection = self._get_collection()
+        left = remaining()
+        deadline = time.monotonic() + (self.wait if left is None else min(self.wait, left))
+        delay = 0.01
+        while True:
+            now = datetime.utcnow()
+            token = uuid.uuid4().hex
+            document = {
+                '_id': key,
+                'request_hash': fingerprint,
+                'state': PENDING,
+                'token': token,
+                'resource_id': ObjectId(),
+                'locked_until': now + timedelta(seconds=self.lease),
+                'expires_at': now + timedelta(seconds=self.ttl)
+            }
+            try:
+                collection.insert_one(document)
+                return Claim(key, token, document['resource_id'])
+            except DuplicateKeyError:
+                pass
+
+            existing = collection.find_one({'_id': key})
+            if existing is None:
+                continue
+            if existing['expires_at'] <= now:
+                # Caducada pero aún no borrada por el índice TTL
+                collection.delete_one({'_id': key, 'expires_at': existing['expires_at']})
+                continue
+            if existing['request_hash'] != fingerprint:
+                raise _mismatch(key)
+            if existing['state'] == DONE:
+                return StoredResponse(existing['status_code'], existing['response'])
+            if existing['locked_until'] <= now:
+                taken = collection.find_one_and_update(
+                    {'_id': key, 'state': PENDING, 'token': existing['token']},
+                    {'$set': {'token': token, 'locked_until': now + timedelta(seconds=self.lease)}})
+                if taken is not None:
+                    return Claim(key, token, existing['resource_id'])
+                continue
+            if time.monotonic() >= deadline:
+                raise _in_progress(key)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    def complete(self, claim, status_code, body):
+        self._get_collection().update_one(
+            {'_id': claim.key, 'token': claim.token},
+            {'$set': {'state': DONE, 'status_code': status_code, 'response': body,
+                      'expires_at': datetime.utcnow() + timedelta(seconds=self.ttl)},
+             '$unset': {'locked_until': ''}})
+
+    def release(self, claim):
+        """Libera la reserva si el alta falló, para que un reintento la ejecute."""
+        self._get_collection().delete_one({'_id': claim.key, 'token': claim.token, 'state': PENDING})
@@ -0,0 +1,88 @@
+"""Serialización JSON rápida y común a todos los servicios.
+
+``install_json_provider(app)`` cambia el proveedor JSON de Flask
+(``jsonify``, ``app.json.dumps``, ``request.get_json``) por uno basado en
+orjson. Serializa directamente ``Decimal`` (como número), ``datetime`` y
+``date`` (ISO 8601), ``UUID`` y ``ObjectId``, así que no hace falta
+convertir las filas antes de responder.
+
+``JSON_BACKEND=stdlib`` usa el módulo ``json`` con las mismas conversiones
+y la misma salida compacta. Sirve para comparar en los benchmarks.
+"""
+import json
+import os
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    from bson import ObjectId
+except ImportError:
+    # Solo Order Service tiene pymongo
+    ObjectId = None
+
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson').lower()
+JSON_MIMETYPE = 'application/json'
+
+# Claves no str (p. ej. enteros) se convierten a texto, como hace json
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    """Tipos que orjson no serializa por sí solo."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if ObjectId is not None and isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _stdlib_default(value):
+    """``_default`` más lo que orjson sí trae de serie."""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return _default(value)
+
+
+def dumps_bytes(obj):
+    """JSON compacto en UTF-8 (bytes), listo para el cuerpo de una respuesta o un mensaje."""
+    if JSON_BACKEND == 'stdlib':
+        return json.dumps(obj, default=_stdlib_default, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+    return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+
+
+def dumps(obj):
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def loads(data):
+    """Acepta str o bytes."""
+    if JSON_BACKEND == 'stdlib':
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Proveedor de Flask que delega en ``dumps_bytes`` / ``loads``."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # Los bytes van tal cual al cuerpo, sin pasar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=JSON_MIMETYPE)
+
+
+def install_json_provider(app):
+    app.json = FastJSONProvider(app)
+    return app
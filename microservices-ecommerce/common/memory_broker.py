@@ -0,0 +1,204 @@
+"""Sustituto en memoria de RabbitMQ para desarrollo local, benchmarks y pruebas.
+
+Implementa lo mínimo del modelo AMQP que usan los servicios: un exchange
+de tipo topic, colas con bindings, confirmación por lotes y, para los
+consumidores, prefetch, acks (sueltos o ``multiple``), dead-lettering y la
+cola de reintento con TTL (un temporizador por mensaje). Se
+activa con ``RABBITMQ_URL=memory://``; todos los publicadores y consumidores
+del proceso comparten el mismo broker.
+"""
+import threading
+import time
+from collections import deque
+
+
+def topic_matches(pattern, routing_key):
+    """Reglas de un exchange topic: '*' es una palabra y '#' cero o más."""
+    def match(p, k):
+        if not p:
+            return not k
+        if p[0] == '#':
+            return any(match(p[1:], k[i:]) for i in range(len(k) + 1))
+        if not k:
+            return False
+        return (p[0] == '*' or p[0] == k[0]) and match(p[1:], k[1:])
+
+    return match(pattern.split('.'), routing_key.split('.'))
+
+
+class InMemoryBroker:
+    """Exchange topic en memoria con colas FIFO.
+
+    ``confirm_latency`` simula el viaje de ida y vuelta de la confirmación
+    del broker: se paga una vez por lote, como con publisher confirms reales.
+    """
+
+    def __init__(self, confirm_latency=0.0):
+        self.confirm_latency = confirm_latency
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._bindings = []
+        self._dead_letters = {}
+        self.published = 0
+        self.batches = 0
+
+    def declare_queue(self, name, *patterns, dead_letter=None):
+        """Cola ligada a ``patterns``; los rechazos van a la cola ``dead_letter``."""
+        with self._cond:
+            self._queues.setdefault(name, deque())
+            if dead_letter is not None:
+                self._queues.setdefault(dead_letter, deque())
+                self._dead_letters[name] = dead_letter
+            for pattern in patterns:
+                if (pattern, name) not in self._bindings:
+                    self._bindings.append((pattern, name))
+
+    def publish_batch(self, messages):
+        if self.confirm_latency:
+            time.sleep(self.confirm_latency)
+        with self._cond:
+            for message in messages:
+                for pattern, queue in self._bindings:
+                    if topic_matches(pattern, message.routing_key):
+                        self._queues[queue].append(message)
+            self.published += len(messages)
+            self.batches += 1
+            self._cond.notify_all()
+
+    def get(self, queue, timeout=0.0):
+        """Saca el siguiente mensaje de la cola o None si no llega a tiempo."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._queues.get(queue):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._queues[queue].popleft()
+
+    def requeue(self, queue, messages):
+        """Devuelve mensajes sin ack al principio de la cola, en su orden."""
+        with self._cond:
+            self._queues[queue].extendleft(reversed(messages))
+            self._cond.notify_all()
+
+    def publish_later(self, queue, message, delay):
+        """Añade ``message`` al final de ``queue`` pasados ``delay`` segundos (TTL)."""
+        def deliver():
+            with self._cond:
+                if queue in self._queues:
+                    self._queues[queue].append(message)
+                    self._cond.notify_all()
+
+        timer = threading.Timer(delay, deliver)
+        timer.daemon = True
+        timer.start()
+
+    def dead_letter(self, queue, message):
+        with self._cond:
+            target = self._dead_letters.get(queue)
+            if target is not None:
+                self._queues[target].append(message)
+                self._cond.notify_all()
+
+    def depth(self, queue):
+        with self._cond:
+            return len(self._queues.get(queue, ()))
+
+    def reset(self):
+        with self._cond:
+            self._queues.clear()
+            self._bindings.clear()
+            self._dead_letters.clear()
+            self.published = 0
+            self.batches = 0
+
+
+class InMemoryTransport:
+    """Transporte de ``EventPublisher`` que entrega los lotes al broker en memoria."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish_batch(self, messages, timeout=None):
+        self.broker.publish_batch(messages)
+
+    def close(self):
+        pass
+
+
+class InMemoryConsumerTransport:
+    """Transporte de ``EventConsumer`` sobre el broker en memoria.
+
+    Como un canal AMQP: entrega como mucho ``prefetch`` mensajes sin ack con
+    delivery tags crecientes desde 1, y al cerrarse devuelve a la cola los
+    que no recibieron ack para que se entreguen de nuevo.
+    """
+
+    def __init__(self, broker, queue, routing_keys, prefetch, dead_letter_queue=None, requeue_delay=0.0):
+        self.broker = broker
+        self.queue = queue
+        self.prefetch = prefetch
+        self.requeue_delay = requeue_delay
+        self._cond = threading.Condition()
+        self._unacked = {}
+        self._closed = False
+        broker.declare_queue(queue, *routing_keys, dead_letter=dead_letter_queue)
+
+    def run(self, on_message):
+        """Entrega mensajes a ``on_message(tag, message)`` hasta ``close()``."""
+        tag = 0
+        with self._cond:
+            self._closed = False
+        try:
+            while True:
+                with self._cond:
+                    while len(self._unacked) >= self.prefetch and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                message = self.broker.get(self.queue, timeout=0.1)
+                if message is None:
+                    continue
+                tag += 1
+                with self._cond:
+                    self._unacked[tag] = message
+                on_message(tag, message)
+        finally:
+            with self._cond:
+                pending = [self._unacked[key] for key in sorted(self._unacked)]
+                self._unacked.clear()
+            if pending:
+                self.broker.requeue(self.queue, pending)
+
+    def ack(self, tag, multiple=False):
+        with self._cond:
+            tags = [key for key in self._unacked if key <= tag] if multiple else [tag]
+            for key in tags:
+                self._unacked.pop(key, None)
+            self._cond.notify_all()
+
+    def reject(self, tag):
+        """Rechaza sin reencolar: el mensaje va a la cola de dead-letter."""
+        with self._cond:
+            message = self._unacked.pop(tag, None)
+            self._cond.notify_all()
+        if message is not None:
+            self.broker.dead_letter(self.queue, message)
+
+    def retry(self, message):
+        """Como la cola de reintento: vuelve a la cola tras ``requeue_delay``."""
+        self.broker.publish_later(self.queue, message, self.requeue_delay)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+_default_broker = InMemoryBroker()
+
+
+def get_broker():
+    """Broker compartido por todos los publicadores/consumidores del proceso."""
+    return _default_broker
@@ -0,0 +1,262 @@
+"""Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Contadores, gauges e histogramas con etiquetas, un registro por proceso y
+``instrument_flask(app)``, que añade los hooks before/after request y el
+endpoint ``GET /metrics``. Con varios workers cada proceso expone sus
+propias series (Prometheus las agrega al consultar).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [cuentas por bucket..., suma, total]
+                series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+        lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+        plain = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{plain} {_format_value(series[-2])}')
+        lines.append(f'{self.name}_count{plain} {series[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'Peticiones HTTP atendidas', ('method', 'route', 'status'))
+HTTP_ERRORS = REGISTRY.counter(
+    'http_request_errors_total', 'Peticiones HTTP con respuesta 5xx', ('method', 'route'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Latencia de las peticiones HTTP hasta enviar cabeceras',
+    ('method', 'route'))
+HTTP_IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'Peticiones HTTP en curso')
+DB_LATENCY = REGISTRY.histogram(
+    'db_call_duration_seconds', 'Duración de las llamadas a la base de datos', ('operation',))
+DB_ERRORS = REGISTRY.counter(
+    'db_call_errors_total', 'Llamadas a la base de datos que fallaron', ('operation',))
+
+
+def observe_db_call(operation, seconds, failed=False):
+    if not METRICS_ENABLED:
+        return
+    DB_LATENCY.observe(seconds, operation=operation)
+    if failed:
+        DB_ERRORS.inc(operation=operation)
+
+
+# ---------- tiempo en upstreams (gateway) ----------
+
+# Acumulador por petición; es mutable para que las tareas hijas (fan-out
+# asyncio) sumen sobre el mismo objeto que la petición que las lanzó.
+_upstream_time = ContextVar('upstream_time', default=None)
+
+
+def start_upstream_timer():
+    holder = [0.0]
+    _upstream_time.set(holder)
+    return holder
+
+
+def add_upstream_time(seconds):
+    holder = _upstream_time.get()
+    if holder is not None:
+        holder[0] += seconds
+
+
+def upstream_time():
+    holder = _upstream_time.get()
+    return holder[0] if holder is not None else 0.0
+
+
+# ---------- Flask ----------
+
+def record_request(method, route, status, seconds):
+    HTTP_LATENCY.observe(seconds, method=method, route=route)
+    HTTP_REQUESTS.inc(method=method, route=route, status=status)
+    if status >= 500:
+        HTTP_ERRORS.inc(method=method, route=route)
+
+
+def metrics_body():
+    return REGISTRY.render()
+
+
+def instrument_flask(app, on_request=None):
+    """Hooks de latencia/in-flight/errores y endpoint ``GET /metrics``.
+
+    ``on_request(route, seconds)`` se llama tras cada petición con su
+    duración (el gateway lo usa para separar su overhead del upstream).
+    """
+    from flask import Response, g, request
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(metrics_body(), content_type=CONTENT_TYPE)
+
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+        g._metrics_in_flight = True
+        HTTP_IN_FLIGHT.inc()
+        start_upstream_timer()
+
+    @app.after_request
+    def _record(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            seconds = time.perf_counter() - started
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            record_request(request.method, route, response.status_code, seconds)
+            if on_request is not None:
+                on_request(route, seconds)
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        if g.pop('_metrics_in_flight', False):
+            HTTP_IN_FLIGHT.dec()
@@ -0,0 +1,381 @@
+"""Pool de conexiones PostgreSQL acotado y compartido por todo el proceso.
+
+Evita el ``psycopg2.connect`` (handshake TCP + autenticación) en cada
+petición. Las conexiones se prestan con ``with db_pool.connection() as conn``
+y se devuelven siempre, también cuando el handler lanza una excepción.
+"""
+import itertools
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from common.deadline import remaining
+from common.metrics import METRICS_ENABLED, observe_db_call
+
+POOL_MIN = int(os.getenv('PG_POOL_MIN', '1'))
+POOL_MAX = int(os.getenv('PG_POOL_MAX', '10'))
+MAX_LIFETIME = float(os.getenv('PG_POOL_MAX_LIFETIME', '1800'))
+CHECKOUT_TIMEOUT = float(os.getenv('PG_POOL_CHECKOUT_TIMEOUT', '5'))
+HEALTHCHECK_AFTER = float(os.getenv('PG_POOL_HEALTHCHECK_AFTER', '30'))
+CONNECT_TIMEOUT = int(os.getenv('PG_CONNECT_TIMEOUT', '3'))
+
+_cursor_ids = itertools.count(1)
+
+
+class DatabaseUnavailable(Exception):
+    """No se pudo obtener una conexión (base de datos caída o pool agotado)."""
+
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+)', re.IGNORECASE)
+
+
+def sql_operation(query):
+    """Etiqueta de baja cardinalidad para una sentencia: 'select payments'."""
+    if isinstance(query, bytes):
+        query = query[:200].decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    words = query.split(None, 1)
+    verb = words[0].lower() if words else 'unknown'
+    table = _TABLE_RE.search(query)
+    return f'{verb} {table.group(1).lower()}' if table else verb
+
+
+class _TimedCursorMixin:
+    """Mide cada ``execute`` (incluye la ida y vuelta al servidor)."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            observe_db_call(sql_operation(query), time.perf_counter() - started, failed)
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor(factory):
+    cls = _timed_cursor_classes.get(factory)
+    if cls is None:
+        cls = _timed_cursor_classes[factory] = type(f'Timed{factory.__name__}', (_TimedCursorMixin, factory), {})
+    return cls
+
+
+class TimedConnection(extensions.connection):
+    """Conexión cuyos cursores (de cualquier ``cursor_factory``) registran su duración."""
+
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        factory = cursor_factory or self.cursor_factory or extensions.cursor
+        return super().cursor(*args, cursor_factory=_timed_cursor(factory), **kwargs)
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class _ServerCursorRows:
+    """Iterador sobre un cursor de servidor que devuelve la conexión al terminar."""
+
+    def __init__(self, pool, pooled, cursor):
+        self._pool = pool
+        self._pooled = pooled
+        self._cursor = cursor
+        self._rows = iter(cursor)
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        try:
+            return next(self._rows)
+        except StopIteration:
+            self.close()
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._finish(broken=True)
+            raise
+
+    def close(self):
+        self._finish(broken=False)
+
+    def _finish(self, broken):
+        if self._done:
+            return
+        self._done = True
+        try:
+            self._cursor.close()
+        except Exception:
+            broken = True
+        self._pool._return(self._pooled, broken)
+
+
+class PgPool:
+    """Pool acotado con health-check, reciclado por antigüedad y métricas de espera."""
+
+    def __init__(self, dsn, minconn=POOL_MIN, maxconn=POOL_MAX, max_lifetime=MAX_LIFETIME,
+                 checkout_timeout=CHECKOUT_TIMEOUT, healthcheck_after=HEALTHCHECK_AFTER,
+                 connect_timeout=CONNECT_TIMEOUT):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_after = healthcheck_after
+        self.connect_timeout = connect_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0
+        self._pid = os.getpid()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._healthcheck_failures = 0
+
+    # ---------- ciclo de vida de conexiones ----------
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout,
+                                connection_factory=TimedConnection if METRICS_ENABLED else None)
+        with self._cond:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, pooled):
+        """SELECT 1 solo si la conexión lleva tiempo ociosa."""
+        if pooled.conn.closed:
+            return False
+        if time.monotonic() - pooled.last_used < self.healthcheck_after:
+            return True
+        try:
+            cur = pooled.conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchone()
+            cur.close()
+            pooled.conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _check_fork(self):
+        # Un proceso hijo no puede reutilizar los sockets del padre: se olvidan
+        # sin cerrarlos para no terminar la sesión del proceso original.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._size = 0
+
+    def _acquire(self):
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        waited = False
+        with self._cond:
+            self._check_fork()
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise DatabaseUnavailable(
+                        f'Connection pool exhausted ({self.maxconn} in use) after {self.checkout_timeout}s')
+                waited = True
+                self._cond.wait(remaining)
+
+            wait = time.monotonic() - started
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+        if pooled is None:
+            return self._open_reserved()
+
+        expired = time.monotonic() - pooled.created_at >= self.max_lifetime
+        if expired or not self._is_healthy(pooled):
+            self._close(pooled)
+            with self._cond:
+                if expired:
+                    self._recycled += 1
+                else:
+                    self._healthcheck_failures += 1
+            return self._open_reserved()
+        return pooled
+
+    def _open_reserved(self):
+        """Abre una conexión para un hueco ya reservado en ``_size``."""
+        try:
+            return self._connect()
+        except Exception as e:
+            self._release_slot()
+            raise DatabaseUnavailable(str(e)) from e
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _return(self, pooled, broken):
+        conn = pooled.conn
+        if not broken and not conn.closed:
+            try:
+                # Nunca devolver una transacción abierta al pool
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        if broken or conn.closed:
+            self._close(pooled)
+            with self._cond:
+                self._discarded += 1
+            self._release_slot()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    # ---------- API pública ----------
+
+    @contextmanager
+    def connection(self):
+        """Presta una conexión y la devuelve al salir, haya o no excepción."""
+        pooled = self._acquire()
+        broken = False
+        try:
+            self._apply_deadline(pooled.conn)
+            yield pooled.conn
+        except extensions.QueryCanceledError:
+            # statement_timeout por el plazo de la petición: la conexión sigue sana
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self._return(pooled, broken)
+
+    def _apply_deadline(self, conn):
+        """Limita las sentencias de la transacción al plazo que le queda a la petición."""
+        seconds = remaining()
+        if seconds is None:
+            return
+        cur = conn.cursor()
+        cur.execute("SELECT set_config('statement_timeout', %s, true)", (f'{max(1, int(seconds * 1000))}ms',))
+        cur.close()
+
+    def iter_query(self, sql, params=None, itersize=1000, cursor_factory=None):
+        """Ejecuta ``sql`` con un cursor de servidor y devuelve un iterador de filas.
+
+        La conexión se obtiene y la consulta se declara antes de devolver el
+        iterador, así los errores de conexión o SQL llegan al handler antes de
+        empezar la respuesta. La conexión vuelve al pool cuando el iterador se
+        agota o se cierra (``close()``), aunque no se haya llegado a recorrer.
+        """
+        pooled = self._acquire()
+        try:
+            cur = pooled.conn.cursor(name=f'stream_{next(_cursor_ids)}', cursor_factory=cursor_factory)
+            cur.itersize = itersize
+            cur.execute(sql, params)
+        except Exception as e:
+            self._return(pooled, isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)))
+            raise
+        return _ServerCursorRows(self, pooled, cur)
+
+    def warm_up(self):
+        """Abre ``minconn`` conexiones por adelantado (ignora fallos)."""
+        opened = []
+        try:
+            for _ in range(self.minconn):
+                opened.append(self._acquire())
+        except DatabaseUnavailable as e:
+            print(f"Could not warm up connection pool: {e}")
+        for pooled in opened:
+            self._return(pooled, False)
+
+    def ping(self):
+        """True si la base de datos responde a través del pool."""
+        try:
+            with self.connection() as conn:
+                cur = conn.cursor()
+                cur.execute('SELECT 1')
+                cur.close()
+            return True
+        except Exception:
+            return False
+
+    def close_all(self):
+        """Cierra las conexiones ociosas (p. ej. antes de hacer fork de workers)."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max': self.maxconn,
+                'checkouts': self._checkouts,
+                'checkout_waits': self._waits,
+                'checkout_wait_avg_ms': round(self._wait_total / self._waits * 1000, 2) if self._waits else 0.0,
+                'checkout_wait_max_ms': round(self._wait_max * 1000, 2),
+                'checkout_timeouts': self._timeouts,
+                'connections_created': self._created,
+                'connections_recycled': self._recycled,
+                'connections_discarded': self._discarded,
+                'healthcheck_failures': self._healthcheck_failures
+            }
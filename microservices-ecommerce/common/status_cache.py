@@ -0,0 +1,59 @@
+"""Totales de ``/status`` baratos y cacheados en el proceso.
+
+Los paneles y la monitorización consultan ``/status`` con frecuencia; en vez
+de un ``COUNT(*)`` completo en cada llamada, cada servicio calcula sus
+totales de forma barata (contadores mantenidos por trigger o estimaciones
+del catálogo) y el resultado se reutiliza durante ``STATUS_CACHE_SECONDS``.
+``/status?exact=1`` pide el valor exacto, también cacheado.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import request
+
+STATUS_CACHE_SECONDS = float(os.getenv('STATUS_CACHE_SECONDS', '30'))
+# Por debajo de este tamaño estimado se cuenta exacto (es barato)
+STATUS_EXACT_BELOW = int(os.getenv('STATUS_EXACT_BELOW', '10000'))
+
+
+def wants_exact():
+    """True si el cliente pide totales exactos con ?exact=1."""
+    return request.args.get('exact', '').lower() in ('1', 'true', 'yes')
+
+
+class StatusCache:
+    """Valores calculados por ``loader`` y reutilizados durante ``max_age`` segundos.
+
+    Solo un hilo recalcula a la vez; si el cálculo falla se sirve el último
+    valor conocido (aunque esté caducado).
+    """
+
+    def __init__(self, max_age=STATUS_CACHE_SECONDS):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry[1] < self.max_age
+
+    def get(self, key, loader):
+        """Devuelve ``(valor, metadatos)``; propaga el error solo si no hay valor previo."""
+        entry = self._entries.get(key)
+        if not self._fresh(entry):
+            with self._lock:
+                entry = self._entries.get(key)
+                if not self._fresh(entry):
+                    try:
+                        entry = (loader(), time.monotonic(), datetime.utcnow())
+                        self._entries[key] = entry
+                    except Exception:
+                        if entry is None:
+                            raise
+        value, loaded_at, as_of = entry
+        return value, {
+            'as_of': as_of.isoformat(),
+            'age_seconds': round(time.monotonic() - loaded_at, 3),
+            'max_age_seconds': self.max_age
+        }
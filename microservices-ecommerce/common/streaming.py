@@ -0,0 +1,60 @@
+"""Respuestas NDJSON en streaming (un objeto JSON por línea).
+
+Permite exportar colecciones completas con memoria constante: las filas se
+leen de un cursor de servidor y se envían al cliente a medida que llegan.
+"""
+import os
+
+from flask import Response, request
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '1000'))
+# Las líneas se agrupan en trozos de este tamaño para no escribir fila a fila
+STREAM_CHUNK_BYTES = int(os.getenv('STREAM_CHUNK_BYTES', '65536'))
+
+
+def wants_ndjson():
+    """True si el cliente pide streaming con ?stream=1 o Accept: application/x-ndjson."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return any(mimetype == NDJSON_MIMETYPE and quality > 0
+               for mimetype, quality in request.accept_mimetypes)
+
+
+def ndjson_response(rows, dumps, transform=None):
+    """Response Flask que serializa ``rows`` (iterable perezoso) línea a línea.
+
+    Si la lectura falla a mitad del envío ya no se puede cambiar el código
+    HTTP, así que se emite una última línea ``{"error": ...}``. ``rows`` se
+    cierra siempre al terminar o si el cliente corta la conexión.
+    """
+    def generate():
+        buffer = []
+        size = 0
+        try:
+            for row in rows:
+                if transform is not None:
+                    row = transform(row)
+                line = dumps(row) + '\n'
+                buffer.append(line)
+                size += len(line)
+                if size >= STREAM_CHUNK_BYTES:
+                    yield ''.join(buffer)
+                    buffer = []
+                    size = 0
+            if buffer:
+                yield ''.join(buffer)
+        except Exception as e:
+            yield ''.join(buffer) + dumps({'error': str(e)}) + '\n'
+        finally:
+            close_rows()
+
+    def close_rows():
+        close = getattr(rows, 'close', None)
+        if close is not None:
+            close()
+
+    response = Response(generate(), mimetype=NDJSON_MIMETYPE)
+    # Si el cliente corta antes de empezar, el generador nunca llega al finally
+    response.call_on_close(close_rows)
+    return response
@@ -1,22 +1,61 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from datetime import datetime
 import os
-from pymongo import MongoClient
+import base64
 from bson import ObjectId
+import pymongo
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import mongo
+from changes import ORDERS_STREAM_RETRY_MS, SSE_MIMETYPE, ChangeHub, TooManyClients, sse_stream
+from common.bulk import bulk_created, bulk_error, bulk_items, bulk_response
+from common.compression import enable_compression
+from common.consumer import EventConsumer
+from common.deadline import enable_deadlines
+from common.events import EVENTS_OUTBOX, EventPublisher, MongoOutbox, OutboxRelay
+from common.http_cache import enable_conditional_get
+from common.idempotency import (IdempotencyError, MongoIdempotencyStore, StoredResponse, idempotency_error,
+                                idempotency_key, replay_response, request_fingerprint)
+from common.json_provider import install_json_provider
+from common.metrics import instrument_flask
+from common.status_cache import StatusCache, wants_exact
+from common.streaming import STREAM_BATCH_SIZE, ndjson_response, wants_ndjson
+from saga import ORDER_SAGA_ENABLED, ORDER_SAGA_QUEUE, PAYMENT_ROUTING_KEYS, PaymentSaga, order_key
 
 app = Flask(__name__)
+# jsonify con orjson: Decimal, datetime y ObjectId sin conversiones previas
+install_json_provider(app)
+# gzip/brotli según Accept-Encoding; antes del ETag para que este se calcule sin comprimir
+enable_compression(app)
+enable_conditional_get(app)
+instrument_flask(app)
+# Las operaciones de MongoDB no sobreviven al plazo de la petición (X-Request-Timeout-Ms)
+enable_deadlines(app, scope=pymongo.timeout)
+
+# Eventos de dominio: publicación en segundo plano, con outbox opcional
+events = EventPublisher('order-service')
+outbox = MongoOutbox(lambda: mongo.get_client()[mongo.DB_NAME].event_outbox) if EVENTS_OUTBOX else None
+outbox_relay = OutboxRelay(outbox, events) if outbox else None
+
+# Respuestas de POST /orders por Idempotency-Key
+idempotency = MongoIdempotencyStore(lambda: mongo.get_client()[mongo.DB_NAME].idempotency_keys)
+
+# Totales de /status reutilizados durante STATUS_CACHE_SECONDS
+status_cache = StatusCache()
+
+# Deltas de pedidos para GET /orders/stream (change stream o bus del proceso)
+order_changes = ChangeHub(lambda: mongo.get_client()[mongo.DB_NAME].orders)
 
-# Configuración de MongoDB
-MONGODB_URL = os.getenv('MONGODB_URL', 'mongodb://localhost:27017/orderdb')
+# Saga de pagos: PaymentCompleted/Failed/Refunded mueven el estado del pedido
+payment_saga = PaymentSaga(lambda: mongo.get_client()[mongo.DB_NAME].orders, order_changes.updated)
+saga_consumer = EventConsumer('order-saga', ORDER_SAGA_QUEUE, PAYMENT_ROUTING_KEYS, payment_saga.apply,
+                              key=order_key, enabled=ORDER_SAGA_ENABLED)
 
 def get_db():
-    """Conexión a MongoDB"""
+    """Base de datos del MongoClient único del proceso (sin ping por petición)"""
     try:
-        client = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=2000)
-        # fuerza conexión real (si no hay mongo, explota aquí)
-        client.admin.command("ping")
-        # selecciona DB explícita
-        return client["orderdb"]
+        return mongo.get_client()[mongo.DB_NAME]
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
         return None
@@ -31,82 +70,215 @@ def init_db():
             if 'orders' not in db.list_collection_names():
                 db.create_collection('orders')
             
-            # Crear índice en user_id
-            db.orders.create_index('user_id')
+            # Índices compuestos para la paginación por cursor y sus filtros
+            db.orders.create_index([('user_id', ASCENDING)] + ORDER_SORT)
+            db.orders.create_index([('status', ASCENDING)] + ORDER_SORT)
+            db.orders.create_index(ORDER_SORT)
+            # El índice simple anterior queda cubierto por el compuesto de user_id
+            if 'user_id_1' in db.orders.index_information():
+                db.orders.drop_index('user_id_1')
+            idempotency.create_indexes()
+            if outbox is not None:
+                outbox.create_indexes()
             print("✅ Order collection initialized successfully")
         except Exception as e:
             print(f"❌ Error initializing MongoDB: {e}")
 
 @app.route('/health', methods=['GET'])
 def health():
-    db = get_db()
-    db_status = 'connected' if db is not None else 'disconnected'
-    status = 'healthy' if db is not None else 'unhealthy'
+    connected = mongo.is_connected()
+    db_status = 'connected' if connected else 'disconnected'
+    status = 'healthy' if connected else 'unhealthy'
 
     return jsonify({
         'status': status,
         'service': 'order-service',
         'database': db_status,
         'timestamp': datetime.utcnow().isoformat()
-    }), (200 if db is not None else 503)
+    }), (200 if connected else 503)
 
 
 @app.route('/status', methods=['GET'])
 def status():
-    """Status endpoint detallado"""
-    db = get_db()
-    order_count = 0
-    
-    if db is not None:
-        try:
-            order_count = db.orders.count_documents({})
-        except:
-            order_count = 0
+    """Status endpoint detallado (?exact=1 para el total exacto)"""
+    exact = wants_exact()
+    try:
+        counts, counts_meta = status_cache.get('exact' if exact else 'estimate', lambda: count_orders(exact))
+    except Exception:
+        counts, counts_meta = {'total_orders': 0, 'source': 'unavailable'}, {}
     
     return jsonify({
         'service': 'order-service',
         'status': 'operational',
         'database': 'MongoDB',
-        'total_orders': order_count,
+        'total_orders': counts['total_orders'],
+        'counts': dict(counts_meta, source=counts['source']),
+        'pool': mongo.pool_stats(),
+        'events': event_stats(),
+        'saga': dict(saga_consumer.stats(), orders=payment_saga.stats()),
+        'stream': order_changes.stats(),
         'timestamp': datetime.utcnow().isoformat(),
         'version': '1.0.0'
     }), 200
 
+def count_orders(exact=False):
+    """estimated_document_count lee los metadatos de la colección en vez de recorrerla"""
+    orders = mongo.get_client()[mongo.DB_NAME].orders
+    if exact:
+        return {'total_orders': orders.count_documents({}), 'source': 'exact'}
+    return {'total_orders': orders.estimated_document_count(), 'source': 'estimate'}
+
+# Paginación por cursor (keyset) sobre (created_at, _id), del más reciente al más antiguo
+DEFAULT_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', '100'))
+MAX_PAGE_SIZE = int(os.getenv('ORDERS_MAX_PAGE_SIZE', '1000'))
+ORDER_FIELDS = ('user_id', 'items', 'total', 'status', 'created_at', 'updated_at')
+ORDER_SORT = [('created_at', DESCENDING), ('_id', DESCENDING)]
+
+
+def encode_cursor(order):
+    """Cursor opaco con la clave de ordenación del último pedido de la página"""
+    created_at = order.get('created_at')
+    key = f"{created_at.isoformat() if created_at else ''}|{order['_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Filtro que devuelve los pedidos posteriores al cursor; ValueError si es inválido"""
+    try:
+        created_at, order_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        order_id = ObjectId(order_id)
+        created_at = datetime.fromisoformat(created_at) if created_at else None
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    # Los pedidos sin created_at (null) van al final en orden descendente
+    if created_at is None:
+        return {'created_at': None, '_id': {'$lt': order_id}}
+    return {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': order_id}},
+        {'created_at': None}
+    ]}
+
+
+def parse_user_id(raw):
+    """user_id puede estar guardado como número o como texto (dashboard)"""
+    values = [raw]
+    if raw.lstrip('-').isdigit():
+        values.append(int(raw))
+    return {'$in': values}
+
+
+def parse_orders_query(args):
+    """Filtro y proyección de Mongo a partir de los query params; ValueError si son inválidos"""
+    query = {}
+    if args.get('user_id'):
+        query['user_id'] = parse_user_id(args['user_id'])
+    if args.get('status'):
+        query['status'] = args['status']
+    if args.get('after'):
+        query.update(decode_cursor(args['after']))
+
+    fields = None
+    projection = None
+    if args.get('fields'):
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in ORDER_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        # created_at siempre se lee: hace falta para construir el cursor
+        projection = {f: 1 for f in fields + ['created_at']}
+    return query, projection, fields
+
+
+def order_to_json(order, fields=None):
+    """Quitar created_at si no se pidió (el ObjectId lo serializa el proveedor JSON)"""
+    if fields is not None and 'created_at' not in fields:
+        order.pop('created_at', None)
+    return order
+
+
 @app.route('/orders', methods=['GET'])
 def get_orders():
-    """Obtener todos los pedidos"""
+    """Obtener pedidos paginados (?limit, ?after, ?user_id, ?status, ?fields, ?stream)"""
+    try:
+        query, projection, fields = parse_orders_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if wants_ndjson():
+        return stream_orders(query, projection, fields)
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
     db = get_db()
     if db is None:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        orders = list(db.orders.find())
-        
-        # Convertir ObjectId a string para JSON
-        for order in orders:
-            order['_id'] = str(order['_id'])
+        # Se pide un elemento extra para saber si hay más páginas
+        orders = list(db.orders.find(query, projection).sort(ORDER_SORT).limit(limit + 1))
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1]) if has_more else None
+
+        if fields is not None:
+            for order in orders:
+                order_to_json(order, fields)
         
         return jsonify({
             'success': True,
             'count': len(orders),
-            'orders': orders
+            'orders': orders,
+            'next_cursor': next_cursor
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+def stream_orders(query, projection, fields):
+    """Exporta todos los pedidos del filtro (sin limit) leyendo por lotes del cursor"""
+    db = get_db()
+    if db is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    cursor = db.orders.find(query, projection).sort(ORDER_SORT).batch_size(STREAM_BATCH_SIZE)
+    transform = (lambda order: order_to_json(order, fields)) if fields is not None else None
+    return ndjson_response(cursor, app.json.dumps, transform=transform)
+
 @app.route('/orders', methods=['POST'])
 def create_order():
-    """Crear nuevo pedido"""
+    """Crear nuevo pedido (con Idempotency-Key, un reintento devuelve el mismo pedido)"""
     data = request.get_json()
     
     if not data or 'user_id' not in data or 'items' not in data:
         return jsonify({
             'error': 'Missing required fields: user_id, items'
         }), 400
+
+    key, error = idempotency_key()
+    if error:
+        return jsonify({'error': error}), 400
     
     db = get_db()
     if db is None:
         return jsonify({'error': 'Database connection failed'}), 500
+
+    claim = None
+    if key is not None:
+        try:
+            claim = idempotency.claim(key, request_fingerprint(data))
+        except IdempotencyError as e:
+            return idempotency_error(e)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        if isinstance(claim, StoredResponse):
+            return replay_response(claim)
     
     try:
         # Crear documento de pedido
@@ -118,20 +290,146 @@ def create_order():
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow()
         }
+        if claim is not None:
+            # Id fijado en la reserva: si se retoma, el pedido no se duplica
+            order['_id'] = claim.resource_id
+
+        try:
+            insert_order(db, order)
+            order_changes.created(order)
+        except DuplicateKeyError:
+            # Un intento anterior con la misma clave llegó a insertarlo
+            if claim is None:
+                raise
+            order = db.orders.find_one({'_id': claim.resource_id})
         
-        result = db.orders.insert_one(order)
-        order['_id'] = str(result.inserted_id)
-        
-        # TODO: Publicar evento OrderCreated en RabbitMQ
-        
-        return jsonify({
+        body = {
             'success': True,
             'message': 'Order created successfully',
             'order': order
-        }), 201
+        }
+        if claim is not None:
+            idempotency.complete(claim, 201, app.json.dumps(body))
+        return jsonify(body), 201
     except Exception as e:
+        if claim is not None:
+            try:
+                idempotency.release(claim)
+            except Exception:
+                pass
         return jsonify({'error': str(e)}), 500
 
+def insert_order(db, order):
+    """Inserta el pedido y publica OrderCreated (o lo deja en el outbox).
+
+    Con outbox en un replica set, pedido y evento van en la misma transacción;
+    un mongod standalone no admite transacciones y el evento se escribe justo
+    después del pedido.
+    """
+    if outbox is None:
+        db.orders.insert_one(order)
+        events.publish('OrderCreated', order)
+        return
+
+    order.setdefault('_id', ObjectId())
+    message = events.message('OrderCreated', order)
+    if mongo.supports_transactions():
+        with mongo.get_client().start_session() as session:
+            with session.start_transaction():
+                db.orders.insert_one(order, session=session)
+                outbox.add(message, session=session)
+    else:
+        db.orders.insert_one(order)
+        outbox.add(message)
+    outbox_relay.notify()
+
+def insert_orders(db, orders):
+    """insert_many sin orden (un pedido que falla no detiene al resto).
+
+    Devuelve {índice: error} de los que no se insertaron. En lote, los eventos
+    del outbox se escriben tras los pedidos, sin transacción.
+    """
+    failed = {}
+    try:
+        db.orders.insert_many(orders, ordered=False)
+    except BulkWriteError as e:
+        failed = {error['index']: error.get('errmsg', 'Write failed')
+                  for error in e.details.get('writeErrors', [])}
+
+    created = [order for index, order in enumerate(orders) if index not in failed]
+    for order in created:
+        order_changes.created(order)
+    if outbox is None:
+        for order in created:
+            events.publish('OrderCreated', order)
+    elif created:
+        outbox.add_many([events.message('OrderCreated', order) for order in created])
+        outbox_relay.notify()
+    return failed
+
+def event_stats():
+    stats = events.stats()
+    if outbox_relay is not None:
+        stats['outbox'] = outbox_relay.stats()
+    return stats
+
+@app.route('/orders/bulk', methods=['POST'])
+def create_orders_bulk():
+    """Crear pedidos en lote con un único insert_many"""
+    items, error = bulk_items(request.get_json(silent=True), 'orders')
+    if error:
+        return jsonify({'error': error}), 400
+
+    db = get_db()
+    if db is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    results = [None] * len(items)
+    orders, positions = [], []
+    now = datetime.utcnow()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'user_id' not in item or 'items' not in item:
+            results[index] = bulk_error(index, 400, 'Missing required fields: user_id, items')
+            continue
+        orders.append({
+            'user_id': item['user_id'],
+            'items': item['items'],
+            'total': item.get('total', 0),
+            'status': 'pending',
+            'created_at': now,
+            'updated_at': now
+        })
+        positions.append(index)
+
+    if orders:
+        try:
+            failed = insert_orders(db, orders)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        for position, (index, order) in enumerate(zip(positions, orders)):
+            if position in failed:
+                results[index] = bulk_error(index, 500, failed[position])
+            else:
+                results[index] = bulk_created(index, str(order['_id']))
+
+    return bulk_response(results)
+
+@app.route('/orders/stream', methods=['GET'])
+def stream_order_changes():
+    """Deltas de pedidos por Server-Sent Events (created/updated/deleted/reset)"""
+    try:
+        subscription = order_changes.subscribe(request.headers.get('Last-Event-ID'))
+    except TooManyClients as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(max(1, ORDERS_STREAM_RETRY_MS // 1000))}
+
+    response = Response(sse_stream(order_changes, subscription, app.json.dumps), mimetype=SSE_MIMETYPE)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Sin buffering en proxies (nginx) para que cada evento salga al instante
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Si el cliente corta antes de empezar, el generador nunca llega al finally
+    response.call_on_close(lambda: order_changes.unsubscribe(subscription))
+    return response
+
 @app.route('/orders/<order_id>', methods=['GET'])
 def get_order(order_id):
     """Obtener pedido por ID"""
@@ -143,7 +441,6 @@ def get_order(order_id):
         order = db.orders.find_one({'_id': ObjectId(order_id)})
         
         if order:
-            order['_id'] = str(order['_id'])
             return jsonify({
                 'success': True,
                 'order': order
@@ -170,17 +467,17 @@ def update_order_status(order_id):
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
+        changes = {
+            'status': data['status'],
+            'updated_at': datetime.utcnow()
+        }
         result = db.orders.update_one(
             {'_id': ObjectId(order_id)},
-            {
-                '$set': {
-                    'status': data['status'],
-                    'updated_at': datetime.utcnow()
-                }
-            }
+            {'$set': changes}
         )
         
         if result.modified_count > 0:
+            order_changes.updated(order_id, changes)
             return jsonify({
                 'success': True,
                 'message': 'Order status updated successfully'
@@ -203,7 +500,10 @@ def root():
         'endpoints': {
             'health': '/health',
             'status': '/status',
-            'orders': '/orders [GET, POST]',
+            'metrics': '/metrics',
+            'orders': '/orders [GET ?limit&after&user_id&status&fields, POST]',
+            'orders_bulk': '/orders/bulk [POST]',
+            'orders_stream': '/orders/stream [GET, text/event-stream]',
             'order_detail': '/orders/<id> [GET]',
             'update_status': '/orders/<id>/status [PUT]'
         }
@@ -211,4 +511,7 @@ def root():
 
 if __name__ == '__main__':
     init_db()
+    if outbox_relay is not None:
+        outbox_relay.start()
+    saga_consumer.start()
     app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""Feed de cambios de pedidos para ``GET /orders/stream`` (Server-Sent Events).
+
+Cada cambio es un delta pequeño (``created``, ``updated`` o ``deleted`` con
+solo los campos que cambiaron) que se reparte a los clientes suscritos en
+lugar de que vuelvan a descargar el listado completo.
+
+Con MongoDB en replica set o sharding los cambios salen de un change stream
+sobre ``orders``, de modo que todos los procesos ven todas las escrituras. En
+un mongod standalone (el de docker-compose) no hay change streams y los
+propios endpoints de escritura publican en el bus del proceso, que solo ve
+sus escrituras.
+
+Los últimos ``ORDERS_STREAM_BACKLOG`` cambios se guardan para que un cliente
+que se reconecta con ``Last-Event-ID`` reciba lo que se perdió. Si ya no
+están (o el id es de otro proceso) recibe ``reset`` y debe recargar.
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+from pymongo.errors import PyMongoError
+
+import mongo
+
+ORDERS_STREAM_BACKLOG = int(os.getenv('ORDERS_STREAM_BACKLOG', '1000'))
+ORDERS_STREAM_QUEUE = int(os.getenv('ORDERS_STREAM_QUEUE', '500'))
+# Cada suscriptor ocupa un hilo de gunicorn mientras está conectado: el tope no
+# pasa de la mitad de los hilos para que el resto siga atendiendo /orders, /health...
+STREAM_THREAD_SHARE = max(1, int(os.getenv('GUNICORN_THREADS', '4')) // 2)
+ORDERS_STREAM_MAX_CLIENTS = min(int(os.getenv('ORDERS_STREAM_MAX_CLIENTS', str(STREAM_THREAD_SHARE))),
+                                STREAM_THREAD_SHARE)
+ORDERS_STREAM_HEARTBEAT = float(os.getenv('ORDERS_STREAM_HEARTBEAT_SECONDS', '15'))
+ORDERS_STREAM_RETRY_MS = int(os.getenv('ORDERS_STREAM_RETRY_MS', '3000'))
+CHANGE_STREAMS_ENABLED = os.getenv('ORDERS_CHANGE_STREAMS', 'true').lower() == 'true'
+
+SSE_MIMETYPE = 'text/event-stream'
+# Campos que viajan en los deltas (los items no los necesita el listado)
+DELTA_FIELDS = ('user_id', 'total', 'status', 'created_at', 'updated_at')
+RESET = 'reset'
+
+
+class TooManyClients(Exception):
+    pass
+
+
+class Change:
+    __slots__ = ('id', 'event', 'data')
+
+    def __init__(self, change_id, event, data):
+        self.id = change_id
+        self.event = event
+        self.data = data
+
+
+def order_delta(order):
+    """Delta ``created``: id y campos del listado."""
+    delta = {field: order[field] for field in DELTA_FIELDS if field in order}
+    delta['_id'] = str(order['_id'])
+    return delta
+
+
+class Subscription:
+    def __init__(self, replay, reset):
+        self.replay = replay
+        self.reset = reset
+        self._queue = queue.Queue(maxsize=ORDERS_STREAM_QUEUE)
+        self.overflowed = False
+
+    def offer(self, change):
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(change)
+        except queue.Full:
+            # Cliente demasiado lento: se descarta su cola y se le pide recargar
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Siguiente cambio, ``RESET`` si se desbordó o None si no hubo nada en ``timeout``."""
+        if self.overflowed:
+            self._drain()
+            self.overflowed = False
+            return RESET
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return RESET if self.overflowed else None
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class ChangeHub:
+    """Bus de cambios del proceso con backlog para reanudar y watcher opcional."""
+
+    def __init__(self, get_collection, backlog=ORDERS_STREAM_BACKLOG,
+                 max_clients=ORDERS_STREAM_MAX_CLIENTS):
+        self._get_collection = get_collection
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._backlog = deque(maxlen=backlog)
+        self._subscribers = set()
+        # Los ids llevan un prefijo por proceso: un id de otro worker no es reanudable
+        self._boot = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self.published = 0
+        self.resets = 0
+        self._watcher = None
+        self._watcher_pid = None
+        self._watching = False
+        self._resume_token = None
+
+    # ---------- publicación ----------
+
+    def _publish(self, event, data):
+        with self._lock:
+            self._seq += 1
+            change = Change(f'{self._boot}-{self._seq}', event, data)
+            self._backlog.append(change)
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for subscription in subscribers:
+            subscription.offer(change)
+
+    def publish_local(self, event, data):
+        """Cambio hecho por este proceso; con change stream activo ya llegará por ahí."""
+        if not self._watching:
+            self._publish(event, data)
+
+    def created(self, order):
+        self.publish_local('created', order_delta(order))
+
+    def updated(self, order_id, fields):
+        self.publish_local('updated', dict(fields, _id=str(order_id)))
+
+    # ---------- suscripción ----------
+
+    def subscribe(self, last_event_id=None):
+        """Nueva suscripción con los cambios posteriores a ``last_event_id``."""
+        self.start()
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                raise TooManyClients(f'Too many stream clients (max {self.max_clients})')
+            replay, reset = self._replay_after(last_event_id)
+            subscription = Subscription(replay, reset)
+            self._subscribers.add(subscription)
+            if reset:
+                self.resets += 1
+        return subscription
+
+    def _replay_after(self, last_event_id):
+        if not last_event_id:
+            return [], False
+        boot, _, seq = last_event_id.partition('-')
+        if boot != self._boot or not seq.isdigit():
+            return [], True
+        seq = int(seq)
+        if seq >= self._seq:
+            return [], False
+        oldest = int(self._backlog[0].id.split('-')[1]) if self._backlog else self._seq + 1
+        if seq + 1 < oldest:
+            return [], True
+        return [change for change in self._backlog if int(change.id.split('-')[1]) > seq], False
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def last_event_id(self):
+        with self._lock:
+            return f'{self._boot}-{self._seq}'
+
+    # ---------- change stream ----------
+
+    def start(self):
+        """Arranca el watcher si MongoDB admite change streams (una vez por proceso)."""
+        if not CHANGE_STREAMS_ENABLED or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        try:
+            # El ping completa el descubrimiento de la topología antes de consultarla
+            mongo.get_client().admin.command('ping')
+            if not mongo.supports_transactions():
+                return
+        except Exception as e:
+            print(f"Change streams unavailable, using in-process feed: {e}")
+            # Se vuelve a intentar con la siguiente suscripción
+            self._watcher_pid = None
+            return
+        self._watching = True
+        self._watcher = threading.Thread(target=self._watch, name='orders-change-stream', daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        backoff = 1.0
+        while True:
+            try:
+                with self._get_collection().watch(pipeline, resume_after=self._resume_token) as stream:
+                    backoff = 1.0
+                    for change in stream:
+                        self._resume_token = stream.resume_token
+                        self._publish_change(change)
+            except PyMongoError as e:
+                print(f"Order change stream interrupted, retrying in {backoff:.0f}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def _publish_change(self, change):
+        operation = change['operationType']
+        order_id = change['documentKey']['_id']
+        if operation == 'insert':
+            self._publish('created', order_delta(change['fullDocument']))
+        elif operation == 'replace':
+            self._publish('updated', order_delta(change['fullDocument']))
+        elif operation == 'update':
+            fields = change.get('updateDescription', {}).get('updatedFields', {})
+            delta = {field: fields[field] for field in DELTA_FIELDS if field in fields}
+            if delta:
+                self._publish('updated', dict(delta, _id=str(order_id)))
+        elif operation == 'delete':
+            self._publish('deleted', {'_id': str(order_id)})
+
+    def stats(self):
+        with self._lock:
+            return {
+                'source': 'change_stream' if self._watching else 'in_process',
+                'clients': len(self._subscribers),
+                'max_clients': self.max_clients,
+                'published': self.published,
+                'backlog': len(self._backlog),
+                'resets': self.resets,
+                'last_event_id': f'{self._boot}-{self._seq}'
+            }
+
+
+def sse_event(event, data, event_id=None):
+    """Un evento SSE; ``data`` ya serializado en una sola línea."""
+    head = f'id: {event_id}\n' if event_id else ''
+    return f'{head}event: {event}\ndata: {data}\n\n'
+
+
+def sse_stream(hub, subscription, dumps):
+    """Generador del cuerpo SSE: reenvío de lo perdido, cambios y heartbeats."""
+    try:
+        yield f'retry: {ORDERS_STREAM_RETRY_MS}\n\n'
+        if subscription.reset:
+            yield sse_event(RESET, '{}', hub.last_event_id())
+        for change in subscription.replay:
+            yield sse_event(change.event, dumps(change.data), change.id)
+        while True:
+            change = subscription.get(ORDERS_STREAM_HEARTBEAT)
+            if change is None:
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                yield ': keep-alive\n\n'
+            elif change is RESET:
+                yield sse_event(RESET, '{}', hub.last_event_id())
+            else:
+                yield sse_event(change.event, dumps(change.data), change.id)
+    finally:
+        hub.unsubscribe(subscription)
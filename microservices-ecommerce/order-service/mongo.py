@@ -0,0 +1,185 @@
+"""Cliente MongoDB único por proceso con pool ajustado y métricas de checkout.
+
+``MongoClient`` ya gestiona internamente un pool de conexiones y hilos de
+monitorización, así que debe crearse una sola vez por proceso y reutilizarse.
+"""
+import atexit
+import os
+import threading
+import time
+
+from pymongo import MongoClient, monitoring
+
+from common.metrics import METRICS_ENABLED, observe_db_call
+
+MONGODB_URL = os.getenv('MONGODB_URL', 'mongodb://localhost:27017/orderdb')
+DB_NAME = os.getenv('MONGODB_DB', 'orderdb')
+MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '5'))
+MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '60000'))
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '2000'))
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Cuenta conexiones y mide la espera de checkout del pool del driver."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.pool_clears = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        # El checkout empieza y termina en el mismo hilo
+        self._local.started = time.monotonic()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        wait = time.monotonic() - started if started is not None else 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.waits += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def connection_checked_in(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connections_created': self.created,
+                'connections_closed': self.closed,
+                'open_connections': self.created - self.closed,
+                'checkouts': self.checked_out,
+                'checkout_failures': self.checkout_failures,
+                'checkout_wait_avg_ms': round(self.wait_total / self.waits * 1000, 3) if self.waits else 0.0,
+                'checkout_wait_max_ms': round(self.wait_max * 1000, 3),
+                'pool_clears': self.pool_clears
+            }
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Duración de cada comando (find, insert...) por colección para /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get('collection')
+        operation = f'{event.command_name} {target}' if isinstance(target, str) else event.command_name
+        with self._lock:
+            self._operations[(event.connection_id, event.request_id)] = operation
+
+    def _finish(self, event, failed):
+        with self._lock:
+            operation = self._operations.pop((event.connection_id, event.request_id), event.command_name)
+        observe_db_call(operation, event.duration_micros / 1e6, failed)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+
+pool_metrics = PoolMetrics()
+command_metrics = CommandMetrics()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Devuelve el MongoClient del proceso, creándolo la primera vez.
+
+    Se recrea tras un fork: los clientes de pymongo no son fork-safe.
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(
+                MONGODB_URL,
+                maxPoolSize=MAX_POOL_SIZE,
+                minPoolSize=MIN_POOL_SIZE,
+                maxIdleTimeMS=MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+                event_listeners=[pool_metrics, command_metrics] if METRICS_ENABLED else [pool_metrics]
+            )
+            _client_pid = os.getpid()
+    return _client
+
+
+def is_connected():
+    """Estado según la topología que ya monitoriza el driver (sin ping extra)."""
+    return get_client().topology_description.has_readable_server()
+
+
+def supports_transactions():
+    """Las transacciones multi-documento requieren replica set o sharding."""
+    return get_client().topology_description.topology_type_name in (
+        'ReplicaSetWithPrimary', 'Sharded', 'LoadBalanced')
+
+
+def pool_stats():
+    stats = pool_metrics.snapshot()
+    stats.update({
+        'max_pool_size': MAX_POOL_SIZE,
+        'min_pool_size': MIN_POOL_SIZE,
+        'max_idle_time_ms': MAX_IDLE_TIME_MS,
+        'topology': _client.topology_description.topology_type_name if _client is not None else 'Unknown'
+    })
+    return stats
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+
+
+atexit.register(close_client)
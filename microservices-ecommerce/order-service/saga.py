@@ -0,0 +1,81 @@
+"""Saga del ciclo de vida del pedido: los eventos de pago mueven su estado.
+
+Payment Service publica ``PaymentCompleted``, ``PaymentFailed`` y
+``PaymentRefunded`` al cambiar el estado de un pago con ``order_ref`` (el
+``_id`` del pedido). Un ``EventConsumer`` en cada worker del Order Service
+los consume de la cola ``ORDER_SAGA_QUEUE`` y aplica la transición del
+pedido, así el cliente ya no tiene que llamar también a
+``PUT /orders/<id>/status``.
+
+Cada transición es un ``update_one`` condicionado al estado de origen:
+aplicar dos veces el mismo evento (entrega al menos una vez) o uno que llega
+tarde no cambia nada. Los eventos del mismo pedido se procesan en orden
+(misma clave en el consumidor), salvo uno que pasa por la cola de reintento.
+"""
+import os
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+
+from common.events import routing_key_for
+
+ORDER_SAGA_ENABLED = os.getenv('ORDER_SAGA_ENABLED', 'true').lower() == 'true'
+ORDER_SAGA_QUEUE = os.getenv('ORDER_SAGA_QUEUE', 'order-service.payments')
+
+# evento -> (estados de origen permitidos, estado destino)
+PAYMENT_TRANSITIONS = {
+    'PaymentCompleted': (('pending', 'payment_failed'), 'paid'),
+    'PaymentFailed': (('pending',), 'payment_failed'),
+    'PaymentRefunded': (('paid', 'shipped', 'delivered'), 'refunded'),
+}
+PAYMENT_ROUTING_KEYS = [routing_key_for(event_type) for event_type in PAYMENT_TRANSITIONS]
+
+
+def order_key(event):
+    """Clave de orden del consumidor: el pedido afectado."""
+    return (event.get('data') or {}).get('order_ref')
+
+
+class PaymentSaga:
+    """Aplica a ``orders`` la transición de cada evento de pago."""
+
+    def __init__(self, get_collection, on_change=None):
+        self._get_collection = get_collection
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self.applied = 0
+        self.skipped = 0
+        self.ignored = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def apply(self, event):
+        """Handler del consumidor; las excepciones (MongoDB caído) provocan reintento."""
+        transition = PAYMENT_TRANSITIONS.get(event.get('event_type'))
+        data = event.get('data') or {}
+        order_ref = data.get('order_ref')
+        if transition is None or not isinstance(order_ref, str) or not ObjectId.is_valid(order_ref):
+            # Pagos sin pedido de Order Service asociado
+            self._count('ignored')
+            return False
+
+        sources, target = transition
+        changes = {'status': target, 'payment_id': data.get('id'), 'updated_at': datetime.utcnow()}
+        result = self._get_collection().update_one(
+            {'_id': ObjectId(order_ref), 'status': {'$in': list(sources)}},
+            {'$set': changes})
+        if result.modified_count == 0:
+            # Ya aplicado, pedido inexistente o transición no permitida desde su estado
+            self._count('skipped')
+            return False
+        self._count('applied')
+        if self._on_change is not None:
+            self._on_change(order_ref, {'status': target, 'updated_at': changes['updated_at']})
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'applied': self.applied, 'skipped': self.skipped, 'ignored': self.ignored}
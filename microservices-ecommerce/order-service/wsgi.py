@@ -0,0 +1,27 @@
+"""Punto de entrada WSGI del Order Service para gunicorn.
+
+    gunicorn -c common/gunicorn_conf.py --bind 0.0.0.0:5002 wsgi:app
+
+Los hooks los invoca ``common/gunicorn_conf.py``.
+"""
+import mongo
+from app import app, events, init_db, outbox_relay, saga_consumer  # noqa: F401
+
+
+def on_starting():
+    # Una sola vez en el master; MongoClient no es fork-safe y se cierra antes del fork
+    init_db()
+    mongo.close_client()
+
+
+def post_worker_init():
+    if outbox_relay is not None:
+        outbox_relay.start()
+    # Cada worker consume de la misma cola (consumidores en competencia)
+    saga_consumer.start()
+
+
+def worker_exit():
+    saga_consumer.close()
+    events.close()
+    mongo.close_client()
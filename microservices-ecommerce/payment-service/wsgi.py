@@ -0,0 +1,25 @@
+"""Punto de entrada WSGI del Payment Service para gunicorn.
+
+    gunicorn -c common/gunicorn_conf.py --bind 0.0.0.0:5003 wsgi:app
+
+Los hooks los invoca ``common/gunicorn_conf.py``.
+"""
+from app import app, db_pool, events, init_db, outbox_relay  # noqa: F401
+
+
+def on_starting():
+    # Una sola vez en el master; sus conexiones no se heredan en los workers
+    init_db()
+    db_pool.close_all()
+
+
+def post_worker_init():
+    db_pool.warm_up()
+    if outbox_relay is not None:
+        outbox_relay.start()
+
+
+def worker_exit():
+    # Envía los eventos pendientes antes de cerrar las conexiones
+    events.close()
+    db_pool.close_all()
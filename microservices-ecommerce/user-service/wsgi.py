@@ -0,0 +1,21 @@
+"""Punto de entrada WSGI del User Service para gunicorn.
+
+    gunicorn -c common/gunicorn_conf.py --bind 0.0.0.0:5001 wsgi:app
+
+Los hooks los invoca ``common/gunicorn_conf.py``.
+"""
+from app import app, db_pool, init_db  # noqa: F401
+
+
+def on_starting():
+    # Una sola vez en el master; sus conexiones no se heredan en los workers
+    init_db()
+    db_pool.close_all()
+
+
+def post_worker_init():
+    db_pool.warm_up()
+
+
+def worker_exit():
+    db_pool.close_all()